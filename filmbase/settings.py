@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -50,7 +51,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'films.routers.PrimaryPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -61,6 +64,11 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'filmbase.urls'
 
+# ASYNC_VIEWS=1 serves the read-heavy pages with the async views of
+# films/async_views.py. It is off by default, also under ASGI: on SQLite
+# the sync views served more requests per second (see bench_asgi).
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', '0') == '1'
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -86,10 +94,56 @@ WSGI_APPLICATION = 'filmbase.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('DATABASE_PATH', BASE_DIR / 'db.sqlite3'),
     }
 }
 
+# DATABASE_PROFILE=production tunes SQLite for concurrent requests. In WAL
+# mode readers are not blocked by a writer. Write transactions take the
+# lock when they begin (BEGIN IMMEDIATE) and wait up to 5 s for it, so they
+# never fail halfway when upgrading a read lock. Connections are kept for
+# 10 minutes instead of being opened for every request.
+DATABASE_PROFILES = {
+    'development': {},
+    'production': {
+        'OPTIONS': {
+            'init_command': (
+                'PRAGMA journal_mode = WAL;'
+                'PRAGMA synchronous = NORMAL;'
+                'PRAGMA cache_size = -65536;'
+                'PRAGMA mmap_size = 268435456;'
+                'PRAGMA temp_store = MEMORY;'
+                'PRAGMA busy_timeout = 5000;'
+            ),
+            'transaction_mode': 'IMMEDIATE',
+        },
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+    },
+}
+
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'development')
+DATABASES['default'].update(DATABASE_PROFILES[DATABASE_PROFILE])
+
+# DATABASE_REPLICAS is a comma-separated list of SQLite files with copies
+# of the database, kept up to date by replication (or 'manage.py
+# replicate'). Reads are spread over them, writes go to 'default'; see
+# films/routers.py.
+DATABASE_REPLICAS = []
+for number, path in enumerate(
+        filter(None, os.environ.get('DATABASE_REPLICAS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'NAME': path,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['films.routers.PrimaryReplicaRouter']
+
+# Seconds a browser reads from the primary after it has written.
+REPLICA_PIN_SECONDS = 15
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -140,3 +194,40 @@ LOGIN_REDIRECT_URL = 'films:home'
 
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+
+# Caches
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+#
+# "pages" holds the anonymous page cache of films/pagecache.py. PAGE_CACHE
+# selects its backend: "locmem" (per process), "file" or "redis" (shared
+# between processes; PAGE_CACHE_LOCATION points at the server). "redis"
+# needs the redis package: pip install -r requirements-redis.txt.
+
+PAGE_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pages',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('PAGE_CACHE_LOCATION',
+                                   BASE_DIR / 'cache' / 'pages'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('PAGE_CACHE_LOCATION',
+                                   'redis://127.0.0.1:6379/1'),
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'pages': PAGE_CACHE_BACKENDS[os.environ.get('PAGE_CACHE', 'locmem')],
+}
+
+PAGE_CACHE_TIMEOUT = 600
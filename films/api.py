@@ -0,0 +1,196 @@
+import json
+from itertools import islice
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import FileField
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_safe
+from .helpers import decode_cursor, encode_cursor
+from .models import Country, Film, Genre, Person, Post
+
+
+def dumps(data):
+    return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False)
+
+
+def error(message, status=400):
+    return JsonResponse({"error": message}, status=status,
+                        json_dumps_params={"ensure_ascii": False})
+
+
+def page_size():
+    return getattr(settings, "API_PAGE_SIZE", 100)
+
+
+def max_page_size():
+    return getattr(settings, "API_MAX_PAGE_SIZE", 10000)
+
+
+def max_ids():
+    return getattr(settings, "API_MAX_IDS", 1000)
+
+
+def parse_ids(request):
+    """Primary keys of ``?ids=1,2,3`` in order without repeats, or None."""
+    value = request.GET.get("ids")
+    if value is None:
+        return None
+    try:
+        ids = list(dict.fromkeys(int(pk) for pk in value.split(",") if pk))
+    except ValueError:
+        raise ValueError("ids must be comma-separated integers")
+    if len(ids) > max_ids():
+        raise ValueError(f"At most {max_ids()} ids per request")
+    return ids
+
+
+def parse_limit(request):
+    try:
+        limit = int(request.GET.get("limit", page_size()))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if not 1 <= limit <= max_page_size():
+        raise ValueError(f"limit must be between 1 and {max_page_size()}")
+    return limit
+
+
+class Resource:
+    """Read-only JSON endpoints of a model.
+
+    Rows are read with ``values()`` restricted to the ``?fields=`` asked
+    for, so no model instances are built and no templates rendered.
+    Foreign keys are given as ids, files as URLs, and many-to-many fields
+    as lists of ids fetched with one query per batch of rows. Lists are
+    ordered by id with an opaque ``cursor`` and streamed while they are
+    read; ``?ids=`` looks up many rows in one query.
+    """
+
+    batch_size = 500
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = {name: model._meta.get_field(name) for name in fields}
+        self.list = require_safe(self.list_view)
+        self.detail = require_safe(self.detail_view)
+
+    def parse_fields(self, request):
+        value = request.GET.get("fields")
+        if not value:
+            return list(self.fields)
+        names = list(dict.fromkeys(name for name in value.split(",")
+                                   if name))
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise ValueError(f"Unknown fields {', '.join(unknown)}; "
+                             f"expected some of {', '.join(self.fields)}")
+        return names
+
+    def queryset(self):
+        return self.model._default_manager.order_by("pk")
+
+    def related(self, field, pks):
+        """Ids of the rows ``field`` links each of ``pks`` to."""
+        through = field.remote_field.through
+        source, target = field.m2m_column_name(), field.m2m_reverse_name()
+        related = {pk: [] for pk in pks}
+        for pk, other in (through.objects.filter(**{f"{source}__in": pks})
+                          .order_by(target).values_list(source, target)):
+            related[pk].append(other)
+        return related
+
+    def serialize(self, queryset, names):
+        """Yields ``(pk, data)`` of the rows of ``queryset``."""
+        fields = [self.fields[name] for name in names]
+        columns = {"pk", *(field.attname for field in fields
+                           if not field.many_to_many)}
+        rows = queryset.values(*columns).iterator(chunk_size=self.batch_size)
+        while batch := list(islice(rows, self.batch_size)):
+            pks = [row["pk"] for row in batch]
+            related = {field.name: self.related(field, pks)
+                       for field in fields if field.many_to_many}
+            for row in batch:
+                data = {}
+                for field in fields:
+                    if field.many_to_many:
+                        data[field.name] = related[field.name][row["pk"]]
+                    elif isinstance(field, FileField):
+                        name = row[field.attname]
+                        data[field.name] = field.storage.url(name) \
+                            if name else None
+                    else:
+                        data[field.name] = row[field.attname]
+                yield row["pk"], data
+
+    def list_view(self, request):
+        try:
+            names = self.parse_fields(request)
+            ids = parse_ids(request)
+            limit = parse_limit(request)
+        except ValueError as e:
+            return error(str(e))
+        if ids is not None:
+            rows = dict(self.serialize(self.queryset().filter(pk__in=ids),
+                                       names))
+            return JsonResponse({"results": [rows[pk] for pk in ids
+                                             if pk in rows]},
+                                json_dumps_params={"ensure_ascii": False})
+        queryset = self.queryset()
+        fields = [(self.model._meta.pk.name, False)]
+        cursor = request.GET.get("cursor")
+        if cursor:
+            decoded = decode_cursor(cursor, self.model, fields)
+            if decoded is None or decoded[0] != "next":
+                return error("Invalid cursor")
+            queryset = queryset.filter(pk__gt=decoded[1][0])
+        rows = self.serialize(queryset[:limit + 1], names)
+        return StreamingHttpResponse(self.stream(request, rows, limit),
+                                     content_type="application/json")
+
+    def stream(self, request, rows, limit):
+        # Rows are sent a batch per chunk, not a write per row.
+        chunk = ['{"results": [']
+        last = None
+        for count, (pk, data) in enumerate(rows):
+            if count == limit:
+                break
+            chunk.append(("," if count else "") + dumps(data))
+            last = pk
+            if len(chunk) >= self.batch_size:
+                yield "".join(chunk)
+                chunk = []
+        else:
+            last = None
+        next_link = None
+        if last is not None:
+            params = request.GET.copy()
+            params["cursor"] = encode_cursor("next", [last])
+            next_link = request.build_absolute_uri(
+                f"{request.path}?{params.urlencode()}")
+        chunk.append('], "next": ' + dumps(next_link) + '}')
+        yield "".join(chunk)
+
+    def detail_view(self, request, id):
+        try:
+            names = self.parse_fields(request)
+        except ValueError as e:
+            return error(str(e))
+        for _, data in self.serialize(self.queryset().filter(pk=id), names):
+            return JsonResponse(data,
+                                json_dumps_params={"ensure_ascii": False})
+        return error("Not found", status=404)
+
+
+films = Resource(Film, [
+    "id", "name", "origin_name", "slogan", "year", "length", "country",
+    "director", "genres", "people", "trailer_url", "cover", "description",
+    "kinopoisk_id", "created_at", "updated_at"])
+people = Resource(Person, [
+    "id", "name", "origin_name", "birthday", "photo", "kinopoisk_id",
+    "film_count", "directed_count", "created_at", "updated_at"])
+genres = Resource(Genre, [
+    "id", "name", "film_count", "created_at", "updated_at"])
+countries = Resource(Country, [
+    "id", "name", "film_count", "created_at", "updated_at"])
+posts = Resource(Post, [
+    "id", "name", "slug", "icon", "author", "comment_count", "created_at",
+    "updated_at"])
@@ -0,0 +1,150 @@
+import asyncio
+from asgiref.sync import sync_to_async
+from django.core.paginator import Paginator
+from django.http import JsonResponse
+from django.shortcuts import aget_object_or_404, render
+from . import conditional
+from .autocomplete import country_index, person_index
+from .facets import film_facets, parse_filters
+from .helpers import apaginate, sort
+from .models import Country, Film, Genre, Person, Post
+from .pagecache import cache_page, list_tag, tag
+from .search import search
+from .similar import similar
+
+# Async versions of the read-heavy views, served under ASGI (see
+# ASYNC_VIEWS in settings). Queries use the async ORM; templates are
+# rendered in a worker thread since rendering may still query lazily.
+
+
+async def fetch(queryset):
+    return [obj async for obj in queryset]
+
+
+def prefetched(instance, name, objects):
+    """Makes ``instance.<name>.all()`` return ``objects`` without a query,
+    as ``prefetch_related`` does."""
+    manager = getattr(instance, name)
+    cache_name = getattr(manager, "prefetch_cache_name", None) \
+        or manager.field.remote_field.cache_name
+    queryset = manager.all()
+    queryset._result_cache = objects
+    queryset._prefetch_done = True
+    if not hasattr(instance, "_prefetched_objects_cache"):
+        instance._prefetched_objects_cache = {}
+    instance._prefetched_objects_cache[cache_name] = queryset
+
+
+async def arender(request, template_name, context):
+    return await sync_to_async(render)(request, template_name, context)
+
+
+@conditional.conditional(conditional.country_list)
+async def country_list(request):
+    countries = await fetch(sort(request, Country.objects.all(),
+                                 ["-film_count", "name"]))
+    return await arender(request, 'films/country/list.html',
+                         {'countries': countries})
+
+
+@conditional.conditional(conditional.genre_list)
+async def genre_list(request):
+    genres = await fetch(sort(request, Genre.objects.all(),
+                              ["-film_count", "name"]))
+    return await arender(request, 'films/genre/list.html',
+                         {'genres': genres})
+
+
+@cache_page
+@conditional.conditional(conditional.film_list)
+async def film_list(request):
+    films = Film.objects.all()
+    query = request.GET.get('query', '')
+    if query:
+        films = search(films, query)
+    filters = parse_filters(request.GET)
+    matches, facets = await film_facets.aquery(filters, query)
+    if filters:
+        films = matches
+    films = await apaginate(request, films)
+    tag(request, list_tag(Film), list_tag(Genre), list_tag(Country), *films)
+    directors = await fetch(
+        Person.objects.filter(pk__in=filters.get("director", ())))
+    return await arender(request, 'films/film/list.html', {
+        'films': films, 'query': query, 'facets': facets,
+        'filters': filters, 'directors': directors})
+
+
+@cache_page
+@conditional.conditional(conditional.film_detail)
+async def film_detail(request, id):
+    # The film, its genres and its actors are independent queries.
+    film, genres, people, similar_films = await asyncio.gather(
+        aget_object_or_404(Film.objects.select_related("country",
+                                                       "director"), id=id),
+        fetch(Genre.objects.filter(film=id)),
+        fetch(Person.objects.filter(film=id)),
+        fetch(similar(id)))
+    prefetched(film, "genres", genres)
+    prefetched(film, "people", people)
+    tag(request, film, film.country, film.director, *genres, *people,
+        *similar_films)
+    return await arender(request, 'films/film/detail.html',
+                         {'film': film, 'similar_films': similar_films})
+
+
+@conditional.conditional(conditional.person_list)
+async def person_list(request):
+    people = Person.objects.all()
+    query = request.GET.get('query', '')
+    if query:
+        people = search(people, query)
+    else:
+        people = sort(request, people, ["-film_count", "name", "id"])
+    people = await apaginate(request, people)
+    return await arender(request, 'films/person/list.html',
+                         {'people': people, 'query': query})
+
+
+@cache_page
+@conditional.conditional(conditional.person_detail)
+async def person_detail(request, id):
+    person, films, directed_films = await asyncio.gather(
+        aget_object_or_404(Person, id=id),
+        fetch(Film.objects.filter(people=id)),
+        fetch(Film.objects.filter(director=id)))
+    prefetched(person, "film_set", films)
+    prefetched(person, "directed_films", directed_films)
+    tag(request, person, list_tag(Film, person), *films, *directed_films)
+    return await arender(request, 'films/person/detail.html',
+                         {'person': person})
+
+
+@conditional.conditional(conditional.post_list)
+async def post_list(request):
+    posts = Post.objects.all()
+    query = request.GET.get('query', '')
+    if query:
+        posts = search(posts, query)
+    posts = await apaginate(request, posts)
+    return await arender(request, 'films/post/list.html',
+                         {'posts': posts, 'query': query})
+
+
+async def autocomplete(request, index, per=10):
+    # The JSON of dal's Select2QuerySetView, which the widgets expect.
+    matches = await index.asearch(request.GET.get('q', ''))
+    page = Paginator(matches, per).get_page(request.GET.get('page'))
+    return JsonResponse({
+        'results': [{'id': str(pk), 'text': name, 'selected_text': name}
+                    for pk, name in page],
+        'pagination': {'more': page.has_next()},
+    })
+
+
+async def person_autocomplete(request):
+    return await autocomplete(request, person_index)
+
+
+async def country_autocomplete(request):
+    return await autocomplete(request, country_index)
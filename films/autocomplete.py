@@ -0,0 +1,178 @@
+import bisect
+import functools
+import heapq
+import threading
+import time
+from array import array
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import F
+from .models import Country, Person
+from .search import normalize
+
+
+def prefix_key(text):
+    return normalize(text).casefold()
+
+
+class PrefixIndex:
+    """Process-local prefix index over ``name`` and ``origin_name``.
+
+    Normalized names are kept in a sorted list with a parallel array of
+    primary keys, so the rows matching a prefix form one contiguous slice
+    found by bisection. Matches are ordered by popularity, the number of
+    films a row belongs to. The index is built on first use, updated from
+    model signals and rebuilt after ``AUTOCOMPLETE_INDEX_TTL`` seconds to
+    pick up rows written by other processes, while searches go on with
+    the previous one.
+    """
+
+    limit = 50
+    memo_threshold = 1000
+
+    def __init__(self, model, popularity):
+        self.model = model
+        self.popularity = popularity
+        self.ttl = getattr(settings, "AUTOCOMPLETE_INDEX_TTL", 600)
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._built_at = None
+        self._changes = None
+        self.keys = []
+        self.pks = array("q")
+        self.rows = {}
+        self._memo = {}
+
+    @staticmethod
+    def row_keys(*texts):
+        return tuple({prefix_key(text) for text in texts if text})
+
+    def read(self):
+        """``(keys, pks, rows)`` of the index, read from the table."""
+        popularity = self.popularity()
+        entries = []
+        rows = {}
+        fields = ["pk", "name"]
+        if hasattr(self.model, "origin_name"):
+            fields.append("origin_name")
+        for pk, name, *origin_name in (self.model.objects.order_by()
+                                       .values_list(*fields)):
+            keys = self.row_keys(name, *origin_name)
+            rows[pk] = (name, popularity.get(pk, 0), keys)
+            entries.extend((key, pk) for key in keys)
+        entries.sort()
+        return ([key for key, _ in entries],
+                array("q", (pk for _, pk in entries)), rows)
+
+    def build(self):
+        # The table is read without holding the lock, so searches go on
+        # with the previous index. Rows written meanwhile may be missing
+        # from what was read; their changes are applied again after it.
+        with self._lock:
+            self._changes = []
+        try:
+            built = self.read()
+        except BaseException:
+            with self._lock:
+                self._changes = None
+            raise
+        with self._lock:
+            self.keys, self.pks, self.rows = built
+            for change in self._changes:
+                change()
+            self._changes = None
+            self._memo = {}
+            self._built_at = time.monotonic()
+
+    def stale(self):
+        return self._built_at is None \
+            or time.monotonic() - self._built_at > self.ttl
+
+    def ensure_built(self):
+        if not self.stale():
+            return
+        # Searches wait for the first build only; later ones use the
+        # previous index while another request rebuilds it.
+        if not self._build_lock.acquire(blocking=self._built_at is None):
+            return
+        try:
+            if self.stale():
+                self.build()
+        finally:
+            self._build_lock.release()
+
+    def search(self, query):
+        """Returns up to ``limit`` ``(pk, name)`` pairs for a prefix."""
+        prefix = prefix_key(query.strip())
+        self.ensure_built()
+        with self._lock:
+            # Results of prefixes matching many rows are memoized until
+            # the next change of the index.
+            if prefix in self._memo:
+                return self._memo[prefix]
+            start = bisect.bisect_left(self.keys, prefix)
+            end = bisect.bisect_left(self.keys, prefix + "\U0010ffff", start)
+            pks = set(self.pks[start:end])
+            top = heapq.nsmallest(
+                self.limit, pks,
+                key=lambda pk: (-self.rows[pk][1], self.rows[pk][0]))
+            result = [(pk, self.rows[pk][0]) for pk in top]
+            if end - start > self.memo_threshold:
+                self._memo[prefix] = result
+            return result
+
+    async def asearch(self, query):
+        """``search`` for async views. Only a stale index, which has to
+        query the database, is searched from a worker thread."""
+        if self.stale():
+            return await sync_to_async(self.search)(query)
+        return self.search(query)
+
+    def _remove(self, pk):
+        row = self.rows.pop(pk, None)
+        if row is None:
+            return
+        for key in row[2]:
+            index = bisect.bisect_left(self.keys, key)
+            while self.pks[index] != pk:
+                index += 1
+            del self.keys[index]
+            del self.pks[index]
+
+    def _update(self, obj):
+        popularity = self.rows.get(obj.pk, (None, 0))[1]
+        self._remove(obj.pk)
+        keys = self.row_keys(obj.name, getattr(obj, "origin_name", None))
+        self.rows[obj.pk] = (obj.name, popularity, keys)
+        for key in keys:
+            index = bisect.bisect_right(self.keys, key)
+            self.keys.insert(index, key)
+            self.pks.insert(index, obj.pk)
+
+    def change(self, method, *args):
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append(functools.partial(method, *args))
+            if self._built_at is None:
+                return
+            method(*args)
+            self._memo = {}
+
+    def update(self, obj):
+        self.change(self._update, obj)
+
+    def remove(self, pk):
+        self.change(self._remove, pk)
+
+
+def person_popularity():
+    return dict(Person.objects.order_by().values_list(
+        "pk", F("film_count") + F("directed_count")))
+
+
+def country_popularity():
+    return dict(Country.objects.order_by().values_list("pk", "film_count"))
+
+
+person_index = PrefixIndex(Person, person_popularity)
+country_index = PrefixIndex(Country, country_popularity)
@@ -0,0 +1,174 @@
+import functools
+import hashlib
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.db.models import (Count, DateTimeField, F, FloatField, Max,
+                              Sum, Value)
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from . import pagecache
+from .models import (Comment, Country, Film, Genre, Person, Post, Section,
+                     SimilarFilm)
+
+# Pages are validated before they are rendered. The ETag of a page hashes
+# a state computed without rendering it: max(updated_at), count and sum of
+# ids of the rows a detail page shows, or the page cache versions of the
+# tables a list shows. It also covers the user, whose pages differ, and a
+# site version that changes whenever the page cache is cleared, e.g. after
+# a bulk import or new thumbnails.
+
+
+def summary(name, queryset, updated_at=None, ids=None):
+    """``(name, max(updated_at), count, sum of ids)`` of ``queryset``;
+    ``updated_at`` and ``ids`` replace the expressions of the last two."""
+    if updated_at is None:
+        updated_at = Max("updated_at")
+    if ids is None:
+        ids = Sum("pk")
+    return (queryset.order_by().annotate(part=Value(name)).values("part")
+            .annotate(updated_at=updated_at, count=Count("pk"), ids=ids)
+            .values_list("part", "updated_at", "count", "ids"))
+
+
+def updated(*summaries, **querysets):
+    """State of the rows of ``querysets`` and of ``summaries`` made by
+    ``summary``, and their last modification, read with one query. Counts
+    and sums of ids tell removed rows."""
+    parts = [*summaries, *(summary(name, queryset)
+                           for name, queryset in querysets.items())]
+    rows = sorted(parts[0].union(*parts[1:], all=True))
+    return rows, max((row[1] for row in rows if row[1]), default=None)
+
+
+def versions(*items):
+    """State of the page cache tags of ``items``, as given to
+    ``pagecache.tag``: list tags count as per-table version counters.
+    There is no modification time."""
+    tags = [item if isinstance(item, str) else pagecache.object_tag(item)
+            for item in items]
+    return sorted(pagecache.current_versions(tags).items()), None
+
+
+def etag(request, state):
+    # Anonymous pages are the same for everyone, see pagecache. Pages of
+    # users carry a CSRF token, whose cookie changes when they log in.
+    user = None
+    if request.user.is_authenticated:
+        user = (request.user.pk,
+                request.COOKIES.get(settings.CSRF_COOKIE_NAME, ""))
+    site = pagecache.current_versions(["site"])
+    data = repr((sorted(site.items()), user, state)).encode()
+    return quote_etag(hashlib.sha1(data).hexdigest())
+
+
+def validate(request, validator, args, kwargs):
+    """``(etag, last modified)`` of the page, and a 304 response if the
+    client has it; None if the page is not validated."""
+    if request.method not in ("GET", "HEAD") \
+            or len(messages.get_messages(request)):
+        return None
+    state, last_modified = validator(request, *args, **kwargs)
+    last_modified = int(last_modified.timestamp()) if last_modified \
+        else None
+    tag = etag(request, state)
+    return tag, last_modified, get_conditional_response(
+        request, etag=tag, last_modified=last_modified)
+
+
+def add_headers(response, validated):
+    if validated is not None and response.status_code == 200:
+        tag, last_modified, _ = validated
+        response.headers.setdefault("ETag", tag)
+        if last_modified is not None:
+            response.headers.setdefault("Last-Modified",
+                                        http_date(last_modified))
+    return response
+
+
+def conditional(validator):
+    """Answers conditional GET requests for pages of ``view`` with 304
+    without running it, when ``validator(request, *args, **kwargs)``
+    returns the ``(state, last modified)`` of an unchanged page. ``view``
+    may be a coroutine function."""
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                validated = await sync_to_async(validate)(
+                    request, validator, args, kwargs)
+                if validated is not None and validated[2] is not None:
+                    return validated[2]
+                return add_headers(await view(request, *args, **kwargs),
+                                   validated)
+            return async_wrapper
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            validated = validate(request, validator, args, kwargs)
+            if validated is not None and validated[2] is not None:
+                return validated[2]
+            return add_headers(view(request, *args, **kwargs), validated)
+        return wrapper
+    return decorator
+
+
+def film_detail(request, id):
+    # build_similar may reorder the same similar films, changing only
+    # their scores, which have no updated_at of their own.
+    scores = summary("scores", SimilarFilm.objects.filter(film=id),
+                     updated_at=Value(None, output_field=DateTimeField()),
+                     ids=Sum(F("similar_id") * F("score"),
+                             output_field=FloatField()))
+    return updated(scores, film=Film.objects.filter(pk=id),
+                   country=Country.objects.filter(film=id),
+                   director=Person.objects.filter(directed_films=id),
+                   genres=Genre.objects.filter(film=id),
+                   people=Person.objects.filter(film=id),
+                   similar=Film.objects.filter(similar_to__film=id))
+
+
+def person_detail(request, id):
+    return updated(person=Person.objects.filter(pk=id),
+                   films=Film.objects.filter(people=id),
+                   directed_films=Film.objects.filter(director=id))
+
+
+def post_detail(request, id):
+    return updated(post=Post.objects.filter(pk=id),
+                   sections=Section.objects.filter(post=id),
+                   comments=Comment.objects.filter(post=id))
+
+
+def film_list(request):
+    # Facets show the names of genres and countries.
+    return versions(pagecache.list_tag(Film), pagecache.list_tag(Genre),
+                    pagecache.list_tag(Country))
+
+
+def person_list(request):
+    return versions(pagecache.list_tag(Person))
+
+
+def post_list(request):
+    return versions(pagecache.list_tag(Post))
+
+
+def country_list(request):
+    return versions(pagecache.list_tag(Country))
+
+
+def genre_list(request):
+    return versions(pagecache.list_tag(Genre))
+
+
+def country_detail(request, id):
+    country = Country(pk=id)
+    return versions(country, pagecache.list_tag(Film),
+                    pagecache.list_tag(Film, country))
+
+
+def genre_detail(request, id):
+    genre = Genre(pk=id)
+    return versions(genre, pagecache.list_tag(Film),
+                    pagecache.list_tag(Film, genre))
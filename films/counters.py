@@ -0,0 +1,41 @@
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import Comment, Country, Film, Genre, Person, Post
+
+# Counter columns as (model, counter, rows counted, column of the rows
+# pointing to the model). Signals keep them up to date with F() updates,
+# see films/signals.py; bulk writes, which send no signals, and anything
+# else that lets them drift are repaired by ``recount``.
+COUNTERS = [
+    (Country, "film_count", Film.objects, "country"),
+    (Genre, "film_count", Film.genres.through.objects, "genre"),
+    (Person, "film_count", Film.people.through.objects, "person"),
+    (Person, "directed_count", Film.objects, "director"),
+    (Post, "comment_count", Comment.objects, "post"),
+]
+
+
+def count(rows, column):
+    """Number of ``rows`` pointing to the outer row, as an expression."""
+    counted = (rows.filter(**{column: OuterRef("pk")}).order_by()
+               .values(column).annotate(count=Count("*")).values("count"))
+    return Coalesce(Subquery(counted), 0)
+
+
+def recount(now=None):
+    """Sets every counter to the number of rows it counts, with one
+    UPDATE per counter touching only the rows that have drifted. Returns
+    the number of rows fixed per ``model.counter``. Fixed rows are marked
+    updated at ``now``, the current time by default."""
+    if now is None:
+        now = timezone.now()
+    fixed = {}
+    with transaction.atomic():
+        for model, counter, rows, column in COUNTERS:
+            expression = count(rows, column)
+            fixed[f"{model._meta.model_name}.{counter}"] = (
+                model.objects.exclude(**{counter: expression})
+                .update(**{counter: expression}, updated_at=now))
+    return fixed
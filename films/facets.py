@@ -0,0 +1,446 @@
+import functools
+import threading
+import time
+from array import array
+from collections import defaultdict
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .models import Country, Film, Genre
+from .search import search
+
+# Facets with counts, in the order they are shown.
+FACETS = ("genre", "country", "decade")
+
+
+def bitset(positions):
+    """Python int with the bits at ``positions`` set, built in a
+    bytearray instead of shifting a growing int for every position."""
+    positions = list(positions)
+    if not positions:
+        return 0
+    data = bytearray(max(positions) // 8 + 1)
+    for position in positions:
+        data[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(data, "little")
+
+
+def nth_bit(bits, n):
+    """Position of the set bit of ``bits`` preceded by ``n`` others."""
+    low, high = 0, bits.bit_length()
+    while low < high:
+        middle = (low + high) // 2
+        if (bits & ((2 << middle) - 1)).bit_count() > n:
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+def positions(bits, start, stop):
+    """Positions of the ``start``-th to ``stop``-th set bits of ``bits``."""
+    if start >= bits.bit_count():
+        return []
+    offset = nth_bit(bits, start)
+    bits >>= offset
+    result = []
+    while bits and len(result) < stop - start:
+        result.append(offset + (bits & -bits).bit_length() - 1)
+        bits &= bits - 1
+    return result
+
+
+def parse_filters(params):
+    """Facet filters of a film list query string as ``{facet: values}``;
+    malformed values are ignored. ``length`` is a ``(min, max)`` pair."""
+    filters = {}
+    for name in ("genre", "country", "decade", "director"):
+        values = set()
+        for value in params.getlist(name):
+            try:
+                values.add(int(value))
+            except ValueError:
+                pass
+        if values:
+            filters[name] = values
+    length = []
+    for name in ("length_min", "length_max"):
+        try:
+            length.append(int(params.get(name, "")))
+        except ValueError:
+            length.append(None)
+    if length != [None, None]:
+        filters["length"] = tuple(length)
+    return filters
+
+
+class Matches:
+    """Films of a bitset in the order of their compact ids.
+
+    A sequence for ``Paginator``: ``count()`` is a popcount and slicing
+    fetches only the films of the slice.
+    """
+
+    def __init__(self, pks, bits):
+        self.pks = pks
+        self.bits = bits
+
+    def count(self):
+        return self.bits.bit_count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop, _ = index.indices(self.count())
+        pks = [self.pks[position]
+               for position in positions(self.bits, start, stop)]
+        films = Film.objects.in_bulk(pks)
+        return [films[pk] for pk in pks if pk in films]
+
+
+class FacetIndex:
+    """Process-local bitmap index of films for faceted browsing.
+
+    Films get compact ids in the order of the film list, (name, id), and
+    every genre, country, year and length maps to a bitset: a Python int
+    with the bit of each of its films set. Filters and facet counts are
+    then a few ANDs, ORs and popcounts over ints of one bit per film.
+    Directors, too many for a bitset each, map to sets of compact ids.
+
+    Like ``PrefixIndex`` the index is built on first use, updated from
+    model signals and rebuilt after ``FACET_INDEX_TTL`` seconds to pick up
+    rows written by other processes, while queries go on with the previous
+    one. Films added since the build come last until then.
+    """
+
+    country_choices = 12
+    memo_size = 1000
+
+    def __init__(self):
+        self.ttl = getattr(settings, "FACET_INDEX_TTL", 600)
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._built_at = None
+        self._changes = None
+        self.pks = array("q")
+        self.ids = {}
+        self.rows = []
+        self.all = 0
+        self.bitsets = {}
+        self.directors = {}
+        self.names = {}
+        self._memo = {}
+
+    @staticmethod
+    def values(row):
+        country, _, year, length, genres = row
+        yield "country", country
+        if year is not None:
+            yield "year", year
+        if length is not None:
+            yield "length", length
+        for genre in genres:
+            yield "genre", genre
+
+    def read(self):
+        """``(pks, ids, rows, bitsets, directors, names)`` of the index,
+        read from the tables."""
+        genres = defaultdict(set)
+        for film, genre in (Film.genres.through.objects.order_by()
+                            .values_list("film_id", "genre_id")):
+            genres[film].add(genre)
+        # Films share few combinations of genres; each is kept once.
+        combinations = {}
+        pks = array("q")
+        ids = {}
+        rows = []
+        members = {facet: defaultdict(list)
+                   for facet in ("genre", "country", "year", "length")}
+        directors = defaultdict(set)
+        for id, (pk, country, director, year, length) in enumerate(
+                Film.objects.order_by("name", "id").values_list(
+                    "pk", "country_id", "director_id", "year", "length")):
+            film_genres = frozenset(genres.pop(pk, ()))
+            film_genres = combinations.setdefault(film_genres, film_genres)
+            pks.append(pk)
+            ids[pk] = id
+            rows.append((country, director, year, length, film_genres))
+            members["country"][country].append(id)
+            if year is not None:
+                members["year"][year].append(id)
+            if length is not None:
+                members["length"][length].append(id)
+            for genre in film_genres:
+                members["genre"][genre].append(id)
+            directors[director].add(id)
+        bitsets = {facet: {value: bitset(positions)
+                           for value, positions in values.items()}
+                   for facet, values in members.items()}
+        names = {
+            "genre": dict(Genre.objects.values_list("pk", "name")),
+            "country": dict(Country.objects.values_list("pk", "name")),
+        }
+        return pks, ids, rows, bitsets, dict(directors), names
+
+    def build(self):
+        # As in PrefixIndex, the tables are read without holding the lock,
+        # so queries and writes go on with the previous index. Films
+        # written meanwhile may be missing from what was read; their
+        # changes are applied again after it.
+        with self._lock:
+            self._changes = []
+        try:
+            built = self.read()
+        except BaseException:
+            with self._lock:
+                self._changes = None
+            raise
+        with self._lock:
+            (self.pks, self.ids, self.rows, self.bitsets, self.directors,
+             self.names) = built
+            self.all = (1 << len(self.pks)) - 1
+            for change in self._changes:
+                change()
+            self._changes = None
+            self._memo = {}
+            self._built_at = time.monotonic()
+
+    def stale(self):
+        return self._built_at is None \
+            or time.monotonic() - self._built_at > self.ttl
+
+    def ensure_built(self):
+        if not self.stale():
+            return
+        # Queries wait for the first build only; later ones use the
+        # previous index while another request rebuilds it.
+        if not self._build_lock.acquire(blocking=self._built_at is None):
+            return
+        try:
+            if self.stale():
+                self.build()
+        finally:
+            self._build_lock.release()
+
+    def mask(self, facet, values):
+        """Bitset of the films matching any of ``values`` of ``facet``."""
+        if facet == "director":
+            return bitset(id for director in values
+                          for id in self.directors.get(director, ()))
+        if facet == "decade":
+            facet, values = "year", [year for year in self.bitsets["year"]
+                                     if year // 10 * 10 in values]
+        elif facet == "length":
+            low, high = values
+            values = [length for length in self.bitsets["length"]
+                      if (low is None or length >= low)
+                      and (high is None or length <= high)]
+        bitsets = self.bitsets[facet]
+        mask = 0
+        for value in values:
+            mask |= bitsets.get(value, 0)
+        return mask
+
+    def counts(self, facet, within):
+        if facet == "decade":
+            bitsets = defaultdict(int)
+            for year, bits in self.bitsets["year"].items():
+                bitsets[year // 10 * 10] |= bits
+        else:
+            bitsets = self.bitsets[facet]
+        counts = {}
+        for value, bits in bitsets.items():
+            count = (bits & within).bit_count()
+            if count:
+                counts[value] = count
+        return counts
+
+    def remember(self, key, value):
+        if len(self._memo) >= self.memo_size:
+            self._memo = {}
+        self._memo[key] = value
+        return value
+
+    def search_bits(self, query):
+        """``(bits, ids)``: the bitset of the films matching the full-text
+        search ``query`` and the compact ids it was built with. Matches
+        are read outside the lock and memoized like query results."""
+        key = ("search", query)
+        self.ensure_built()
+        with self._lock:
+            if key in self._memo:
+                return self._memo[key], self.ids
+            memo, ids = self._memo, self.ids
+        pks = (search(Film.objects.all(), query).order_by()
+               .values_list("pk", flat=True))
+        bits = bitset(ids[pk] for pk in pks if pk in ids)
+        with self._lock:
+            # Any change replaces the memo; the bits may miss it then.
+            if self._memo is memo:
+                self.remember(key, bits)
+        return bits, ids
+
+    def query(self, filters, search=None):
+        """``(matches, facets)`` of the films matching the full-text
+        ``search``, or all films, and ``filters`` as given by
+        ``parse_filters``: any of the values of a facet and every facet.
+        ``facets`` holds the choices of each facet with the number of
+        films they would match."""
+        while True:
+            bits, ids = self.search_bits(search) if search \
+                else (None, None)
+            self.ensure_built()
+            with self._lock:
+                # A rebuild renumbers the films, so the search is read
+                # again.
+                if ids is None or ids is self.ids:
+                    return self._query(filters, search, bits)
+
+    def _query(self, filters, search, bits):
+        # Results are memoized until the next change of the index; pages
+        # of a query ask for it again.
+        key = ("query", search, frozenset(
+            (facet, frozenset(values) if isinstance(values, set) else values)
+            for facet, values in filters.items()))
+        if key in self._memo:
+            return self._memo[key]
+        base = self.all if bits is None else self.all & bits
+        masks = {facet: self.mask(facet, values)
+                 for facet, values in filters.items()}
+        matches = base
+        for mask in masks.values():
+            matches &= mask
+        facets = {}
+        for facet in FACETS:
+            # Counts of a facet apply the filters of the others only,
+            # since its own values add to each other.
+            within = base
+            for name, mask in masks.items():
+                if name != facet:
+                    within &= mask
+            facets[facet] = self.choices(
+                facet, self.counts(facet, within),
+                filters.get(facet, set()))
+        return self.remember(key, (Matches(self.pks, matches), facets))
+
+    async def aquery(self, filters, search=None):
+        """``query`` for async views. A stale index, which has to query
+        the database, and searches not memoized run in a worker thread."""
+        if self.stale() or search and ("search", search) not in self._memo:
+            return await sync_to_async(self.query)(filters, search)
+        return self.query(filters, search)
+
+    def choices(self, facet, counts, selected):
+        """``(value, label, count, selected)`` of the values of ``facet``
+        worth showing: those matching films and those selected."""
+        values = set(counts) | selected
+        if facet == "decade":
+            return [(value, f"{value}-е", counts.get(value, 0),
+                     value in selected)
+                    for value in sorted(values, reverse=True)]
+        names = self.names[facet]
+        choices = sorted(
+            ((value, names[value], counts.get(value, 0), value in selected)
+             for value in values if value in names),
+            key=lambda choice: (-choice[2], choice[1]))
+        if facet == "country":
+            choices = [choice for number, choice in enumerate(choices)
+                       if number < self.country_choices or choice[3]]
+        return choices
+
+    def _set(self, id, row):
+        bit = 1 << id
+        for facet, value in self.values(row):
+            bitsets = self.bitsets[facet]
+            bitsets[value] = bitsets.get(value, 0) | bit
+        self.directors.setdefault(row[1], set()).add(id)
+        self.rows[id] = row
+
+    def _unset(self, id):
+        row = self.rows[id]
+        bit = 1 << id
+        for facet, value in self.values(row):
+            bitsets = self.bitsets[facet]
+            bitsets[value] &= ~bit
+            if not bitsets[value]:
+                del bitsets[value]
+        self.directors[row[1]].discard(id)
+        if not self.directors[row[1]]:
+            del self.directors[row[1]]
+        self.rows[id] = None
+
+    def _update(self, pk, country, director, year, length):
+        id = self.ids.get(pk)
+        if id is None:
+            id = len(self.pks)
+            self.pks.append(pk)
+            self.ids[pk] = id
+            self.rows.append(None)
+            self.all |= 1 << id
+            genres = frozenset()
+        else:
+            genres = self.rows[id][4]
+            self._unset(id)
+        self._set(id, (country, director, year, length, genres))
+
+    def _remove(self, pk):
+        if pk not in self.ids:
+            return
+        id = self.ids.pop(pk)
+        self._unset(id)
+        self.all &= ~(1 << id)
+
+    def _link(self, film_pks, genre_pks, linked):
+        for pk in film_pks:
+            id = self.ids.get(pk)
+            if id is None:
+                continue
+            *row, genres = self.rows[id]
+            self._unset(id)
+            genres = genres | genre_pks if linked else genres - genre_pks
+            self._set(id, (*row, frozenset(genres)))
+
+    def _rename(self, facet, pk, name):
+        self.names[facet][pk] = name
+
+    def _remove_choice(self, facet, pk):
+        self.names[facet].pop(pk, None)
+        bits = self.bitsets[facet].get(pk, 0) if facet == "genre" else 0
+        self._link([self.pks[id] for id in positions(bits, 0,
+                                                     bits.bit_count())],
+                   {pk}, linked=False)
+
+    def change(self, method, *args):
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append(functools.partial(method, *args))
+            if self._built_at is None:
+                return
+            method(*args)
+            self._memo = {}
+
+    def update(self, film):
+        self.change(self._update, film.pk, film.country_id, film.director_id,
+                    film.year, film.length)
+
+    def remove(self, pk):
+        self.change(self._remove, pk)
+
+    def link(self, film_pks, genre_pks, linked=True):
+        """Adds ``genre_pks`` to the genres of the films ``film_pks``, or
+        removes them if not ``linked``."""
+        self.change(self._link, list(film_pks), set(genre_pks), linked)
+
+    def rename(self, facet, pk, name):
+        self.change(self._rename, facet, pk, name)
+
+    def remove_choice(self, facet, pk):
+        """Forgets a deleted genre or country. Films of a country are
+        deleted with it; rows of the through table of a genre go without
+        m2m_changed."""
+        self.change(self._remove_choice, facet, pk)
+
+
+film_facets = FacetIndex()
@@ -1,7 +1,177 @@
+import base64
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+import markdown
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.db.models import Q
+
+
+class CursorPage:
+    """One page of a keyset-paginated queryset.
+
+    Iterates like ``django.core.paginator.Page``; instead of page numbers
+    it carries query strings of the neighbouring pages, which hold an
+    opaque ``cursor`` parameter.
+    """
+
+    is_cursor = True
+
+    def __init__(self, object_list, previous_link=None, next_link=None,
+                 first_link=None):
+        self.object_list = object_list
+        self.previous_link = previous_link
+        self.next_link = next_link
+        self.first_link = first_link
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_link is not None
+
+    def has_previous(self):
+        return self.previous_link is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def keyset_fields(collection):
+    """Ordering of ``collection`` as ``(name, descending)`` pairs ending
+    with the primary key, or None if it cannot be used as a keyset."""
+    query = getattr(collection, "query", None)
+    if query is None:
+        return None
+    opts = collection.model._meta
+    ordering = query.order_by or opts.ordering
+    fields = []
+    for name in ordering:
+        if not isinstance(name, str) or "__" in name:
+            return None
+        descending = name.startswith("-")
+        name = name.lstrip("-")
+        if name in query.annotations:
+            return None
+        if name == "pk":
+            name = opts.pk.name
+        field = opts.get_field(name)
+        if field.null or field.is_relation:
+            return None
+        fields.append((name, descending))
+        if field.primary_key:
+            return fields
+    return fields + [(opts.pk.name, False)]
+
+
+def encode_cursor(direction, values):
+    values = [value.isoformat() if hasattr(value, "isoformat") else value
+              for value in values]
+    data = json.dumps([direction, values])
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, model, fields):
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        direction, values = json.loads(data)
+        if direction not in ("next", "previous") \
+                or len(values) != len(fields):
+            return None
+        values = [model._meta.get_field(name).to_python(value)
+                  for (name, _), value in zip(fields, values)]
+        # Keyset fields are never null.
+        if None in values:
+            return None
+        return direction, values
+    except (ValueError, TypeError, ValidationError):
+        return None
+
+
+def after(fields, values, backwards):
+    # (a, b) > (x, y) is written as a > x OR (a = x AND b > y).
+    condition = Q()
+    for i, (name, descending) in enumerate(fields):
+        lookup = "lt" if descending != backwards else "gt"
+        equal = {fields[j][0]: values[j] for j in range(i)}
+        condition |= Q(**equal, **{f"{name}__{lookup}": values[i]})
+    return condition
+
+
+class CursorQuery:
+    """Query of one keyset page; ``page`` turns the fetched ``rows`` into
+    a ``CursorPage``."""
+
+    def __init__(self, request, collection, fields, per):
+        self.fields = fields
+        self.per = per
+        self.params = request.GET.copy()
+        self.params.pop("page", None)
+        self.params.pop("cursor", None)
+        self.first_link = "?" + self.params.urlencode()
+        cursor = decode_cursor(request.GET.get("cursor", ""),
+                               collection.model, fields)
+        self.after_cursor = cursor is not None
+        self.backwards = cursor is not None and cursor[0] == "previous"
+        ordering = [("-" if descending != self.backwards else "") + name
+                    for name, descending in fields]
+        rows = collection.order_by(*ordering)
+        if cursor is not None:
+            rows = rows.filter(after(fields, cursor[1], self.backwards))
+        self.rows = rows[:per + 1]
+
+    def link(self, direction, obj):
+        values = [getattr(obj, name) for name, _ in self.fields]
+        self.params["cursor"] = encode_cursor(direction, values)
+        return "?" + self.params.urlencode()
+
+    def page(self, rows):
+        more = len(rows) > self.per
+        rows = rows[:self.per]
+        if self.backwards:
+            rows.reverse()
+        if not rows:
+            return CursorPage(rows, first_link=self.first_link)
+        has_previous = more if self.backwards else self.after_cursor
+        has_next = True if self.backwards else more
+        return CursorPage(
+            rows,
+            previous_link=self.link("previous", rows[0])
+            if has_previous else None,
+            next_link=self.link("next", rows[-1]) if has_next else None,
+            first_link=self.first_link)
+
+
+def cursor_paginate(request, collection, fields, per):
+    query = CursorQuery(request, collection, fields, per)
+    return query.page(list(query.rows))
+
+
+def sort(request, queryset, popular):
+    """Orders ``queryset`` by ``popular``, fields of maintained counters,
+    for ``?sort=popular``; by its own ordering otherwise."""
+    if request.GET.get("sort") == "popular":
+        return queryset.order_by(*popular)
+    return queryset
 
 
 def paginate(request, collection, per=12):
+    # Keyset pagination skips COUNT(*) and OFFSET, so every page costs the
+    # same. Numbered ?page= links and querysets ordered by something other
+    # than plain columns (e.g. search rank) still use Paginator.
+    fields = keyset_fields(collection)
+    if fields is not None and "page" not in request.GET:
+        return cursor_paginate(request, collection, fields, per)
     paginator = Paginator(collection, per)
     page = request.GET.get('page')
     try:
@@ -11,3 +181,44 @@ def paginate(request, collection, per=12):
     except EmptyPage:
         collection = paginator.page(paginator.num_pages)
     return collection
+
+
+async def apaginate(request, collection, per=12):
+    """``paginate`` for async views; keyset pages use the async ORM."""
+    fields = keyset_fields(collection)
+    if fields is not None and "page" not in request.GET:
+        query = CursorQuery(request, collection, fields, per)
+        return query.page([row async for row in query.rows])
+
+    def page():
+        page = paginate(request, collection, per)
+        page.object_list = list(page.object_list)
+        return page
+    return await sync_to_async(page)()
+
+
+_markdown_cache = OrderedDict()
+_markdown_lock = threading.Lock()
+
+
+def markdown_extensions():
+    return getattr(settings, "MARKDOWN_EXTENSIONS", [])
+
+
+def render_markdown(text):
+    """Renders Markdown to HTML through an LRU cache keyed by the hash of
+    the text, so repeated previews of the same body are rendered once."""
+    text = text or ""
+    extensions = markdown_extensions()
+    key = hashlib.sha1("\0".join([*extensions, text]).encode()).hexdigest()
+    with _markdown_lock:
+        if key in _markdown_cache:
+            _markdown_cache.move_to_end(key)
+            return _markdown_cache[key]
+    html = markdown.markdown(text, extensions=extensions)
+    with _markdown_lock:
+        _markdown_cache[key] = html
+        if len(_markdown_cache) > getattr(settings, "MARKDOWN_CACHE_SIZE",
+                                          512):
+            _markdown_cache.popitem(last=False)
+    return html
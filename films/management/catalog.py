@@ -0,0 +1,346 @@
+import datetime
+import importlib
+import itertools
+import math
+import random
+import time
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from films.counters import recount
+from films.models import (Country, Genre, Person, Film, Post, Section,
+                          Comment)
+
+SYLLABLES = ["ан", "бер", "вел", "гор", "дан", "ер", "жан", "зор", "ил",
+             "кар", "лен", "мир", "нор", "ол", "пет", "рос", "сан", "тим",
+             "ур", "фед", "хан", "чер", "шил", "юр", "ярс"]
+LATIN = ["an", "ber", "vel", "gor", "dan", "er", "zhan", "zor", "il", "kar",
+         "len", "mir", "nor", "ol", "pet", "ros", "san", "tim", "ur", "fed",
+         "han", "cher", "shil", "yur", "yars"]
+GENRES = ["драма", "комедия", "боевик", "триллер", "мелодрама", "ужасы",
+          "фантастика", "фэнтези", "детектив", "криминал", "приключения",
+          "мультфильм", "документальный", "биография", "военный", "история",
+          "вестерн", "мюзикл", "семейный", "спорт", "аниме", "короткометражка"]
+
+# Dates of the catalog are counted back from a fixed moment instead of the
+# current time, so a seed produces the same rows on any day.
+EPOCH = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+
+# Full-text indexes filled by insert triggers of migration 0005. Seeding
+# drops the triggers and indexes the new rows with one query at the end.
+search_index = importlib.import_module("films.migrations.0005_search_index")
+FTS_COLUMNS = {
+    "films_film": ["name", "origin_name", "slogan", "description"],
+    "films_person": ["name", "origin_name"],
+}
+
+
+def word(rng, syllables=None, parts=(2, 4)):
+    indexes = [rng.randrange(len(SYLLABLES))
+               for _ in range(rng.randint(*parts))]
+    if syllables is None:
+        syllables = SYLLABLES
+    return "".join(syllables[i] for i in indexes).capitalize()
+
+
+def sentence(rng, words):
+    return " ".join(word(rng).lower() for _ in range(words)).capitalize()
+
+
+def zipf_weights(count, exponent, offset=100):
+    """Cumulative Zipf-Mandelbrot weights of ranks 1..count for
+    ``random.choices``. The offset flattens the head, so the most popular
+    actor is not cast in every other film."""
+    return list(itertools.accumulate(1 / (rank + offset) ** exponent
+                                     for rank in range(1, count + 1)))
+
+
+def insert(model, fields, rows):
+    """Writes ``rows``, tuples of values of ``fields``, with one
+    ``executemany``. Values must already be adapted for the database."""
+    qn = connection.ops.quote_name
+    columns = [model._meta.get_field(name).column for name in fields]
+    sql = (f"INSERT INTO {qn(model._meta.db_table)} "
+           f"({', '.join(qn(column) for column in columns)}) "
+           f"VALUES ({', '.join(['%s'] * len(columns))})")
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def next_id(model):
+    last = model.objects.order_by("-pk").values_list("pk", flat=True).first()
+    return (last or 0) + 1
+
+
+class CatalogGenerator:
+    """Fills the database with a synthetic catalog of ``films`` films.
+
+    The same ``seed`` always produces the same rows. Rows are written with
+    raw ``executemany`` inserts and explicit primary keys, in transactions
+    of ``batch_size`` rows, so nothing is read back from the database.
+    Actors are cast and comments are spread over posts with Zipf
+    distributed popularity, so a few people and posts get most of them.
+    """
+
+    vocabulary_size = 5000
+
+    def __init__(self, films, seed=0, batch_size=50000, actors=8,
+                 people=None, posts=None, comments=20, exponent=1.1,
+                 verbose=True):
+        self.films = films
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.actors = actors
+        self.people = max(100, films * 2) if people is None else people
+        self.countries = min(250, max(10, films // 100))
+        self.posts = films // 100 if posts is None else posts
+        self.comments = comments
+        self.exponent = exponent
+        self.verbose = verbose
+        self.now = connection.ops.adapt_datetimefield_value(EPOCH)
+        self.vocabulary = [word(self.rng).lower()
+                           for _ in range(self.vocabulary_size)]
+        self.latin = [word(self.rng, LATIN)
+                      for _ in range(self.vocabulary_size)]
+
+    def log(self, message):
+        if self.verbose:
+            print(message)
+
+    def text(self, words):
+        return " ".join(self.rng.choices(self.vocabulary, k=words)) \
+            .capitalize()
+
+    def name(self):
+        first, last = self.rng.choices(self.vocabulary, k=2)
+        return f"{first.capitalize()} {last.capitalize()}"
+
+    def run(self):
+        started = time.monotonic()
+        fast = connection.vendor == "sqlite"
+        if fast:
+            first_ids = {"films_film": next_id(Film),
+                         "films_person": next_id(Person)}
+            with connection.cursor() as cursor:
+                # Losing the database in a crash is fine for generated data.
+                cursor.execute("PRAGMA synchronous = OFF")
+                for table in FTS_COLUMNS:
+                    cursor.execute(f"DROP TRIGGER {table}_fts_insert")
+        try:
+            countries = self.create_countries()
+            genres = self.create_genres()
+            people = self.create_people()
+            self.create_films(countries, genres, people)
+            self.create_posts()
+            self.log(f"Counters of {sum(recount(EPOCH).values())} rows set")
+        finally:
+            if fast:
+                with transaction.atomic(), connection.cursor() as cursor:
+                    for table, columns in FTS_COLUMNS.items():
+                        self.index(cursor, table, columns, first_ids[table])
+                with connection.cursor() as cursor:
+                    cursor.execute("PRAGMA synchronous = FULL")
+        self.log(f"Catalog of {self.films} films created in "
+                 f"{time.monotonic() - started:.1f}s")
+
+    def index(self, cursor, table, columns, first_id):
+        values = ", ".join(search_index.yo(column) for column in columns)
+        cursor.execute(f"INSERT INTO {table}_fts(rowid, {', '.join(columns)}) "
+                       f"SELECT id, {values} FROM {table} WHERE id >= %s",
+                       [first_id])
+        # The third statement creates the insert trigger.
+        cursor.execute(search_index.table_index(table, columns)[2])
+        self.log(f"Indexed {table} for search")
+
+    def batches(self, count):
+        for start in range(0, count, self.batch_size):
+            yield start, min(count, start + self.batch_size)
+
+    def create_countries(self):
+        existing = set(Country.objects.values_list("name", flat=True))
+        names = []
+        for name in self.vocabulary:
+            name = f"{name.capitalize()}ия"
+            if name not in existing:
+                existing.add(name)
+                names.append(name)
+            if len(names) == self.countries:
+                break
+        first = next_id(Country)
+        with transaction.atomic():
+            insert(Country, ["id", "name", "film_count", "created_at",
+                             "updated_at"],
+                   [(first + i, name, 0, self.now, self.now)
+                    for i, name in enumerate(names)])
+        return list(range(first, first + len(names)))
+
+    def create_genres(self):
+        existing = set(Genre.objects.values_list("name", flat=True))
+        names = [name for name in GENRES if name not in existing]
+        first = next_id(Genre)
+        with transaction.atomic():
+            insert(Genre, ["id", "name", "film_count", "created_at",
+                           "updated_at"],
+                   [(first + i, name, 0, self.now, self.now)
+                    for i, name in enumerate(names)])
+        return list(Genre.objects.values_list("pk", flat=True))
+
+    def birthday(self):
+        # Person.birthday must not be in the future.
+        if self.rng.random() < 0.2:
+            return None
+        start = datetime.date(1900, 1, 1).toordinal()
+        end = EPOCH.date().toordinal() - 365 * 6
+        return connection.ops.adapt_datefield_value(
+            datetime.date.fromordinal(self.rng.randint(start, end)))
+
+    def create_people(self):
+        first = next_id(Person)
+        fields = ["id", "name", "origin_name", "birthday", "film_count",
+                  "directed_count", "created_at", "updated_at"]
+        for start, end in self.batches(self.people):
+            rows = [(first + i, self.name(),
+                     " ".join(self.rng.choices(self.latin, k=2)),
+                     self.birthday(), 0, 0, self.now, self.now)
+                    for i in range(start, end)]
+            with transaction.atomic():
+                insert(Person, fields, rows)
+            self.log(f"Created {end} people")
+        pks = list(range(first, first + self.people))
+        # Popularity ranks are not in the order of primary keys.
+        self.rng.shuffle(pks)
+        return pks
+
+    def cast_size(self):
+        size = self.rng.lognormvariate(math.log(self.actors), 0.6)
+        return max(1, min(self.actors * 6, round(size)))
+
+    def create_films(self, countries, genres, people):
+        popularity = zipf_weights(len(people), self.exponent)
+        by_size = zipf_weights(len(countries), 1.0, offset=0)
+        this_year = EPOCH.year
+        first = next_id(Film)
+        genre_id = next_id(Film.genres.through)
+        actor_id = next_id(Film.people.through)
+        fields = ["id", "name", "origin_name", "slogan", "description",
+                  "year", "length", "country", "director", "created_at",
+                  "updated_at"]
+        for start, end in self.batches(self.films):
+            films = []
+            film_genres = []
+            film_people = []
+            for pk in range(first + start, first + end):
+                films.append((
+                    pk, self.text(self.rng.randint(1, 4)),
+                    self.rng.choice(self.latin), self.text(5),
+                    self.text(40), self.rng.randint(1920, this_year),
+                    self.rng.randint(70, 200),
+                    self.rng.choices(countries, cum_weights=by_size)[0],
+                    self.rng.choices(people, cum_weights=popularity)[0],
+                    self.now, self.now))
+                for genre in self.rng.sample(genres, self.rng.randint(1, 3)):
+                    film_genres.append((genre_id, pk, genre))
+                    genre_id += 1
+                cast = set(self.rng.choices(people, cum_weights=popularity,
+                                            k=self.cast_size()))
+                for person in cast:
+                    film_people.append((actor_id, pk, person))
+                    actor_id += 1
+            with transaction.atomic():
+                insert(Film, fields, films)
+                insert(Film.genres.through, ["id", "film", "genre"],
+                       film_genres)
+                insert(Film.people.through, ["id", "film", "person"],
+                       film_people)
+            self.log(f"Created {end} films")
+
+    def create_users(self, count):
+        User = get_user_model()
+        first = next_id(User)
+        fields = ["id", "username", "password", "is_superuser",
+                  "first_name", "last_name", "email", "is_staff",
+                  "is_active", "date_joined"]
+        with transaction.atomic():
+            insert(User, fields, [
+                (first + i, f"seed{first + i}", "!", False, "", "", "",
+                 False, True, self.now) for i in range(count)])
+        return list(range(first, first + count))
+
+    def created_at(self):
+        moment = EPOCH - datetime.timedelta(
+            seconds=self.rng.randrange(5 * 365 * 24 * 3600))
+        return connection.ops.adapt_datetimefield_value(moment)
+
+    def create_posts(self):
+        if not self.posts:
+            return
+        users = self.create_users(max(20, self.posts // 10))
+        first = next_id(Post)
+        section_id = next_id(Section)
+        for start, end in self.batches(self.posts):
+            posts = []
+            sections = []
+            for pk in range(first + start, first + end):
+                created_at = self.created_at()
+                posts.append((pk, self.text(4), f"post-{pk}",
+                              self.rng.choice(users), 0, created_at,
+                              created_at))
+                for position in range(self.rng.randint(1, 5)):
+                    body = self.text(60)
+                    sections.append((section_id, pk, self.text(3), position,
+                                     body, f"<p>{body}</p>",
+                                     Section.ImageStatus.BEFORE_TITLE,
+                                     created_at, created_at))
+                    section_id += 1
+            with transaction.atomic():
+                insert(Post, ["id", "name", "slug", "author",
+                              "comment_count", "created_at", "updated_at"],
+                       posts)
+                insert(Section, ["id", "post", "name", "position", "body",
+                                 "body_html", "image_status", "created_at",
+                                 "updated_at"], sections)
+        self.log(f"Created {self.posts} posts")
+        self.create_comments(list(range(first, first + self.posts)), users)
+
+    def create_comments(self, posts, users):
+        popularity = zipf_weights(len(posts), self.exponent)
+        self.rng.shuffle(posts)
+        first = next_id(Comment)
+        fields = ["id", "post", "author", "body", "created_at", "updated_at"]
+        total = len(posts) * self.comments
+        for start, end in self.batches(total):
+            rows = []
+            for pk in range(first + start, first + end):
+                created_at = self.created_at()
+                post = self.rng.choices(posts, cum_weights=popularity)[0]
+                rows.append((pk, post, self.rng.choice(users), self.text(12),
+                             created_at, created_at))
+            with transaction.atomic():
+                insert(Comment, fields, rows)
+        self.log(f"Created {total} comments")
+
+
+def kinopoisk_documents(count, seed=0, first_id=1):
+    """Films in the format of the Kinopoisk API, as read by import_films."""
+    rng = random.Random(seed)
+    people = [{"id": first_id + i, "name": f"{word(rng)} {word(rng)}",
+               "enName": f"{word(rng, LATIN)} {word(rng, LATIN)}"}
+              for i in range(max(10, count * 2))]
+    countries = [f"{word(rng)}ия" for _ in range(20)]
+    for i in range(count):
+        cast = rng.sample(people, rng.randint(2, 12))
+        yield {
+            "id": first_id + i,
+            "name": sentence(rng, rng.randint(1, 4)),
+            "enName": word(rng, LATIN),
+            "slogan": sentence(rng, 5),
+            "description": sentence(rng, 40),
+            "year": rng.randint(1920, 2024),
+            "movieLength": rng.randint(70, 200),
+            "countries": [{"name": rng.choice(countries)}],
+            "genres": [{"name": name}
+                       for name in rng.sample(GENRES, rng.randint(1, 3))],
+            "persons": [{**person, "profession": "режиссеры"}
+                        for person in cast[:1]]
+                       + [{**person, "profession": "актеры"}
+                          for person in cast[1:]],
+        }
@@ -0,0 +1,75 @@
+import re
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from ..routes import patterns, route_url
+
+# Plan lines of full table scans: "SCAN films_film", or "SCAN TABLE
+# films_film" before SQLite 3.36; not scans of an index.
+FULL_SCAN = re.compile(
+    r"\bSCAN (?:TABLE )?(?!TABLE\b)(\w+)\b(?! USING (?:COVERING )?INDEX)")
+
+
+class Command(BaseCommand):
+    help = 'Run EXPLAIN QUERY PLAN for the queries of every films view'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--min-rows", type=int, default=1000,
+                            help="Tables with fewer rows are not checked")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("EXPLAIN QUERY PLAN needs SQLite")
+        self.min_rows = options["min_rows"]
+        self.sizes = {}
+        self.tables = set(connection.introspection.table_names())
+        failures = []
+        with transaction.atomic(), override_settings(ALLOWED_HOSTS=["*"]):
+            client = Client()
+            client.force_login(get_user_model().objects.create_superuser(
+                "audit_queries", password=None))
+            for pattern in patterns():
+                url = route_url(pattern)
+                if url is None:
+                    print(f"SKIP {pattern.name}: no objects")
+                    continue
+                with CaptureQueriesContext(connection) as queries:
+                    client.get(url)
+                for query in queries.captured_queries:
+                    if self.audit(url, query["sql"]):
+                        failures.append(url)
+            transaction.set_rollback(True)
+        if failures:
+            raise CommandError(
+                f"Full scan with temp B-tree sort in {len(failures)} "
+                f"queries: {', '.join(sorted(set(failures)))}")
+        print("OK")
+
+    def table_size(self, table):
+        if table not in self.sizes:
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT COUNT(*) FROM "{table}"')
+                self.sizes[table] = cursor.fetchone()[0]
+        return self.sizes[table]
+
+    def audit(self, url, sql):
+        if not sql.startswith("SELECT"):
+            return False
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            plan = [row[-1] for row in cursor.fetchall()]
+        sorted_in_temp = any("USE TEMP B-TREE FOR ORDER BY" in line
+                             for line in plan)
+        scanned = [match.group(1) for line in plan
+                   for match in [FULL_SCAN.search(line)] if match]
+        large = [table for table in scanned
+                 if table in self.tables
+                 and self.table_size(table) >= self.min_rows]
+        if not (sorted_in_temp and large):
+            return False
+        print(f"FAIL {url}\n  {sql}")
+        for line in plan:
+            print(f"    {line}")
+        return True
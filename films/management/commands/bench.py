@@ -0,0 +1,208 @@
+import contextlib
+import datetime
+import io
+import json
+import os
+import statistics
+import sqlite3
+import tempfile
+import time
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from films.models import Film
+from ..catalog import CatalogGenerator, kinopoisk_documents
+from ..routes import patterns, route_url
+
+
+def percentile(values, p):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[p - 1]
+
+
+def summary(samples):
+    """p50/p95 latency, queries and median query time of ``(seconds,
+    QueryTimer)`` samples, in milliseconds."""
+    latencies = [seconds * 1000 for seconds, _ in samples]
+    return {
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "queries": max(timer.count for _, timer in samples),
+        "query_ms": round(statistics.median(
+            timer.seconds * 1000 for _, timer in samples), 3),
+    }
+
+
+class QueryTimer:
+    """Execute wrapper counting queries and the time spent in them."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = 'Time every films view and import_films on a synthetic catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--films", type=int, default=10000,
+                            help="Size of the synthetic catalog")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--repeat", type=int, default=20,
+                            help="Timed requests per route")
+        parser.add_argument("--import-films", type=int, default=500,
+                            help="Films in the timed import_films run")
+        parser.add_argument("--database",
+                            help="SQLite file kept between runs, so the "
+                                 "catalog is only generated once")
+        parser.add_argument("--output", default="bench.json",
+                            help="File to write the results to")
+        parser.add_argument("--compare",
+                            help="Baseline results to compare with")
+        parser.add_argument("--threshold", type=float, default=0.2,
+                            help="Allowed relative p95 slowdown")
+
+    def handle(self, *args, **options):
+        if options["compare"] and not os.path.exists(options["compare"]):
+            raise CommandError(f"No baseline {options['compare']}")
+        old_name = self.setup_database(options["database"])
+        try:
+            if Film.objects.count() != options["films"]:
+                call_command("flush", interactive=False, verbosity=0)
+                CatalogGenerator(options["films"], seed=options["seed"]).run()
+            results = {}
+            with override_settings(ALLOWED_HOSTS=["*"]):
+                results.update(self.bench_routes(options["repeat"]))
+            results.update(self.bench_import(options["import_films"],
+                                             options["seed"]))
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=bool(options["database"]))
+        report = {
+            "meta": {
+                "films": options["films"],
+                "seed": options["seed"],
+                "repeat": options["repeat"],
+                "date": datetime.datetime.now().isoformat(),
+                "django": django.get_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "debug": settings.DEBUG,
+            },
+            "results": results,
+        }
+        with open(options["output"], "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {options['output']}")
+        if options["compare"]:
+            self.compare(options["compare"], report, options["threshold"])
+
+    def setup_database(self, path):
+        # Benchmarks run on a test database, never on the real one.
+        old_name = connection.settings_dict["NAME"]
+        if path:
+            connection.settings_dict["TEST"]["NAME"] = path
+        connection.creation.create_test_db(verbosity=0, autoclobber=True,
+                                           keepdb=bool(path))
+        return old_name
+
+    def measure(self, func):
+        timer = QueryTimer()
+        with connection.execute_wrapper(timer):
+            started = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - started
+        return result, (elapsed, timer)
+
+    def bench_routes(self, repeat):
+        client = Client()
+        user, _ = get_user_model().objects.get_or_create(
+            username="bench", defaults={"is_superuser": True,
+                                        "is_staff": True})
+        client.force_login(user)
+        results = {}
+        for pattern in patterns():
+            url = route_url(pattern)
+            if url is None:
+                print(f"SKIP {pattern.name}: no objects")
+                continue
+            # The first request fills process-wide caches.
+            client.get(url)
+            samples = []
+            for _ in range(repeat):
+                response, sample = self.measure(lambda: client.get(url))
+                if response.status_code != 200:
+                    raise CommandError(
+                        f"{url} returned {response.status_code}")
+                samples.append(sample)
+            results[pattern.name] = summary(samples)
+            self.report(pattern.name, results[pattern.name])
+        return results
+
+    def bench_import(self, count, seed):
+        results = {}
+        # Imported films are rolled back, so a kept database still holds
+        # the catalog only.
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl",
+                                         encoding="utf-8") as f, \
+                transaction.atomic():
+            for data in kinopoisk_documents(count, seed=seed,
+                                            first_id=10 ** 8):
+                f.write(json.dumps(data, ensure_ascii=False) + "\n")
+            f.flush()
+            for name, options in [
+                    ("import_films", {"bulk": True}),
+                    ("import_films --incremental",
+                     {"bulk": True, "incremental": True})]:
+                _, sample = self.measure(lambda: self.run_import(f.name,
+                                                                 options))
+                results[name] = summary([sample])
+                self.report(name, results[name])
+            transaction.set_rollback(True)
+        return results
+
+    @staticmethod
+    def run_import(path, options):
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_command("import_films", path, **options)
+
+    @staticmethod
+    def report(name, result):
+        print(f"{name:30} p50 {result['p50_ms']:9.2f} ms  "
+              f"p95 {result['p95_ms']:9.2f} ms  "
+              f"{result['queries']:5} queries {result['query_ms']:9.2f} ms")
+
+    def compare(self, path, report, threshold):
+        with open(path, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["meta"]["films"] != report["meta"]["films"]:
+            print(f"Baseline was taken with {baseline['meta']['films']} "
+                  "films, timings are not comparable")
+        regressions = []
+        for name, result in report["results"].items():
+            old = baseline["results"].get(name)
+            if old is None:
+                continue
+            if result["queries"] > old["queries"]:
+                regressions.append(f"{name}: {old['queries']} -> "
+                                   f"{result['queries']} queries")
+            if result["p95_ms"] > old["p95_ms"] * (1 + threshold):
+                regressions.append(f"{name}: p95 {old['p95_ms']:.2f} -> "
+                                   f"{result['p95_ms']:.2f} ms")
+        if regressions:
+            raise CommandError("Regressions against the baseline:\n  "
+                               + "\n  ".join(regressions))
+        print("No regressions against the baseline")
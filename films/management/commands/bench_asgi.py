@@ -0,0 +1,96 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+# Sync views under WSGI from threads, async views under ASGI from asyncio
+# tasks; see ASYNC_VIEWS in settings.
+DEPLOYMENTS = {
+    "wsgi": {"mode": "threads", "async_views": "0"},
+    "asgi": {"mode": "asyncio", "async_views": "1"},
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare throughput of the WSGI and ASGI deployments with ' \
+        'loadtest at equal worker count'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=2,
+                            help="Processes per deployment")
+        parser.add_argument("--concurrency", type=int, default=8,
+                            help="Simultaneous users per worker")
+        parser.add_argument("--duration", type=float, default=15)
+        parser.add_argument("--warmup", type=float, default=10,
+                            help="Seconds before measuring, long enough to "
+                                 "build the autocomplete index")
+        parser.add_argument("--mix",
+                            default="browse=60,search=20,autocomplete=20")
+        parser.add_argument("--output", help="File to write JSON results to")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("The benchmark copies an SQLite database")
+        source = str(connection.settings_dict["NAME"])
+        connection.close()
+        results = {}
+        with tempfile.TemporaryDirectory() as directory:
+            for name, deployment in DEPLOYMENTS.items():
+                path = os.path.join(directory, f"{name}.sqlite3")
+                shutil.copyfile(source, path)
+                results[name] = self.run_workers(path, name, deployment,
+                                                 options)
+        self.print_report(results, options)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+
+    def run_workers(self, path, name, deployment, options):
+        env = {**os.environ, "DATABASE_PATH": path,
+               "ASYNC_VIEWS": deployment["async_views"],
+               "DJANGO_SETTINGS_MODULE": settings.SETTINGS_MODULE}
+        outputs = [f"{path}.{worker}.json"
+                   for worker in range(options["workers"])]
+        workers = [subprocess.Popen(
+            [sys.executable, "-m", "django", "loadtest",
+             "--mode", deployment["mode"], "--mix", options["mix"],
+             "--duration", str(options["duration"]),
+             "--warmup", str(options["warmup"]),
+             "--concurrency", str(options["concurrency"]),
+             "--seed", str(worker), "--output", output],
+            env=env, stdout=subprocess.DEVNULL)
+            for worker, output in enumerate(outputs)]
+        for worker in workers:
+            if worker.wait() != 0:
+                raise CommandError(f"A {name} worker failed")
+        reports = []
+        for output in outputs:
+            with open(output, encoding="utf-8") as f:
+                reports.append(json.load(f))
+        return {
+            "throughput_rps": round(sum(report["throughput_rps"]
+                                        for report in reports), 1),
+            "p95_ms": max(report["latency"]["p95_ms"] for report in reports),
+            "errors": sum(count for report in reports
+                          for status, count in report["statuses"].items()
+                          if int(status) >= 500),
+            "workers": reports,
+        }
+
+    def print_report(self, results, options):
+        print(f"{options['workers']} workers x {options['concurrency']} "
+              f"users, {options['mix']}")
+        base = results["wsgi"]["throughput_rps"]
+        for name, result in results.items():
+            change = ""
+            if name != "wsgi":
+                ratio = result["throughput_rps"] / max(base, 1e-9)
+                change = f" ({ratio - 1:+.0%} vs wsgi)"
+            print(f"  {name:6} {result['throughput_rps']:8.1f} req/s{change}"
+                  f"  p95 {result['p95_ms']:8.1f} ms  "
+                  f"errors {result['errors']}")
@@ -0,0 +1,78 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+MIXES = {
+    "read-heavy": "browse=90,comment=10",
+    "write-heavy": "browse=50,comment=40,admin_edit=10",
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare throughput of the database profiles with loadtest'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profiles", nargs="+",
+                            default=["development", "production"],
+                            choices=list(settings.DATABASE_PROFILES))
+        parser.add_argument("--duration", type=float, default=15)
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--output", help="File to write JSON results to")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("The database profiles are for SQLite")
+        source = str(connection.settings_dict["NAME"])
+        connection.close()
+        results = {}
+        with tempfile.TemporaryDirectory() as directory:
+            for mix, weights in MIXES.items():
+                for profile in options["profiles"]:
+                    # Every run starts from its own copy of the database.
+                    path = os.path.join(directory, f"{mix}-{profile}.sqlite3")
+                    shutil.copyfile(source, path)
+                    results.setdefault(mix, {})[profile] = self.loadtest(
+                        path, profile, weights, options)
+        self.print_report(results, options["profiles"])
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+
+    def loadtest(self, path, profile, mix, options):
+        output = f"{path}.json"
+        env = {**os.environ, "DATABASE_PATH": path,
+               "DATABASE_PROFILE": profile,
+               "DJANGO_SETTINGS_MODULE": settings.SETTINGS_MODULE}
+        subprocess.run(
+            [sys.executable, "-m", "django", "loadtest", "--mix", mix,
+             "--duration", str(options["duration"]),
+             "--concurrency", str(options["concurrency"]),
+             "--output", output],
+            env=env, check=True, stdout=subprocess.DEVNULL)
+        with open(output, encoding="utf-8") as f:
+            report = json.load(f)
+        return {"throughput_rps": report["throughput_rps"],
+                "p95_ms": report["latency"]["p95_ms"],
+                "database_locked": report["database_locked"],
+                "scenarios": report["scenarios"]}
+
+    def print_report(self, results, profiles):
+        base = profiles[0]
+        for mix, by_profile in results.items():
+            print(f"{mix} ({MIXES[mix]})")
+            for profile in profiles:
+                result = by_profile[profile]
+                change = ""
+                if profile != base:
+                    ratio = result["throughput_rps"] \
+                        / max(by_profile[base]["throughput_rps"], 1e-9)
+                    change = f" ({ratio - 1:+.0%} vs {base})"
+                print(f"  {profile:12} {result['throughput_rps']:8.1f} req/s"
+                      f"{change}  p95 {result['p95_ms']:8.1f} ms  "
+                      f"locked {result['database_locked']}")
@@ -0,0 +1,107 @@
+import datetime
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+from films import pagecache
+from films.models import Film, SimilarFilm
+from films.similar import (Features, init_worker, neighbour_count,
+                           neighbours_of)
+
+
+def chunks(pks, size):
+    pks = iter(pks)
+    while chunk := list(islice(pks, size)):
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = 'Compute the similar films shown on film pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                            help="Number of worker processes")
+        parser.add_argument("--chunk-size", type=int, default=1000,
+                            help="Films per job and per transaction")
+        parser.add_argument("--max-df", type=int, default=1000,
+                            help="Features of more films only score "
+                                 "candidates found through rarer ones")
+        parser.add_argument("--since", type=float,
+                            help="Only update films edited in the last "
+                                 "SINCE minutes and the films they may "
+                                 "be similar to")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        features = Features(max_df=options["max_df"])
+        features.load()
+        print(f"Loaded {len(features.pks)} films, {len(features.kinds)} "
+              f"features in {time.monotonic() - started:.1f}s")
+        k = neighbour_count()
+        if options["since"] is None:
+            pks = features.pks
+        else:
+            pks = self.changed(features, options["since"], k)
+        jobs = [(chunk, k) for chunk in chunks(pks, options["chunk_size"])]
+        written = 0
+        if options["workers"] > 1:
+            # Workers only compute; forked processes must not share the
+            # parent's database connection.
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options["workers"],
+                                     initializer=init_worker,
+                                     initargs=(features,)) as pool:
+                for result in pool.map(neighbours_of, jobs):
+                    written += self.save(result, started)
+        else:
+            init_worker(features)
+            for job in jobs:
+                written += self.save(neighbours_of(job), started)
+        if options["since"] is None:
+            pagecache.cache().clear()
+        else:
+            pagecache.invalidate(*(Film(pk=pk) for pk in pks))
+        print(f"Stored {written} similar films of {len(pks)} films in "
+              f"{time.monotonic() - started:.1f}s")
+
+    def changed(self, features, minutes, k):
+        """Films edited since ``minutes`` ago, the films they were similar
+        to, and those they now score high enough to be similar to."""
+        since = timezone.now() - datetime.timedelta(minutes=minutes)
+        edited = [pk for pk in Film.objects.filter(updated_at__gte=since)
+                  .values_list("pk", flat=True) if pk in features.positions]
+        pks = set(edited)
+        pks.update(SimilarFilm.objects.filter(similar__in=edited)
+                   .values_list("film_id", flat=True))
+        # Similarity is symmetric: a candidate of an edited film gains it
+        # when its score beats the last of the candidate's neighbours.
+        scores = defaultdict(float)
+        for pk in edited:
+            for j, score in features.scores(pk).items():
+                scores[features.pks[j]] = max(scores[features.pks[j]], score)
+        for chunk in chunks(scores, 1000):
+            last = dict(SimilarFilm.objects.filter(film_id__in=chunk)
+                        .values("film_id")
+                        .annotate(count=Count("pk"), last=Min("score"))
+                        .filter(count__gte=k).values_list("film_id", "last"))
+            pks.update(pk for pk in chunk
+                       if pk not in last or scores[pk] > last[pk])
+        print(f"{len(edited)} films edited, {len(pks)} to update")
+        return sorted(pk for pk in pks if pk in features.positions)
+
+    def save(self, result, started):
+        rows = [SimilarFilm(film_id=pk, similar_id=other, score=score)
+                for pk, neighbours in result
+                for score, other in neighbours]
+        with transaction.atomic():
+            SimilarFilm.objects.filter(
+                film_id__in=[pk for pk, _ in result]).delete()
+            SimilarFilm.objects.bulk_create(rows)
+        print(f"Stored neighbours of {len(result)} films "
+              f"({time.monotonic() - started:.1f}s)")
+        return len(rows)
@@ -0,0 +1,45 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import connections
+from films import pagecache, thumbnails
+from films.templatetags.films_tags import card_cache
+from films.models import Film, Person, Post
+
+
+def build(args):
+    name, force = args
+    return thumbnails.generate(name, force=force)
+
+
+class Command(BaseCommand):
+    help = 'Generate thumbnails of covers, photos and post icons'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                            help="Number of worker processes")
+        parser.add_argument("--force", action="store_true",
+                            help="Replace existing thumbnails")
+
+    def handle(self, *args, **options):
+        names = set()
+        for model in (Film, Person, Post):
+            field = thumbnails.IMAGE_FIELDS[model._meta.model_name]
+            names.update(model.objects.exclude(**{field: ""})
+                         .exclude(**{f"{field}__isnull": True})
+                         .values_list(field, flat=True))
+        jobs = [(name, options["force"]) for name in sorted(names)]
+        # Workers only touch the storage; forked processes must not share
+        # the parent's database connection.
+        connections.close_all()
+        start = time.monotonic()
+        with ProcessPoolExecutor(max_workers=options["workers"]) as pool:
+            built = sum(pool.map(build, jobs, chunksize=16))
+        elapsed = time.monotonic() - start
+        if built:
+            # Cached cards and pages still point at the original images.
+            card_cache().clear()
+            pagecache.cache().clear()
+        print(f"Built thumbnails of {built} of {len(jobs)} images "
+              f"in {elapsed:.1f}s")
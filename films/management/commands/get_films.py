@@ -1,68 +1,136 @@
 from django.core.management.base import BaseCommand
+from django.utils import timezone
+import datetime
 import os
-import requests
 import json
+from ..fetcher import Checkpoint, KinopoiskFetcher
 
 
 class Command(BaseCommand):
     help = 'Download json via https://api.kinopoisk.dev'
 
+    def add_arguments(self, parser):
+        parser.add_argument("--list", default="top250",
+                            help="Kinopoisk list slug, empty for all movies")
+        parser.add_argument("--base-url", default="https://api.kinopoisk.dev",
+                            help="API root, e.g. a local mock")
+        parser.add_argument("--workers", type=int, default=4,
+                            help="Number of concurrent requests")
+        parser.add_argument("--retries", type=int, default=5,
+                            help="Retries for a request failed with 429/5xx")
+        parser.add_argument("--chunk-size", type=int, default=100,
+                            help="Movie ids per person request")
+        parser.add_argument("--incremental", action="store_true",
+                            help="Fetch only movies updated since last sync")
+
     def handle(self, *args, **options):
-        movies = self.get_movies()
-        with open(self.filename(), "w", encoding="utf-8") as f:
-            json.dump(movies, f, ensure_ascii=False, indent=4)
+        since = None
+        if options["incremental"]:
+            since = self.read_sync_state().get("last_sync")
+        checkpoint = Checkpoint(self.filename() + ".checkpoint")
+        # Films changed while an interrupted run was down count as changed
+        # since its start.
+        started = checkpoint.start(timezone.now().isoformat())
+        movies_path = self.filename() + ".movies.part"
+        persons_path = self.filename() + ".persons.part"
+        with KinopoiskFetcher(options["base_url"], self.headers(), checkpoint,
+                              workers=options["workers"],
+                              retries=options["retries"]) as fetcher:
+            self.get_movies(fetcher, movies_path, options["list"], since)
+            self.get_birthdays(fetcher, movies_path, persons_path,
+                               options["chunk_size"])
+        self.write_films(movies_path, persons_path)
+        checkpoint.clear()
+        os.remove(movies_path)
+        os.remove(persons_path)
+        self.write_sync_state({"last_sync": started})
         print(self.filename())
 
     @staticmethod
     def filename():
-        return "films/data/films.json"
+        return "films/data/films.jsonl"
+
+    @staticmethod
+    def sync_filename():
+        return "films/data/sync.json"
+
+    def read_sync_state(self):
+        try:
+            with open(self.sync_filename(), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def write_sync_state(self, state):
+        with open(self.sync_filename(), "w", encoding="utf-8") as f:
+            json.dump(state, f)
 
     @staticmethod
     def headers():
         return {"X-API-KEY": os.environ.get("KINOPOISK_DEV_TOKEN")}
 
-    def get_birthdays(self, movie_ids):
-        res = {}
+    @staticmethod
+    def read_lines(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    @staticmethod
+    def crawl_to_file(fetcher, path, jobs, select):
+        mode = "a" if fetcher.checkpoint.resumed else "w"
+        with open(path, mode, encoding="utf-8") as f:
+            def consume(docs):
+                for data in docs:
+                    f.write(json.dumps(select(data), ensure_ascii=False)
+                            + "\n")
+                f.flush()
+            fetcher.crawl(jobs, consume)
+
+    def get_birthdays(self, fetcher, movies_path, persons_path, chunk_size):
+        movie_ids = sorted({film_data["id"]
+                            for film_data in self.read_lines(movies_path)})
         params = {
             "selectFields": ["id", "birthday"],
             "notNullFields": ["birthday"],
             "limit": 250,
-            "movies.id": movie_ids,
-            "page": 1
         }
-        while True:
-            print(params["page"])
-            resp = requests.get(
-                "https://api.kinopoisk.dev/v1.4/person",
-                headers=self.headers(), params=params)
-            json = resp.json()
-            for data in json['docs']:
-                res[data['id']] = data['birthday']
-            params["page"] += 1
-            if params["page"] > json['pages']:
-                break
-        return res
+        jobs = []
+        for start in range(0, len(movie_ids), chunk_size):
+            chunk = movie_ids[start:start + chunk_size]
+            jobs.append((f"persons:{chunk_size}:{start}", "/v1.4/person",
+                         {**params, "movies.id": chunk}))
+        self.crawl_to_file(fetcher, persons_path, jobs,
+                           lambda data: [data['id'], data['birthday']])
 
-    def get_movies(self):
+    def get_movies(self, fetcher, movies_path, movie_list, since=None):
         params = {
             "selectFields": ["id", "name", "enName", "year", "description",
                              "movieLength", "countries",  "genres", "persons",
                              "poster", "slogan", "videos"],
             "type": "movie",
-            "lists": "top250",
             "limit": 250
-
         }
-        resp = requests.get(
-            "https://api.kinopoisk.dev/v1.4/movie",
-            headers=self.headers(), params=params)
-        json = resp.json()
-        movie_ids = set()
-        for film_data in json['docs']:
-            movie_ids.add(film_data["id"])
-        birthdays = self.get_birthdays(movie_ids)
-        for film_data in json['docs']:
-            for person_data in film_data['persons']:
-                if person_data['id'] in birthdays:
-                    person_data['birthday'] = birthdays[person_data['id']]
-        return json
+        if movie_list:
+            params["lists"] = movie_list
+        if since:
+            # The API filters by whole days, so the first day is fetched
+            # again; import_films --incremental skips unchanged films.
+            since = datetime.datetime.fromisoformat(since)
+            params["updatedAt"] = \
+                f"{since:%d.%m.%Y}-{timezone.now():%d.%m.%Y}"
+        self.crawl_to_file(fetcher, movies_path,
+                           [("movies", "/v1.4/movie", params)],
+                           lambda data: data)
+
+    def write_films(self, movies_path, persons_path):
+        birthdays = dict(self.read_lines(persons_path))
+        seen = set()
+        with open(self.filename(), "w", encoding="utf-8") as f:
+            for film_data in self.read_lines(movies_path):
+                if film_data["id"] in seen:
+                    continue
+                seen.add(film_data["id"])
+                for person_data in film_data['persons']:
+                    if person_data['id'] in birthdays:
+                        person_data['birthday'] = birthdays[person_data['id']]
+                f.write(json.dumps(film_data, ensure_ascii=False) + "\n")
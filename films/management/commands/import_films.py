@@ -1,97 +1,102 @@
 from django.core.management.base import BaseCommand
-import json
-import os
-from urllib.request import urlopen
-from urllib.error import HTTPError
-from django.core.files import File
-from django.core.files.temp import NamedTemporaryFile
+from films import pagecache
+from films.counters import recount
 from films.models import Country, Genre, Person, Film
+from ..downloader import ImageDownloader
+from ..importer import (BulkImporter, read_films, person_attrs, film_attrs,
+                        film_cast, image_url, fingerprint, update_changed)
 from .get_films import Command as GetCommand
 
 
 class Command(BaseCommand):
     help = 'Import films from json file'
 
-    def handle(self, *args, **options):
-        self.create_films()
+    def add_arguments(self, parser):
+        parser.add_argument("path", nargs="?", default=GetCommand.filename(),
+                            help="JSON Lines file or a single JSON document")
+        parser.add_argument("--image-workers", type=int, default=8,
+                            help="Number of parallel image downloads")
+        parser.add_argument("--image-timeout", type=float, default=10,
+                            help="Timeout for one image request, seconds")
+        parser.add_argument("--image-retries", type=int, default=3,
+                            help="Retries for a failed image request")
+        parser.add_argument("--bulk", action="store_true",
+                            help="Write films in chunks with bulk queries")
+        parser.add_argument("--chunk-size", type=int, default=500,
+                            help="Films per transaction in bulk mode")
+        parser.add_argument("--incremental", action="store_true",
+                            help="Write only films and rows that changed")
 
-    @staticmethod
-    def get_image_by_url(url):
-        img_tmp = NamedTemporaryFile(delete=True)
+    def handle(self, *args, **options):
+        self.incremental = options["incremental"]
+        self.downloader = ImageDownloader(workers=options["image_workers"],
+                                          timeout=options["image_timeout"],
+                                          retries=options["image_retries"])
         try:
-            with urlopen(url) as uo:
-                assert uo.status == 200
-                img_tmp.write(uo.read())
-                img_tmp.flush()
-        except HTTPError:
-            return None
-        return File(img_tmp)
+            self.create_films(options["path"], bulk=options["bulk"],
+                              chunk_size=options["chunk_size"])
+        finally:
+            self.downloader.close()
+
+    def upsert(self, model, defaults, **lookup):
+        if self.incremental:
+            return update_changed(model, defaults, **lookup)
+        return model.objects.update_or_create(defaults=defaults, **lookup)[0]
 
     def create_person(self, data):
         print(f"Processing PERSON «{data['name']}»")
-        attrs = {"name": data['name'], "origin_name": data['enName']}
-        try:
-            if not data['birthday'].startswith("0000-"):
-                attrs['birthday'] = data['birthday'][:10]
-        except KeyError:
-            pass
-        try:
-            photo_url = data['photo']
-        except KeyError:
-            photo_url = None
-        person = Person.objects.update_or_create(kinopoisk_id=data['id'],
-                                                 defaults=attrs)[0]
-        if photo_url:
-            image_file = self.get_image_by_url(photo_url)
-            if image_file:
-                person.photo.save(os.path.basename(photo_url), image_file)
+        person = self.upsert(Person, person_attrs(data),
+                             kinopoisk_id=data['id'])
+        photo_url = image_url(data, 'photo')
+        if photo_url and not (self.incremental and person.photo):
+            self.downloader.submit(person, "photo", photo_url)
         return person
 
     def create_film(self, data):
+        digest = fingerprint(data)
+        if self.incremental and Film.objects.filter(
+                kinopoisk_id=data['id'], import_fingerprint=digest).exists():
+            return None
         print(f"Processing FILM «{data['name']}»")
         country_name = data['countries'][0]['name']
-        country = Country.objects.update_or_create(name=country_name)[0]
+        country = self.upsert(Country, {}, name=country_name)
         genres = []
         for genre_data in data['genres']:
             genre_name = genre_data['name']
-            genre = Genre.objects.update_or_create(name=genre_name)[0]
+            genre = self.upsert(Genre, {}, name=genre_name)
             genres.append(genre)
-        director = None
-        people = []
-        for person_data in data['persons']:
-            if not person_data['name']:
-                continue
-            if person_data['profession'] == 'режиссеры' and director is None:
-                director = self.create_person(person_data)
-            elif person_data['profession'] == 'актеры':
-                people.append(self.create_person(person_data))
-        try:
-            cover_url = data['poster']['url']
-        except KeyError:
-            cover_url = None
-        attrs = {"name": data["name"], "origin_name": data["enName"],
-                 "slogan": data["slogan"], "length": data["movieLength"],
-                 "description": data["description"], "year": data["year"],
-                 "director": director, "country": country}
-        try:
-            attrs["trailer_url"] = data['videos']['trailers'][0]['url']
-        except (KeyError, IndexError):
-            pass
+        director_data, people_data = film_cast(data)
+        director = director_data and self.create_person(director_data)
+        people = [self.create_person(person_data)
+                  for person_data in people_data]
+        attrs = film_attrs(data)
+        attrs.update({"director": director, "country": country,
+                      "import_fingerprint": digest})
 
-        film = Film.objects.update_or_create(kinopoisk_id=data['id'],
-                                             defaults=attrs)[0]
+        film = self.upsert(Film, attrs, kinopoisk_id=data['id'])
         film.people.set(people)
         film.genres.set(genres)
 
-        if cover_url:
-            image_file = self.get_image_by_url(cover_url)
-            if image_file:
-                film.cover.save(os.path.basename(cover_url), image_file)
+        cover_url = image_url(data, 'poster')
+        if cover_url and not (self.incremental and film.cover):
+            self.downloader.submit(film, "cover", cover_url)
 
         return film
 
-    def create_films(self):
-        with open(GetCommand.filename(), 'r') as f:
-            films_data = json.load(f)
-            for film_data in films_data['docs']:
+    def create_films(self, path, bulk=False, chunk_size=500):
+        importer = None
+        if bulk:
+            importer = BulkImporter(chunk_size, self.downloader,
+                                    incremental=self.incremental)
+        for film_data in read_films(path):
+            if importer:
+                importer.add(film_data)
+            else:
                 self.create_film(film_data)
+            self.downloader.collect()
+        if importer:
+            importer.finish()
+            # Bulk queries send no signals to update counters or to
+            # invalidate cached pages.
+            recount()
+            pagecache.cache().clear()
@@ -0,0 +1,385 @@
+import asyncio
+import io
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlencode
+from django.conf import settings
+from django.contrib.auth import (BACKEND_SESSION_KEY, HASH_SESSION_KEY,
+                                 SESSION_KEY, get_user_model)
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import get_internal_wsgi_application
+from django.core.signals import got_request_exception
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+from django.utils.module_loading import import_string
+from importlib import import_module
+from films.models import Country, Film, Person, Post
+from .bench import percentile
+
+MIX = {"browse": 50, "search": 15, "autocomplete": 20, "comment": 10,
+       "admin_edit": 5}
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        if name not in MIX:
+            raise CommandError(f"Unknown scenario {name!r}, expected one "
+                               f"of {', '.join(MIX)}")
+        mix[name] = float(weight)
+    return mix
+
+
+class Session:
+    """A browser of the load test: its cookies and the requests of the
+    scenarios it runs."""
+
+    def __init__(self, user=None):
+        self.csrf_token = get_random_string(32)
+        self.cookies = {settings.CSRF_COOKIE_NAME: self.csrf_token}
+        if user is not None:
+            store = import_module(settings.SESSION_ENGINE).SessionStore()
+            store[SESSION_KEY] = str(user.pk)
+            store[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+            store[HASH_SESSION_KEY] = user.get_session_auth_hash()
+            store.save()
+            self.cookies[settings.SESSION_COOKIE_NAME] = store.session_key
+
+    def request(self, method, path, params=None, data=None):
+        """``(method, path, query string, body)`` of one request."""
+        query = urlencode(params or {})
+        body = urlencode(data or {}).encode()
+        return method, path, query, body
+
+
+class Traffic:
+    """Scripted scenarios; each returns the requests of one user action."""
+
+    def __init__(self):
+        self.films = list(Film.objects.order_by().values_list("pk",
+                                                               flat=True))
+        self.posts = list(Post.objects.order_by().values_list("pk",
+                                                              flat=True))
+        self.countries = list(Country.objects.order_by()
+                              .values_list("pk", "name"))
+        self.words = [word for name in Film.objects.order_by("?")
+                      .values_list("name", flat=True)[:500]
+                      for word in name.split() if len(word) > 3]
+        self.names = list(Person.objects.order_by("?")
+                          .values_list("name", flat=True)[:500])
+        if not (self.films and self.posts and self.countries and self.names):
+            raise CommandError("Needs films, people, countries and posts, "
+                               "see seed_catalog")
+
+    def browse(self, session, rng):
+        return [session.request("GET", reverse("films:film_list")),
+                session.request("GET", reverse(
+                    "films:film_detail", args=[rng.choice(self.films)])),
+                session.request("GET", reverse(
+                    "films:post_detail", args=[rng.choice(self.posts)]))]
+
+    def search(self, session, rng):
+        return [session.request("GET", reverse("films:film_list"),
+                                {"query": rng.choice(self.words)})]
+
+    def autocomplete(self, session, rng):
+        # One request per keystroke, as the select2 widget sends them.
+        name = rng.choice(self.names)
+        path = reverse("films:person_autocomplete")
+        return [session.request("GET", path, {"q": name[:length]})
+                for length in range(1, min(len(name), 6) + 1)]
+
+    def comment(self, session, rng):
+        path = reverse("films:post_detail",
+                       args=[rng.choice(self.posts)])
+        return [session.request("POST", path, data={
+            "body": f"Комментарий {get_random_string(8)}",
+            "csrfmiddlewaretoken": session.csrf_token})]
+
+    def admin_edit(self, session, rng):
+        pk, name = rng.choice(self.countries)
+        path = reverse("films:country_update", args=[pk])
+        return [session.request("POST", path, data={
+            "name": name, "csrfmiddlewaretoken": session.csrf_token})]
+
+
+class Results:
+    def __init__(self, started):
+        self.started = started
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.statuses = Counter()
+        self.series = defaultdict(lambda: {"requests": 0, "errors": 0,
+                                           "latencies": []})
+        self.exceptions = Counter()
+
+    def add(self, scenario, status, seconds, finished):
+        if finished - seconds < self.started:
+            # Started during the warm-up.
+            return
+        with self.lock:
+            self.samples[scenario].append(seconds * 1000)
+            self.statuses[status] += 1
+            second = self.series[int(finished - self.started)]
+            second["requests"] += 1
+            second["errors"] += status >= 500
+            second["latencies"].append(seconds * 1000)
+
+    def exception(self, sender, **kwargs):
+        exc = sys.exc_info()[1]
+        message = str(exc)
+        key = "database is locked" if "database is locked" in message \
+            else type(exc).__name__
+        with self.lock:
+            self.exceptions[key] += 1
+
+    def point(self, second):
+        point = self.series.get(second)
+        if point is None:
+            return {"second": second, "requests": 0, "errors": 0,
+                    "p95_ms": None}
+        return {"second": second, "requests": point["requests"],
+                "errors": point["errors"],
+                "p95_ms": round(percentile(point["latencies"], 95), 2)}
+
+    def report(self, elapsed):
+        latencies = [ms for samples in self.samples.values()
+                     for ms in samples]
+
+        def stats(samples):
+            return {"requests": len(samples),
+                    "p50_ms": round(percentile(samples, 50), 2),
+                    "p95_ms": round(percentile(samples, 95), 2),
+                    "p99_ms": round(percentile(samples, 99), 2)}
+
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "throughput_rps": round(len(latencies) / elapsed, 1),
+            "latency": stats(latencies) if latencies else {},
+            "scenarios": {name: stats(samples)
+                          for name, samples in sorted(self.samples.items())},
+            "statuses": {str(status): count
+                         for status, count in sorted(self.statuses.items())},
+            "database_locked": self.exceptions["database is locked"],
+            "exceptions": dict(self.exceptions),
+            "series": [self.point(second)
+                       for second in range(max(self.series, default=-1) + 1)],
+        }
+
+
+def wsgi_environ(method, path, query, body, cookies, csrf_token):
+    return {
+        "REQUEST_METHOD": method,
+        "PATH_INFO": path,
+        "QUERY_STRING": query,
+        "SCRIPT_NAME": "",
+        "SERVER_NAME": "localhost",
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "REMOTE_ADDR": "127.0.0.1",
+        "HTTP_HOST": "localhost",
+        "HTTP_COOKIE": "; ".join(f"{k}={v}" for k, v in cookies.items()),
+        "HTTP_X_CSRFTOKEN": csrf_token,
+        "CONTENT_TYPE": "application/x-www-form-urlencoded",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": io.StringIO(),
+        "wsgi.url_scheme": "http",
+        "wsgi.version": (1, 0),
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+
+
+def asgi_scope(method, path, query, body, cookies, csrf_token):
+    cookie = "; ".join(f"{k}={v}" for k, v in cookies.items())
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [
+            (b"host", b"localhost"),
+            (b"cookie", cookie.encode()),
+            (b"x-csrftoken", csrf_token.encode()),
+            (b"content-type", b"application/x-www-form-urlencoded"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+        "client": ("127.0.0.1", 0),
+        "server": ("localhost", 80),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Drive the WSGI or ASGI application with concurrent scripted ' \
+        'traffic. Writes comments and saves countries in the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mode", choices=["threads", "asyncio"],
+                            default="threads",
+                            help="WSGI application from threads or ASGI "
+                                 "application from asyncio tasks")
+        parser.add_argument("--concurrency", type=int, default=8,
+                            help="Number of simultaneous users")
+        parser.add_argument("--duration", type=float, default=30,
+                            help="Seconds to run")
+        parser.add_argument("--warmup", type=float, default=0,
+                            help="Seconds to run before measuring, while "
+                                 "process-wide caches fill")
+        parser.add_argument("--mix", type=parse_mix,
+                            default=",".join(f"{k}={v}"
+                                             for k, v in MIX.items()),
+                            help="Weights of the scenarios, "
+                                 "e.g. browse=50,comment=10")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="File to write JSON results to")
+
+    def handle(self, *args, **options):
+        self.seed = options["seed"]
+        self.traffic = Traffic()
+        self.mix = options["mix"]
+        User = get_user_model()
+        admin, _ = User.objects.get_or_create(
+            username="loadtest-admin",
+            defaults={"is_superuser": True, "is_staff": True})
+        self.users = [User.objects.get_or_create(
+            username=f"loadtest-{i}")[0]
+            for i in range(options["concurrency"])]
+        self.admin_session = Session(admin)
+        self.sessions = [Session(user) for user in self.users]
+        self.anonymous = Session()
+
+        started = time.monotonic() + options["warmup"]
+        self.deadline = started + options["duration"]
+        results = Results(started)
+        # Loading the application configures logging again.
+        if options["mode"] == "threads":
+            application = get_internal_wsgi_application()
+        else:
+            path = getattr(settings, "ASGI_APPLICATION", None)
+            application = import_string(path) if path \
+                else get_asgi_application()
+        got_request_exception.connect(results.exception)
+        # Failed requests are counted instead of logged one by one.
+        logger = logging.getLogger("django.request")
+        level = logger.level
+        logger.setLevel(logging.CRITICAL)
+        try:
+            if options["mode"] == "threads":
+                self.run_threads(application, options["concurrency"],
+                                 results)
+            else:
+                asyncio.run(self.run_tasks(application,
+                                           options["concurrency"], results))
+        finally:
+            got_request_exception.disconnect(results.exception)
+            logger.setLevel(level)
+        report = results.report(time.monotonic() - started)
+        report["mode"] = options["mode"]
+        report["concurrency"] = options["concurrency"]
+        self.print_report(report)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+
+    def actions(self, worker):
+        """Endless ``(scenario, requests)`` of one simulated user."""
+        rng = random.Random(f"{self.seed}-{worker}")
+        names = list(self.mix)
+        weights = [self.mix[name] for name in names]
+        session_of = {"comment": self.sessions[worker],
+                      "admin_edit": self.admin_session}
+        while True:
+            scenario = rng.choices(names, weights)[0]
+            session = session_of.get(scenario, self.anonymous)
+            yield (scenario, session,
+                   getattr(self.traffic, scenario)(session, rng))
+
+    def run_threads(self, application, concurrency, results):
+        def worker(number):
+            for scenario, session, requests in self.actions(number):
+                for request in requests:
+                    if time.monotonic() > self.deadline:
+                        return
+                    started = time.monotonic()
+                    status = []
+                    response = application(
+                        wsgi_environ(*request, session.cookies,
+                                     session.csrf_token),
+                        lambda code, headers, exc_info=None:
+                            status.append(int(code.split()[0])))
+                    for _ in response:
+                        pass
+                    response.close()
+                    finished = time.monotonic()
+                    results.add(scenario, status[0], finished - started,
+                                finished)
+
+        threads = [threading.Thread(target=worker, args=[number])
+                   for number in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    async def run_tasks(self, application, concurrency, results):
+        async def worker(number):
+            for scenario, session, requests in self.actions(number):
+                for method, path, query, body in requests:
+                    if time.monotonic() > self.deadline:
+                        return
+                    started = time.monotonic()
+                    status = []
+                    messages = [{"type": "http.request", "body": body}]
+
+                    async def receive():
+                        if messages:
+                            return messages.pop()
+                        # Django cancels the view once the client
+                        # disconnects, so it never does.
+                        await asyncio.Future()
+
+                    async def send(message):
+                        if message["type"] == "http.response.start":
+                            status.append(message["status"])
+
+                    await application(
+                        asgi_scope(method, path, query, body,
+                                   session.cookies, session.csrf_token),
+                        receive, send)
+                    finished = time.monotonic()
+                    results.add(scenario, status[0], finished - started,
+                                finished)
+
+        await asyncio.gather(*(worker(number)
+                               for number in range(concurrency)))
+
+    def print_report(self, report):
+        print(f"{report['mode']}, {report['concurrency']} users, "
+              f"{report['elapsed_s']} s: {report['throughput_rps']} req/s")
+        for name, stats in [("all", report["latency"]),
+                            *report["scenarios"].items()]:
+            if stats:
+                print(f"  {name:14} {stats['requests']:7} requests  "
+                      f"p50 {stats['p50_ms']:8.1f} ms  "
+                      f"p95 {stats['p95_ms']:8.1f} ms  "
+                      f"p99 {stats['p99_ms']:8.1f} ms")
+        print(f"  statuses: {report['statuses']}")
+        print(f"  database is locked: {report['database_locked']}")
+        for point in report["series"]:
+            p95 = "-" if point["p95_ms"] is None else f"{point['p95_ms']:.1f}"
+            print(f"  {point['second']:4}s {point['requests']:6} requests "
+                  f"{point['errors']:4} errors  p95 {p95} ms")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from films import pagecache
+from films.counters import recount
+
+
+class Command(BaseCommand):
+    help = 'Repair the film and comment counters, e.g. after bulk writes ' \
+        'that sent no signals'
+
+    def handle(self, *args, **options):
+        fixed = recount()
+        for counter, rows in fixed.items():
+            print(f"{counter}: {rows} rows fixed")
+        if any(fixed.values()):
+            # Pages showing the counters were cached with the old values.
+            pagecache.cache().clear()
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from films import pagecache
+from films.helpers import render_markdown
+from films.models import Section
+
+
+class Command(BaseCommand):
+    help = 'Render Markdown of all sections again, e.g. after ' \
+        'MARKDOWN_EXTENSIONS has changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500,
+                            help="Sections per transaction")
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        sections = Section.objects.order_by("pk").only("pk", "body")
+        last_pk = 0
+        total = 0
+        while True:
+            chunk = list(sections.filter(pk__gt=last_pk)[:chunk_size])
+            if not chunk:
+                break
+            now = timezone.now()
+            for section in chunk:
+                section.body_html = render_markdown(section.body)
+                # Last-Modified of post pages is max(updated_at).
+                section.updated_at = now
+            with transaction.atomic():
+                Section.objects.bulk_update(chunk,
+                                            ["body_html", "updated_at"])
+            last_pk = chunk[-1].pk
+            total += len(chunk)
+        if total:
+            # Cached pages and their ETags still hold the previous HTML.
+            pagecache.cache().clear()
+        print(f"Rendered {total} sections")
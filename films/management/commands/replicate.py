@@ -0,0 +1,40 @@
+import sqlite3
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+def copy_database(source, target):
+    """Copies the SQLite database ``source`` into ``target`` with the
+    online backup API, which is consistent while ``source`` is written."""
+    src, dst = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+
+
+class Command(BaseCommand):
+    help = 'Copy the primary SQLite database to the replicas of ' \
+        'DATABASE_REPLICAS, as a stand-in for real replication'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float,
+                            help="Keep copying every INTERVAL seconds")
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError("DATABASE_REPLICAS is empty")
+        source = str(connections["default"].settings_dict["NAME"])
+        while True:
+            for alias in settings.DATABASE_REPLICAS:
+                connections[alias].close()
+                copy_database(source,
+                              str(connections[alias].settings_dict["NAME"]))
+            print(f"Copied {source} to {len(settings.DATABASE_REPLICAS)} "
+                  "replicas")
+            if options["interval"] is None:
+                break
+            time.sleep(options["interval"])
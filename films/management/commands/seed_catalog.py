@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from ..catalog import CatalogGenerator
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with a synthetic catalog for scale testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--films", type=int, default=100000)
+        parser.add_argument("--people", type=int,
+                            help="Number of people, twice --films by default")
+        parser.add_argument("--posts", type=int,
+                            help="Number of posts, --films / 100 by default")
+        parser.add_argument("--actors", type=int, default=8,
+                            help="Median number of actors per film")
+        parser.add_argument("--comments", type=int, default=20,
+                            help="Average number of comments per post")
+        parser.add_argument("--zipf", type=float, default=1.1,
+                            help="Exponent of the popularity of actors "
+                                 "and posts")
+        parser.add_argument("--seed", type=int, default=0,
+                            help="Seed of the random generator")
+        parser.add_argument("--batch-size", type=int, default=50000,
+                            help="Rows per transaction")
+
+    def handle(self, *args, **options):
+        CatalogGenerator(
+            options["films"], seed=options["seed"],
+            batch_size=options["batch_size"], actors=options["actors"],
+            people=options["people"], posts=options["posts"],
+            comments=options["comments"], exponent=options["zipf"]).run()
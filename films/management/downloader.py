@@ -0,0 +1,84 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django.core.files import File
+from django.core.files.temp import NamedTemporaryFile
+
+
+class ImageDownloader:
+    """Downloads images in a thread pool and attaches them to model fields.
+
+    Each worker thread keeps its own ``requests.Session``, so connections
+    to the same host are reused between downloads. Finished downloads are
+    saved from the calling thread by ``collect``, which keeps all database
+    writes out of the pool.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, workers=8, timeout=10, retries=3):
+        self.timeout = timeout
+        self.retries = retries
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._pending = {}
+        self._scheduled = set()
+
+    def session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            retry = Retry(total=self.retries, backoff_factor=0.5,
+                          status_forcelist=[429, 500, 502, 503, 504],
+                          allowed_methods=["GET"])
+            adapter = HTTPAdapter(max_retries=retry)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._local.session = session
+        return session
+
+    def fetch(self, url):
+        img_tmp = NamedTemporaryFile(delete=True)
+        try:
+            with self.session().get(url, timeout=self.timeout,
+                                    stream=True) as resp:
+                resp.raise_for_status()
+                for chunk in resp.iter_content(self.chunk_size):
+                    img_tmp.write(chunk)
+            img_tmp.flush()
+        except requests.RequestException:
+            img_tmp.close()
+            return None
+        return File(img_tmp)
+
+    def submit(self, instance, field, url):
+        key = (type(instance), instance.pk, field)
+        if key in self._scheduled:
+            return
+        self._scheduled.add(key)
+        future = self._executor.submit(self.fetch, url)
+        self._pending[future] = (instance, field, url)
+
+    def collect(self, block=False):
+        if block:
+            wait(self._pending)
+        done = [future for future in self._pending if future.done()]
+        for future in done:
+            instance, field, url = self._pending.pop(future)
+            image_file = future.result()
+            if not image_file:
+                continue
+            with image_file:
+                getattr(instance, field).save(os.path.basename(url),
+                                              image_file, save=False)
+            instance.save(update_fields=[field, "updated_at"])
+        return len(done)
+
+    def close(self):
+        try:
+            self.collect(block=True)
+        finally:
+            self._executor.shutdown(cancel_futures=True)
@@ -0,0 +1,123 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class Checkpoint:
+    """Pages already fetched by a crawl, persisted to a JSON file.
+
+    The state maps a job key to the total number of its pages and the
+    pages that are done, and ``started`` to the start of the first run.
+    The file is replaced atomically on every update, so an interrupted
+    crawl always leaves a consistent checkpoint.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.resumed = os.path.exists(path)
+        self.state = {}
+        if self.resumed:
+            with open(path, encoding="utf-8") as f:
+                self.state = json.load(f)
+
+    def get(self, key):
+        return self.state.get(key)
+
+    def start(self, now):
+        """Start time of the crawl: ``now``, or the start of the run that
+        was interrupted."""
+        self.state.setdefault("started", now)
+        self.save()
+        return self.state["started"]
+
+    def mark(self, key, page, pages):
+        job = self.state.setdefault(key, {"pages": pages, "done": []})
+        job["done"].append(page)
+        self.save()
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        self.state = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class KinopoiskFetcher:
+    """Walks paginated api.kinopoisk.dev endpoints concurrently.
+
+    All requests share one ``requests.Session`` whose connection pool is
+    bounded by the number of workers. Requests answered with 429 or 5xx
+    are retried with exponential backoff, honouring ``Retry-After``.
+    """
+
+    def __init__(self, base_url, headers, checkpoint, workers=4, retries=5,
+                 timeout=30):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.checkpoint = checkpoint
+        retry = Retry(total=retries, backoff_factor=1,
+                      status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=["GET"])
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers,
+                              pool_block=True, max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._executor.shutdown(cancel_futures=True)
+        self.session.close()
+
+    def get(self, path, params, page):
+        resp = self.session.get(f"{self.base_url}{path}",
+                                params={**params, "page": page},
+                                timeout=self.timeout)
+        resp.raise_for_status()
+        return resp.json()
+
+    def crawl(self, jobs, consume):
+        """Fetches every page of every ``(key, path, params)`` job.
+
+        ``consume(docs)`` is called from the calling thread for each page,
+        then the page is marked done in the checkpoint. Pages done in an
+        earlier run are skipped.
+        """
+        pending = {}
+
+        def schedule(key, path, params, page):
+            future = self._executor.submit(self.get, path, params, page)
+            pending[future] = (key, path, params, page)
+
+        for key, path, params in jobs:
+            job = self.checkpoint.get(key)
+            if job is None:
+                schedule(key, path, params, 1)
+                continue
+            for page in range(1, job["pages"] + 1):
+                if page not in job["done"]:
+                    schedule(key, path, params, page)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key, path, params, page = pending.pop(future)
+                data = future.result()
+                consume(data['docs'])
+                first = self.checkpoint.get(key) is None
+                self.checkpoint.mark(key, page, data['pages'])
+                if first:
+                    for next_page in range(2, data['pages'] + 1):
+                        schedule(key, path, params, next_page)
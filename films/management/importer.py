@@ -0,0 +1,280 @@
+import hashlib
+import json
+import time
+from django.db import transaction
+from django.db.models import Q
+from films.models import Country, Genre, Person, Film
+
+
+def read_films(path):
+    """Yields films one by one from a JSON Lines file.
+
+    Files in the old format, a single ``{"docs": [...]}`` document, are
+    still accepted, but they are loaded into memory as a whole.
+    """
+    with open(path, encoding="utf-8") as f:
+        # The line of the first non-whitespace character tells the format:
+        # a whole film in JSON Lines, the start of an indented document or
+        # a document on one line otherwise.
+        for first in f:
+            if first.strip():
+                break
+        else:
+            return
+        try:
+            data = json.loads(first)
+        except json.JSONDecodeError:
+            data = None
+        if not isinstance(data, dict) or "docs" in data:
+            f.seek(0)
+            yield from json.load(f)['docs']
+            return
+        yield data
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def person_attrs(data):
+    attrs = {"name": data['name'], "origin_name": data['enName']}
+    try:
+        if not data['birthday'].startswith("0000-"):
+            attrs['birthday'] = data['birthday'][:10]
+    except KeyError:
+        pass
+    return attrs
+
+
+def film_attrs(data):
+    attrs = {"name": data["name"], "origin_name": data["enName"],
+             "slogan": data["slogan"], "length": data["movieLength"],
+             "description": data["description"], "year": data["year"]}
+    try:
+        attrs["trailer_url"] = data['videos']['trailers'][0]['url']
+    except (KeyError, IndexError):
+        pass
+    return attrs
+
+
+def film_cast(data):
+    director = None
+    people = []
+    for person_data in data['persons']:
+        if not person_data['name']:
+            continue
+        if person_data['profession'] == 'режиссеры' and director is None:
+            director = person_data
+        elif person_data['profession'] == 'актеры':
+            people.append(person_data)
+    return director, people
+
+
+def fingerprint(data):
+    content = json.dumps(data, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+def differs(model, obj, attrs):
+    """Names of ``attrs`` whose values differ from ``obj``.
+
+    ``obj`` is a model instance or a dict from ``values()``.
+    """
+    changed = []
+    for name, value in attrs.items():
+        field = model._meta.get_field(name)
+        if not field.is_relation:
+            value = field.to_python(value)
+        stored = obj[name] if isinstance(obj, dict) else getattr(obj, name)
+        if stored != value:
+            changed.append(name)
+    return changed
+
+
+def update_changed(model, defaults, **lookup):
+    """Like ``update_or_create``, but an existing row is saved only when
+    one of ``defaults`` actually changes, so its ``updated_at`` is kept.
+    """
+    obj, created = model.objects.get_or_create(defaults=defaults, **lookup)
+    if not created:
+        changed = differs(model, obj, defaults)
+        if changed:
+            for name in changed:
+                setattr(obj, name, defaults[name])
+            obj.save(update_fields=[*changed, "updated_at"])
+    return obj
+
+
+def image_url(data, key):
+    try:
+        url = data[key]
+    except KeyError:
+        return None
+    if isinstance(url, dict):
+        return url.get('url')
+    return url
+
+
+class BulkImporter:
+    """Imports films in chunks with a fixed number of queries per chunk.
+
+    Countries, genres, people and films are written with ``bulk_create``
+    and the M2M through rows are replaced in bulk. Primary keys of written
+    rows are kept in memory for the whole run, so objects shared between
+    chunks (genres, popular actors) are only written once.
+    """
+
+    def __init__(self, chunk_size=500, downloader=None, incremental=False):
+        self.chunk_size = chunk_size
+        self.downloader = downloader
+        self.incremental = incremental
+        self.countries = {}
+        self.genres = {}
+        self.people = {}
+        self.films = {}
+        self.chunk = []
+        self.rows = 0
+        self.started = time.monotonic()
+
+    def add(self, data):
+        self.chunk.append(data)
+        if len(self.chunk) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.chunk:
+            return
+        chunk, self.chunk = self.chunk, []
+        started = time.monotonic()
+        with transaction.atomic():
+            rows = self.write(chunk)
+        self.rows += rows
+        elapsed = time.monotonic() - started
+        print(f"Imported {len(chunk)} films, {rows} rows "
+              f"({rows / max(elapsed, 1e-6):.0f} rows/s)")
+
+    def finish(self):
+        self.flush()
+        elapsed = time.monotonic() - self.started
+        print(f"Total: {len(self.films)} films, {self.rows} rows "
+              f"in {elapsed:.1f} s ({self.rows / max(elapsed, 1e-6):.0f} "
+              "rows/s)")
+
+    def write(self, chunk):
+        if self.incremental:
+            chunk = self.changed_films(chunk)
+        rows = 0
+        rows += self.save_names(
+            Country, self.countries,
+            {data['countries'][0]['name'] for data in chunk})
+        rows += self.save_names(
+            Genre, self.genres,
+            {genre['name'] for data in chunk for genre in data['genres']})
+
+        films = {}
+        people = {}
+        for data in chunk:
+            director, actors = film_cast(data)
+            if director is None:
+                print(f"Skipping FILM «{data['name']}» without director")
+                continue
+            films[data['id']] = (data, director, actors)
+            for person_data in [director] + actors:
+                if person_data['id'] not in self.people:
+                    people[person_data['id']] = person_data
+        rows += self.upsert(Person, self.people, {
+            kinopoisk_id: person_attrs(data)
+            for kinopoisk_id, data in people.items()})
+        self.submit_images(Person, "photo", {
+            self.people[kinopoisk_id]: image_url(data, 'photo')
+            for kinopoisk_id, data in people.items()})
+
+        film_rows = {}
+        for kinopoisk_id, (data, director, actors) in films.items():
+            attrs = film_attrs(data)
+            attrs["import_fingerprint"] = fingerprint(data)
+            attrs["country_id"] = \
+                self.countries[data['countries'][0]['name']]
+            attrs["director_id"] = self.people[director['id']]
+            film_rows[kinopoisk_id] = attrs
+        rows += self.upsert(Film, self.films, film_rows)
+
+        film_pks = [self.films[kinopoisk_id] for kinopoisk_id in films]
+        rows += self.replace_m2m(Film.genres.through, "genre_id", film_pks, {
+            (self.films[kinopoisk_id], self.genres[genre['name']])
+            for kinopoisk_id, (data, _, _) in films.items()
+            for genre in data['genres']})
+        rows += self.replace_m2m(Film.people.through, "person_id", film_pks, {
+            (self.films[kinopoisk_id], self.people[person['id']])
+            for kinopoisk_id, (_, _, actors) in films.items()
+            for person in actors})
+        self.submit_images(Film, "cover", {
+            self.films[kinopoisk_id]: image_url(data, 'poster')
+            for kinopoisk_id, (data, _, _) in films.items()})
+        return rows
+
+    @staticmethod
+    def save_names(model, ids, names):
+        names = names - ids.keys()
+        if not names:
+            return 0
+        model.objects.bulk_create([model(name=name) for name in names],
+                                  ignore_conflicts=True)
+        ids.update(model.objects.filter(name__in=names)
+                   .values_list("name", "pk"))
+        return len(names)
+
+    @staticmethod
+    def changed_films(chunk):
+        stored = dict(Film.objects.order_by()
+                      .filter(kinopoisk_id__in=[data['id'] for data in chunk])
+                      .values_list("kinopoisk_id", "import_fingerprint"))
+        return [data for data in chunk
+                if stored.get(data['id']) != fingerprint(data)]
+
+    @staticmethod
+    def changed_rows(model, rows):
+        names = {name for attrs in rows.values() for name in attrs}
+        stored = {obj["kinopoisk_id"]: obj for obj in model.objects.order_by()
+                  .filter(kinopoisk_id__in=rows.keys())
+                  .values("kinopoisk_id", *names)}
+        return {kinopoisk_id: attrs for kinopoisk_id, attrs in rows.items()
+                if kinopoisk_id not in stored
+                or differs(model, stored[kinopoisk_id], attrs)}
+
+    def upsert(self, model, ids, rows):
+        changed = self.changed_rows(model, rows) if self.incremental else rows
+        # Rows are grouped by their set of keys, so a field missing from
+        # the source data never overwrites a stored value.
+        groups = {}
+        for kinopoisk_id, attrs in changed.items():
+            groups.setdefault(tuple(sorted(attrs)), []).append(
+                model(kinopoisk_id=kinopoisk_id, **attrs))
+        for fields, objs in groups.items():
+            model.objects.bulk_create(
+                objs, update_conflicts=True, unique_fields=["kinopoisk_id"],
+                update_fields=[*fields, "updated_at"])
+        ids.update(model.objects.filter(kinopoisk_id__in=rows.keys())
+                   .values_list("kinopoisk_id", "pk"))
+        return len(changed)
+
+    @staticmethod
+    def replace_m2m(through, field, film_pks, pairs):
+        through.objects.filter(film_id__in=film_pks).delete()
+        through.objects.bulk_create(
+            [through(film_id=film_pk, **{field: pk})
+             for film_pk, pk in pairs], ignore_conflicts=True)
+        return len(pairs)
+
+    def submit_images(self, model, field, urls):
+        if not self.downloader:
+            return
+        if self.incremental:
+            # Images already stored are not downloaded again.
+            empty = Q(**{field: ""}) | Q(**{f"{field}__isnull": True})
+            missing = set(model.objects.order_by()
+                          .filter(empty, pk__in=urls.keys())
+                          .values_list("pk", flat=True))
+            urls = {pk: url for pk, url in urls.items() if pk in missing}
+        for pk, url in urls.items():
+            if url:
+                self.downloader.submit(model(pk=pk), field, url)
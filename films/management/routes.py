@@ -0,0 +1,30 @@
+from django.urls import URLPattern, reverse
+from films import urls
+from films.models import Country, Genre, Film, Person, Post, Comment
+
+MODELS = {"country": Country, "genre": Genre, "film": Film,
+          "person": Person, "post": Post}
+
+
+def patterns():
+    return [pattern for pattern in urls.urlpatterns
+            if isinstance(pattern, URLPattern)]
+
+
+def route_url(pattern):
+    """URL of ``pattern`` for the first object it applies to, or None if
+    there is no such object."""
+    params = set(pattern.pattern.converters)
+    kwargs = {}
+    if params == {"id"}:
+        model = MODELS[pattern.name.split("_")[0]]
+        obj = model.objects.order_by().first()
+        if obj is None:
+            return None
+        kwargs["id"] = obj.id
+    elif params:
+        comment = Comment.objects.order_by().first()
+        if comment is None:
+            return None
+        kwargs = {"post_id": comment.post_id, "comment_id": comment.id}
+    return reverse(f"{urls.app_name}:{pattern.name}", kwargs=kwargs)
@@ -0,0 +1,68 @@
+# Generated by Django 5.1.15 on 2026-10-18 11:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Post',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('name', models.CharField(max_length=250, verbose_name='Название')),
+                ('slug', models.SlugField(max_length=250)),
+                ('icon', models.ImageField(blank=True, null=True, upload_to='post_images/', verbose_name='Иконка')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='posts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Новость',
+                'verbose_name_plural': 'Новости',
+                'ordering': ['created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Comment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('body', models.TextField(null=True, verbose_name='Текст')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='a_comments', to=settings.AUTH_USER_MODEL)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='comments', to='films.post')),
+            ],
+            options={
+                'verbose_name': 'Комментарий',
+                'verbose_name_plural': 'Комментарии',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Section',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('name', models.CharField(max_length=250, verbose_name='Название')),
+                ('body', models.TextField(null=True, verbose_name='Текст')),
+                ('position', models.IntegerField(default=0, verbose_name='Позиция')),
+                ('image', models.ImageField(blank=True, null=True, upload_to='post_images/', verbose_name='Изображение')),
+                ('image_status', models.CharField(choices=[('L', 'Left'), ('R', 'Right'), ('BT', 'Before title'), ('AT', 'After title'), ('B', 'Bottom')], default='BT', max_length=2)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sections', to='films.post')),
+            ],
+            options={
+                'verbose_name': 'Секция',
+                'verbose_name_plural': 'Секции',
+                'ordering': ['position'],
+            },
+        ),
+    ]
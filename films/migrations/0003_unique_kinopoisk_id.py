@@ -0,0 +1,51 @@
+# Generated by Django 5.1.15 on 2026-10-18 11:45
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicates(apps, schema_editor):
+    """Merges rows sharing a kinopoisk_id, which the importer wrote before
+    it upserted, into the oldest one."""
+    Film = apps.get_model("films", "Film")
+    Person = apps.get_model("films", "Person")
+    through = Film.people.through
+    for model in (Person, Film):
+        duplicates = (model.objects.order_by().exclude(kinopoisk_id=None)
+                      .values("kinopoisk_id")
+                      .annotate(keep=Min("pk"), count=Count("pk"))
+                      .filter(count__gt=1).values_list("kinopoisk_id", "keep"))
+        for kinopoisk_id, keep in duplicates:
+            others = list(model.objects.filter(kinopoisk_id=kinopoisk_id)
+                          .exclude(pk=keep).values_list("pk", flat=True))
+            if model is Person:
+                Film.objects.filter(director__in=others).update(
+                    director=keep)
+                for other in others:
+                    # A film lists each actor once.
+                    through.objects.filter(
+                        person=other, film__in=through.objects.filter(
+                            person=keep).values("film")).delete()
+                    through.objects.filter(person=other).update(person=keep)
+            model.objects.filter(pk__in=others).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0002_post_comment_section'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='film',
+            name='kinopoisk_id',
+            field=models.PositiveIntegerField(blank=True, null=True, unique=True, verbose_name='Kinopoisk ID'),
+        ),
+        migrations.AlterField(
+            model_name='person',
+            name='kinopoisk_id',
+            field=models.PositiveIntegerField(blank=True, null=True, unique=True, verbose_name='Kinopoisk ID'),
+        ),
+    ]
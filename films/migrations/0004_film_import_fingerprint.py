@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 11:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0003_unique_kinopoisk_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='film',
+            name='import_fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True, verbose_name='Отпечаток импорта'),
+        ),
+    ]
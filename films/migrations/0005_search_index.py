@@ -0,0 +1,109 @@
+from django.db import migrations
+
+# Full-text indexes are SQLite FTS5 tables kept in sync by triggers, so
+# rows written with bulk_create or raw SQL are indexed as well. The
+# unicode61 tokenizer folds case for Cyrillic too; ё is replaced with е
+# here and in films.search.match_expression.
+#
+# SQLite drops the triggers of a table when Django's schema editor remakes
+# it, as it does for most AlterField and AddField operations (0007 and 0008
+# did, see 0010). Every migration remaking films_film, films_person,
+# films_post or films_section must create the TRIGGERS of that table again;
+# SearchTest.test_triggers checks that they all exist after migrate.
+
+
+def yo(column):
+    return f"replace(replace(coalesce({column}, ''), 'ё', 'е'), 'Ё', 'Е')"
+
+
+def table_index(table, columns):
+    fts = f"{table}_fts"
+    names = ", ".join(columns)
+    new = ", ".join(yo(f"new.{column}") for column in columns)
+    assignments = ", ".join(f"{column} = {yo(f'new.{column}')}"
+                            for column in columns)
+    return [
+        f"CREATE VIRTUAL TABLE {fts} USING fts5({names}, "
+        "tokenize = 'unicode61 remove_diacritics 2')",
+        f"INSERT INTO {fts}(rowid, {names}) SELECT id, "
+        f"{', '.join(yo(column) for column in columns)} FROM {table}",
+        f"CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new}); END",
+        f"CREATE TRIGGER {fts}_update AFTER UPDATE OF {names} ON {table} "
+        f"BEGIN UPDATE {fts} SET {assignments} WHERE rowid = new.id; END",
+        f"CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN "
+        f"DELETE FROM {fts} WHERE rowid = old.id; END",
+    ]
+
+
+def post_body(post_id):
+    return ("(SELECT group_concat("
+            f"{yo('name')} || ' ' || {yo('body')}, ' ') "
+            f"FROM films_section WHERE post_id = {post_id})")
+
+
+def section_trigger(event, post_ids):
+    updates = " ".join(f"UPDATE films_post_fts SET body = "
+                       f"{post_body(post_id)} WHERE rowid = {post_id};"
+                       for post_id in post_ids)
+    return (f"CREATE TRIGGER films_section_fts_{event.split()[0].lower()} "
+            f"AFTER {event} ON films_section BEGIN {updates} END")
+
+
+FORWARD = [
+    *table_index("films_film",
+                 ["name", "origin_name", "slogan", "description"]),
+    *table_index("films_person", ["name", "origin_name"]),
+    # Posts are indexed with the text of all their sections.
+    "CREATE VIRTUAL TABLE films_post_fts USING fts5(name, body, "
+    "tokenize = 'unicode61 remove_diacritics 2')",
+    f"INSERT INTO films_post_fts(rowid, name, body) SELECT id, {yo('name')}, "
+    f"coalesce({post_body('films_post.id')}, '') FROM films_post",
+    "CREATE TRIGGER films_post_fts_insert AFTER INSERT ON films_post BEGIN "
+    f"INSERT INTO films_post_fts(rowid, name, body) "
+    f"VALUES (new.id, {yo('new.name')}, ''); END",
+    "CREATE TRIGGER films_post_fts_update AFTER UPDATE OF name ON films_post "
+    f"BEGIN UPDATE films_post_fts SET name = {yo('new.name')} "
+    "WHERE rowid = new.id; END",
+    "CREATE TRIGGER films_post_fts_delete AFTER DELETE ON films_post BEGIN "
+    "DELETE FROM films_post_fts WHERE rowid = old.id; END",
+    section_trigger("INSERT", ["new.post_id"]),
+    section_trigger("UPDATE OF name, body, post_id",
+                    ["old.post_id", "new.post_id"]),
+    section_trigger("DELETE", ["old.post_id"]),
+]
+
+TRIGGERS = [statement.split()[2] for statement in FORWARD
+            if statement.startswith("CREATE TRIGGER")]
+
+BACKWARD = [
+    "DROP TABLE IF EXISTS films_film_fts",
+    "DROP TABLE IF EXISTS films_person_fts",
+    "DROP TABLE IF EXISTS films_post_fts",
+    "DROP TRIGGER IF EXISTS films_section_fts_insert",
+    "DROP TRIGGER IF EXISTS films_section_fts_update",
+    "DROP TRIGGER IF EXISTS films_section_fts_delete",
+    *(f"DROP TRIGGER IF EXISTS {table}_fts_{event}"
+      for table in ("films_film", "films_person", "films_post")
+      for event in ("insert", "update", "delete")),
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != "sqlite":
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0004_film_import_fingerprint'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(FORWARD), run(BACKWARD)),
+    ]
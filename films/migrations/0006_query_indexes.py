@@ -0,0 +1,39 @@
+# Generated by Django 5.1.15 on 2026-10-18 11:56
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0005_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', '-created_at'], name='comment_post_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='film',
+            index=models.Index(fields=['name', 'id'], name='film_name_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='film',
+            index=models.Index(fields=['country', 'name', 'id'], name='film_country_name_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='film',
+            index=models.Index(fields=['year'], name='film_year_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(fields=['name', 'id'], name='person_name_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['created_at', 'id'], name='post_created_at_id_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 11:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0006_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='section',
+            name='body_html',
+            field=models.TextField(editable=False, null=True, verbose_name='HTML текста'),
+        ),
+    ]
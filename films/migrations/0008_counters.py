@@ -0,0 +1,58 @@
+# Generated by Django 5.1.15 on 2026-10-18 12:32
+
+from django.db import migrations, models
+
+
+# Counters of existing rows; signals keep them up to date from now on.
+COUNT_SQL = [
+    "UPDATE films_country SET film_count = (SELECT COUNT(*) FROM films_film"
+    " WHERE country_id = films_country.id)",
+    "UPDATE films_genre SET film_count = (SELECT COUNT(*)"
+    " FROM films_film_genres WHERE genre_id = films_genre.id)",
+    "UPDATE films_person SET film_count = (SELECT COUNT(*)"
+    " FROM films_film_people WHERE person_id = films_person.id),"
+    " directed_count = (SELECT COUNT(*) FROM films_film"
+    " WHERE director_id = films_person.id)",
+    "UPDATE films_post SET comment_count = (SELECT COUNT(*)"
+    " FROM films_comment WHERE post_id = films_post.id)",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0007_section_body_html'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='country',
+            name='film_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Фильмов'),
+        ),
+        migrations.AddField(
+            model_name='genre',
+            name='film_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Фильмов'),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='directed_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Фильмов как режиссёр'),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='film_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Фильмов'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Комментариев'),
+        ),
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(fields=['-film_count', 'name', 'id'], name='person_film_count_idx'),
+        ),
+        migrations.RunSQL(COUNT_SQL, migrations.RunSQL.noop),
+    ]
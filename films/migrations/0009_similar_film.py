@@ -0,0 +1,30 @@
+# Generated by Django 5.1.15 on 2026-10-18 12:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0008_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarFilm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(verbose_name='Сходство')),
+                ('film', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='similarities', to='films.film')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_to', to='films.film', verbose_name='Похожий фильм')),
+            ],
+            options={
+                'verbose_name': 'Похожий фильм',
+                'verbose_name_plural': 'Похожие фильмы',
+                'ordering': ['-score'],
+                'indexes': [models.Index(fields=['film', '-score'], name='similar_film_score_idx')],
+                'constraints': [models.UniqueConstraint(fields=('film', 'similar'), name='similar_film_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+import importlib
+from django.db import migrations
+
+# remove_diacritics 2 folded й into и, so "Бой" also matched "Бои".
+# unicode61 folds the case of Cyrillic without it, and ё is still replaced
+# with е. FTS5 tables cannot change their tokenizer, so the indexes of 0005
+# are created again and refilled. This also restores the triggers of
+# films_person and films_post, which SQLite dropped when 0008 rebuilt
+# those tables.
+
+search_index = importlib.import_module("films.migrations.0005_search_index")
+
+
+def recreate(tokenize):
+    return search_index.run(search_index.BACKWARD + [
+        statement.replace("unicode61 remove_diacritics 2", tokenize)
+        for statement in search_index.FORWARD])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0009_similar_film'),
+    ]
+
+    operations = [
+        migrations.RunPython(recreate("unicode61 remove_diacritics 0"),
+                             recreate("unicode61 remove_diacritics 2")),
+    ]
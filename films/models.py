@@ -2,8 +2,8 @@ from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
 import datetime
 from django.conf import settings
-import markdown
 from django.utils.safestring import mark_safe
+from .helpers import render_markdown
 
 
 class MyModel(models.Model):
@@ -16,6 +16,8 @@ class MyModel(models.Model):
 
 class Country(MyModel):
     name = models.CharField("Название", max_length=200, unique=True)
+    film_count = models.PositiveIntegerField("Фильмов", default=0,
+                                             editable=False)
 
     class Meta:
         ordering = ["name"]
@@ -28,6 +30,8 @@ class Country(MyModel):
 
 class Genre(MyModel):
     name = models.CharField("Название", max_length=200, unique=True)
+    film_count = models.PositiveIntegerField("Фильмов", default=0,
+                                             editable=False)
 
     class Meta:
         ordering = ["name"]
@@ -50,7 +54,11 @@ class Person(MyModel):
     photo = models.ImageField(
         "Фото", upload_to='photos/', blank=True, null=True)
     kinopoisk_id = models.PositiveIntegerField(
-        "Kinopoisk ID", blank=True, null=True)
+        "Kinopoisk ID", blank=True, null=True, unique=True)
+    film_count = models.PositiveIntegerField("Фильмов", default=0,
+                                             editable=False)
+    directed_count = models.PositiveIntegerField("Фильмов как режиссёр",
+                                                 default=0, editable=False)
 
     def age(self):
         if not self.birthday:
@@ -62,6 +70,11 @@ class Person(MyModel):
 
     class Meta:
         ordering = ["name"]
+        indexes = [
+            models.Index(fields=["name", "id"], name="person_name_id_idx"),
+            models.Index(fields=["-film_count", "name", "id"],
+                         name="person_film_count_idx"),
+        ]
         verbose_name = "Персона"
         verbose_name_plural = "Персоны"
 
@@ -91,16 +104,56 @@ class Film(MyModel):
     description = models.TextField("Описание", blank=True, null=True)
     people = models.ManyToManyField(Person, verbose_name="Актеры")
     kinopoisk_id = models.PositiveIntegerField(
-        "Kinopoisk ID", blank=True, null=True)
+        "Kinopoisk ID", blank=True, null=True, unique=True)
+    import_fingerprint = models.CharField(
+        "Отпечаток импорта", max_length=40, blank=True, null=True,
+        editable=False)
 
     class Meta:
         ordering = ["name"]
+        indexes = [
+            models.Index(fields=["name", "id"], name="film_name_id_idx"),
+            models.Index(fields=["country", "name", "id"],
+                         name="film_country_name_id_idx"),
+            models.Index(fields=["year"], name="film_year_idx"),
+        ]
         verbose_name = "Фильм"
         verbose_name_plural = "Фильмы"
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The country and director the film is counted for, see
+        # films/signals.py.
+        instance._counted = (instance.__dict__.get("country_id"),
+                             instance.__dict__.get("director_id"))
+        return instance
+
+class SimilarFilm(models.Model):
+    """A precomputed neighbour of a film, see films/similar.py."""
+    film = models.ForeignKey(Film, on_delete=models.CASCADE,
+                             related_name="similarities", db_index=False)
+    similar = models.ForeignKey(Film, on_delete=models.CASCADE,
+                                related_name="similar_to",
+                                verbose_name="Похожий фильм")
+    score = models.FloatField("Сходство")
+
+    class Meta:
+        ordering = ["-score"]
+        constraints = [models.UniqueConstraint(
+            fields=["film", "similar"], name="similar_film_unique")]
+        indexes = [models.Index(fields=["film", "-score"],
+                                name="similar_film_score_idx")]
+        verbose_name = "Похожий фильм"
+        verbose_name_plural = "Похожие фильмы"
+
+    def __str__(self):
+        return f"{self.film_id} ~ {self.similar_id} ({self.score:.3f})"
+
+
 class Post(MyModel):
     name = models.CharField("Название", max_length=250)
     slug = models.SlugField(max_length=250)
@@ -109,9 +162,13 @@ class Post(MyModel):
     author = models.ForeignKey(settings.AUTH_USER_MODEL,
                                on_delete=models.CASCADE,
                                related_name="posts")
+    comment_count = models.PositiveIntegerField("Комментариев", default=0,
+                                                editable=False)
 
     class Meta:
         ordering = ["created_at"]
+        indexes = [models.Index(fields=["created_at", "id"],
+                                name="post_created_at_id_idx")]
         verbose_name = "Новость"
         verbose_name_plural = "Новости"
 
@@ -128,6 +185,8 @@ class Comment(MyModel):
     
     class Meta:
         ordering = ["-created_at"]
+        indexes = [models.Index(fields=["post", "-created_at"],
+                                name="comment_post_created_at_idx")]
         verbose_name = "Комментарий"
         verbose_name_plural = "Комментарии"
 
@@ -144,6 +203,7 @@ class Section(MyModel):
 
     name = models.CharField("Название", max_length=250)
     body = models.TextField("Текст", null=True)
+    body_html = models.TextField("HTML текста", null=True, editable=False)
     post = models.ForeignKey(Post, on_delete=models.CASCADE,
                              related_name="sections")
     position = models.IntegerField("Позиция", default=0)
@@ -160,5 +220,36 @@ class Section(MyModel):
     def __str__(self):
         return self.name
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if "body" in instance.__dict__:
+            instance._rendered_body = instance.body
+        return instance
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "body" in update_fields:
+            # body_html is rendered again only when body has changed.
+            body = self.body
+            render = self.body_html is None \
+                or body != getattr(self, "_rendered_body", None)
+        else:
+            # body is not saved, so only a missing body_html is filled, from
+            # the body as stored. A bare instance has none.
+            deferred = "body" in self.get_deferred_fields()
+            render = self.body_html is None \
+                and (deferred or hasattr(self, "_rendered_body"))
+            if render:
+                body = self.body if deferred else self._rendered_body
+        if render:
+            self.body_html = render_markdown(body)
+            self._rendered_body = body
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "body_html"}
+        super().save(*args, **kwargs)
+
     def body_as_markdown(self):
-        return mark_safe(markdown.markdown(self.body))  
+        if self.body_html is None:
+            return mark_safe(render_markdown(self.body))
+        return mark_safe(self.body_html)
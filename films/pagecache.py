@@ -0,0 +1,131 @@
+import functools
+import hashlib
+import uuid
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import caches
+from . import routers
+
+
+def object_tag(obj):
+    return f"{obj._meta.model_name}:{obj.pk}"
+
+
+def list_tag(model, owner=None):
+    """Tag of all rows of ``model``, or of those listed on the page of
+    ``owner``, such as the films of a country."""
+    name = f"{model._meta.model_name}:list"
+    return f"{name}:{object_tag(owner)}" if owner is not None else name
+
+
+def version_key(tag):
+    return f"pagecache:version:{tag}"
+
+
+def page_key(request):
+    path = hashlib.sha1(request.get_full_path().encode()).hexdigest()
+    return f"pagecache:page:{path}"
+
+
+def cache():
+    return caches[getattr(settings, "PAGE_CACHE_ALIAS", "pages")]
+
+
+def timeout():
+    return getattr(settings, "PAGE_CACHE_TIMEOUT", 600)
+
+
+def tag(request, *items):
+    """Marks the page being rendered as depending on ``items``: model
+    instances, or tags from ``list_tag``."""
+    tags = getattr(request, "cache_tags", None)
+    if tags is None:
+        return
+    for item in items:
+        tags.add(item if isinstance(item, str) else object_tag(item))
+
+
+def invalidate(*items):
+    """Drops every cached page tagged with one of ``items``."""
+    tags = {item if isinstance(item, str) else object_tag(item)
+            for item in items}
+    if tags:
+        # Versions are random rather than counters, so a version key that
+        # was evicted never comes back with a value a page has recorded.
+        cache().set_many({version_key(tag): uuid.uuid4().hex
+                          for tag in tags}, None)
+
+
+def current_versions(tags):
+    keys = [version_key(tag) for tag in tags]
+    versions = cache().get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in versions}
+    if missing:
+        for key, version in missing.items():
+            cache().add(key, version, None)
+        versions.update(cache().get_many(list(missing)))
+    return versions
+
+
+def cacheable(request):
+    return request.method in ("GET", "HEAD") \
+        and not request.user.is_authenticated \
+        and not len(messages.get_messages(request))
+
+
+def lookup(request):
+    """``(key, response)`` of the cached page of ``request``; the response
+    is None on a miss, and both are None if the page is not cached."""
+    if not cacheable(request):
+        return None, None
+    key = page_key(request)
+    entry = cache().get(key)
+    if entry is not None:
+        versions, response = entry
+        if cache().get_many(list(versions)) == versions:
+            return key, response
+    request.cache_tags = set()
+    return key, None
+
+
+def store(request, key, response):
+    if response.status_code == 200 and request.cache_tags:
+        versions = current_versions(request.cache_tags)
+        seconds = timeout()
+        if routers.current_pin().replica_read:
+            # The replica may miss writes that already invalidated the
+            # tags; don't keep what it showed longer than it may lag.
+            lag = getattr(settings, "REPLICA_PIN_SECONDS", 15)
+            seconds = lag if seconds is None else min(seconds, lag)
+        cache().set(key, (versions, response), seconds)
+
+
+def cache_page(view):
+    """Caches responses of ``view`` for anonymous users by URL.
+
+    A cached page stores the versions of the tags the view recorded with
+    ``tag``; it is served only while all of them are unchanged, so a
+    signal calling ``invalidate`` for an object drops exactly the pages
+    that show it. ``view`` may be a coroutine function.
+    """
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            key, response = await sync_to_async(lookup)(request)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+                if key is not None:
+                    await sync_to_async(store)(request, key, response)
+            return response
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key, response = lookup(request)
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if key is not None:
+                store(request, key, response)
+        return response
+    return wrapper
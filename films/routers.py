@@ -0,0 +1,114 @@
+import contextvars
+import random
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Pin:
+    pinned = False
+    wrote = False
+    replica_read = False
+
+
+_pin = contextvars.ContextVar("primary_pin")
+
+
+def current_pin():
+    pin = _pin.get(None)
+    if pin is None:
+        pin = Pin()
+        _pin.set(pin)
+    return pin
+
+
+class PrimaryReplicaRouter:
+    """Sends reads to a random replica of ``DATABASE_REPLICAS`` and writes
+    to the primary (``default``).
+
+    After the first write in a request or a management command, reads go
+    to the primary too, so code reading rows it has just written does
+    not see a lagging replica. Sessions are always read from the primary.
+    Pages read from a replica are cached for ``REPLICA_PIN_SECONDS`` at
+    most, see ``pagecache.cache_page``.
+    """
+
+    primary_apps = {"sessions"}
+
+    def __init__(self, replicas=None):
+        if replicas is None:
+            replicas = getattr(settings, "DATABASE_REPLICAS", [])
+        self.replicas = list(replicas)
+
+    def db_for_read(self, model, **hints):
+        if not self.replicas or model._meta.app_label in self.primary_apps \
+                or current_pin().pinned \
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        current_pin().replica_read = True
+        return random.choice(self.replicas)
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label not in self.primary_apps:
+            pin = current_pin()
+            pin.pinned = pin.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # All databases hold the same rows.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema with the data from the primary.
+        return db not in self.replicas
+
+
+class PrimaryPinMiddleware:
+    """Pins requests to the primary database while replicas may lag.
+
+    Requests other than GET and HEAD are pinned from the start. After a
+    request writes, a cookie pins the requests of the same browser for
+    ``REPLICA_PIN_SECONDS``, so the page it is redirected to shows the
+    change.
+    """
+
+    cookie_name = "primary_pin"
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        pin, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _pin.reset(token)
+        return self.finish(pin, response)
+
+    async def __acall__(self, request):
+        pin, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _pin.reset(token)
+        return self.finish(pin, response)
+
+    def start(self, request):
+        pin = Pin()
+        pin.pinned = request.method not in ("GET", "HEAD") \
+            or self.cookie_name in request.COOKIES
+        return pin, _pin.set(pin)
+
+    def finish(self, pin, response):
+        if pin.wrote:
+            response.set_cookie(
+                self.cookie_name, "1",
+                max_age=getattr(settings, "REPLICA_PIN_SECONDS", 15),
+                httponly=True, samesite="Lax")
+        return response
@@ -0,0 +1,49 @@
+import re
+from django.db import connection
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+
+# FTS5 tables created by migration 0005 and bm25 weights of their columns.
+INDEXES = {
+    "films_film": ("films_film_fts", (10.0, 5.0, 2.0, 1.0)),
+    "films_person": ("films_person_fts", (10.0, 5.0)),
+    "films_post": ("films_post_fts", (10.0, 1.0)),
+}
+
+
+def normalize(text):
+    return text.replace("ё", "е").replace("Ё", "Е")
+
+
+def match_expression(query):
+    words = re.findall(r"\w+", normalize(query))
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def search(queryset, query):
+    """Filters ``queryset`` by ``query`` and orders it by relevance.
+
+    Every word of the query must prefix-match a word of the indexed text.
+    Backends other than SQLite fall back to ``name__icontains``.
+    """
+    table = queryset.model._meta.db_table
+    if connection.vendor != "sqlite" or table not in INDEXES:
+        return queryset.filter(name__icontains=query)
+    match = match_expression(query)
+    if not match:
+        return queryset.none()
+    fts, weights = INDEXES[table]
+    bm25 = ", ".join(str(weight) for weight in weights)
+    # bm25() needs the full-text table in the query, so the ranks of all
+    # matches are computed once in a materialized CTE and looked up by
+    # id; a correlated MATCH would search the index again for every row.
+    rank = RawSQL(
+        f"WITH ranks AS MATERIALIZED (SELECT rowid AS id, "
+        f"bm25({fts}, {bm25}) AS rank FROM {fts} WHERE {fts} MATCH %s) "
+        f"SELECT rank FROM ranks WHERE ranks.id = {table}.id",
+        [match], output_field=FloatField())
+    return (queryset
+            .filter(pk__in=RawSQL(
+                f"SELECT rowid FROM {fts} WHERE {fts} MATCH %s", [match]))
+            .annotate(search_rank=rank)
+            .order_by("search_rank", *queryset.model._meta.ordering))
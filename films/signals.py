@@ -0,0 +1,252 @@
+import functools
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+from django.utils import timezone
+from . import pagecache, thumbnails
+from .autocomplete import country_index, person_index
+from .facets import film_facets
+from .models import Comment, Country, Film, Genre, Person, Post, Section
+
+
+@receiver(post_save, sender=Person)
+@receiver(post_save, sender=Country)
+def update_autocomplete(sender, instance, update_fields=None, **kwargs):
+    # Photos are saved on bare instances, see films/management/downloader.py.
+    if update_fields is None or {"name", "origin_name"} & set(update_fields):
+        index = person_index if sender is Person else country_index
+        # Rows of a rolled back transaction are never suggested.
+        transaction.on_commit(functools.partial(index.update, instance))
+
+
+@receiver(post_delete, sender=Person)
+@receiver(post_delete, sender=Country)
+def remove_autocomplete(sender, instance, **kwargs):
+    index = person_index if sender is Person else country_index
+    transaction.on_commit(functools.partial(index.remove, instance.pk))
+
+
+# Columns of films kept in the facet index.
+FACET_FIELDS = {"country", "director", "year", "length"}
+
+
+def change_facets(method, *args):
+    # Like the page cache, the facet index follows committed rows only, so
+    # a rolled back transaction leaves no phantom films or choices in it.
+    transaction.on_commit(functools.partial(method, *args))
+
+
+@receiver(post_save, sender=Film)
+def update_facets(sender, instance, update_fields=None, **kwargs):
+    # Images are saved on bare instances, see films/management/downloader.py.
+    if update_fields is None or FACET_FIELDS & set(update_fields):
+        change_facets(film_facets.update, instance)
+
+
+@receiver(post_delete, sender=Film)
+def remove_facets(sender, instance, **kwargs):
+    change_facets(film_facets.remove, instance.pk)
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Country)
+def rename_facet_choice(sender, instance, **kwargs):
+    change_facets(film_facets.rename, sender._meta.model_name, instance.pk,
+                  instance.name)
+
+
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Country)
+def remove_facet_choice(sender, instance, **kwargs):
+    change_facets(film_facets.remove_choice, sender._meta.model_name,
+                  instance.pk)
+
+
+@receiver(m2m_changed, sender=Film.genres.through)
+def link_facets(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_clear":
+        # The genres or films cleared are read before they go.
+        column = "film_id" if reverse else "genre_id"
+        pk_set = sender.objects.filter(
+            **{instance._meta.model_name: instance}).values_list(
+                column, flat=True)
+    elif action not in ("post_add", "post_remove"):
+        return
+    linked = action == "post_add"
+    pk_set = list(pk_set)
+    if reverse:
+        change_facets(film_facets.link, pk_set, [instance.pk], linked)
+    else:
+        change_facets(film_facets.link, [instance.pk], pk_set, linked)
+
+
+@receiver(post_save, sender=Film)
+@receiver(post_save, sender=Person)
+@receiver(post_save, sender=Post)
+def generate_thumbnails(sender, instance, update_fields=None, **kwargs):
+    field = thumbnails.IMAGE_FIELDS[sender._meta.model_name]
+    if update_fields is None or field in update_fields:
+        thumbnails.generate_for(instance)
+
+
+def invalidate_pages(*items):
+    # Pages rendered before the commit would be cached with the new
+    # versions, so the versions change only after it.
+    transaction.on_commit(functools.partial(pagecache.invalidate, *items))
+
+
+@receiver(post_save, sender=Country)
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Person)
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Country)
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Person)
+@receiver(post_delete, sender=Post)
+def invalidate_object_pages(sender, instance, **kwargs):
+    invalidate_pages(instance, pagecache.list_tag(sender))
+
+
+@receiver(post_save, sender=Film)
+def invalidate_film_pages(sender, instance, update_fields=None, **kwargs):
+    items = [instance, pagecache.list_tag(Film)]
+    if update_fields is None or {"country", "director"} & set(update_fields):
+        # Lists of the former country and director carry the film tag.
+        items += film_lists(Country(pk=instance.country_id),
+                            Person(pk=instance.director_id))
+    invalidate_pages(*items)
+
+
+@receiver(pre_delete, sender=Film)
+def invalidate_deleted_film_pages(sender, instance, **kwargs):
+    # Rows of the through tables are gone once post_delete is sent.
+    invalidate_pages(
+        instance, pagecache.list_tag(Film),
+        *film_lists(Country(pk=instance.country_id),
+                    Person(pk=instance.director_id)),
+        *film_lists(*(Genre(pk=pk) for pk in Film.genres.through.objects
+                      .filter(film=instance)
+                      .values_list("genre_id", flat=True))),
+        *film_lists(*(Person(pk=pk) for pk in Film.people.through.objects
+                      .filter(film=instance)
+                      .values_list("person_id", flat=True))))
+
+
+@receiver(post_save, sender=Film)
+def count_saved_film(sender, instance, created, **kwargs):
+    counted = (instance.country_id, instance.director_id)
+    if created:
+        old_country, old_director = None, None
+    else:
+        # Columns not loaded from the database count as unchanged.
+        old_country, old_director = (
+            new if old is None else old for old, new in
+            zip(getattr(instance, "_counted", counted), counted))
+    if old_country != instance.country_id:
+        add(Country, [old_country], "film_count", -1)
+        add(Country, [instance.country_id], "film_count", 1)
+    if old_director != instance.director_id:
+        add(Person, [old_director], "directed_count", -1)
+        add(Person, [instance.director_id], "directed_count", 1)
+    instance._counted = counted
+
+
+@receiver(pre_delete, sender=Film)
+def count_deleted_film(sender, instance, **kwargs):
+    add(Country, [instance.country_id], "film_count", -1)
+    add(Person, [instance.director_id], "directed_count", -1)
+    # Deleting the film deletes its through rows without m2m_changed.
+    for model in (Genre, Person):
+        add(model, model.objects.filter(film=instance)
+            .values_list("pk", flat=True), "film_count", -1)
+
+
+@receiver(m2m_changed, sender=Film.genres.through)
+@receiver(m2m_changed, sender=Film.people.through)
+def count_members(sender, instance, action, reverse, model, pk_set,
+                  **kwargs):
+    # pk_set of post_add holds only the rows added, that of pre_remove
+    # every pk asked for, so the rows removed are read before they go.
+    if action == "post_add":
+        amount, pks = 1, list(pk_set)
+    elif action in ("pre_remove", "pre_clear"):
+        target = model._meta.model_name
+        rows = sender.objects.filter(**{instance._meta.model_name: instance})
+        if action == "pre_remove":
+            rows = rows.filter(**{f"{target}_id__in": pk_set})
+        amount = -1
+        pks = list(rows.values_list(f"{target}_id", flat=True))
+    else:
+        return
+    if reverse:
+        if pks:
+            add(type(instance), [instance.pk], "film_count",
+                amount * len(pks))
+    else:
+        add(model, pks, "film_count", amount)
+
+
+@receiver(m2m_changed, sender=Film.genres.through)
+@receiver(m2m_changed, sender=Film.people.through)
+def invalidate_membership_pages(sender, instance, action, reverse, model,
+                                pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if action == "pre_clear":
+        # Columns of the through tables are named after the models.
+        pk_set = sender.objects.filter(
+            **{instance._meta.model_name: instance}).values_list(
+                f"{model._meta.model_name}_id", flat=True)
+    pk_set = list(pk_set)
+    # Both sides count as modified, so max(updated_at) of the rows a page
+    # shows validates it; see films/conditional.py. Genres and people are
+    # touched by count_members along with their counters.
+    touch(Film, [instance.pk] if not reverse else pk_set)
+    related = [model(pk=pk) for pk in pk_set]
+    # The facets of the film list count the films of each genre.
+    facets = [pagecache.list_tag(Film)] \
+        if sender is Film.genres.through else []
+    if reverse:
+        invalidate_pages(*facets, *film_lists(instance), *related)
+    else:
+        invalidate_pages(*facets, instance, *film_lists(*related))
+
+
+@receiver(post_save, sender=Comment)
+def count_saved_comment(sender, instance, created, **kwargs):
+    if created:
+        add(Post, [instance.post_id], "comment_count", 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    add(Post, [instance.post_id], "comment_count", -1)
+
+
+@receiver(post_delete, sender=Section)
+def touch_post(sender, instance, **kwargs):
+    touch(Post, [instance.post_id])
+
+
+def touch(model, pks):
+    model.objects.filter(pk__in=pks).update(updated_at=timezone.now())
+
+
+def add(model, pks, counter, amount):
+    """Adds ``amount`` to ``counter`` of the rows ``pks`` in one UPDATE,
+    which also touches them. Pages showing the rows are invalidated.
+    Counters that have drifted stop at zero until ``recount``."""
+    pks = [pk for pk in pks if pk is not None]
+    if not pks:
+        return
+    model.objects.filter(pk__in=pks).update(
+        **{counter: Greatest(F(counter) + amount, 0)},
+        updated_at=timezone.now())
+    invalidate_pages(pagecache.list_tag(model), *(model(pk=pk) for pk in pks))
+
+
+def film_lists(*owners):
+    return [pagecache.list_tag(Film, owner) for owner in owners]
@@ -0,0 +1,176 @@
+import heapq
+import math
+from array import array
+from collections import defaultdict
+from django.conf import settings
+from .models import Film
+
+# Weight of each kind of feature. A feature weighs that times its inverse
+# document frequency, so a shared rare actor counts for more than a
+# shared common genre.
+WEIGHTS = {
+    "genre": 1.0,
+    "person": 2.0,
+    "director": 3.0,
+    "country": 0.5,
+    "decade": 0.5,
+    "country_decade": 0.5,
+}
+
+
+def neighbour_count():
+    return getattr(settings, "SIMILAR_FILMS", 8)
+
+
+class Features:
+    """Sparse film-by-feature matrix for similar films.
+
+    Rows are stored like a CSR matrix, the feature ids of film ``i`` being
+    ``indices[indptr[i]:indptr[i + 1]]``, and the columns, the films of
+    each feature, likewise, all in flat arrays. Films are numbered by
+    ``pks``.
+
+    Similarity is the cosine of weighted rows: the sum of the squared
+    weights of the shared features over the product of the norms of the
+    rows. Candidates are reached through features of at most ``max_df``
+    films: people, directors, a country within a decade. Features such as
+    genres only add to the scores of those candidates, since going
+    through their films would cost a scan of the catalog for every film.
+    """
+
+    def __init__(self, weights=None, max_df=1000):
+        self.kind_weights = weights or getattr(
+            settings, "SIMILAR_FILMS_WEIGHTS", WEIGHTS)
+        self.max_df = max_df
+        self.keys = {}
+        self.kinds = []
+
+    def feature(self, kind, value):
+        key = (kind, value)
+        id = self.keys.get(key)
+        if id is None:
+            id = self.keys[key] = len(self.kinds)
+            self.kinds.append(kind)
+        return id
+
+    def load(self):
+        films = defaultdict(list)
+        for pk, country, director, year in (
+                Film.objects.order_by("pk")
+                .values_list("pk", "country_id", "director_id", "year")):
+            row = films[pk]
+            row.append(self.feature("country", country))
+            row.append(self.feature("director", director))
+            if year is not None:
+                decade = year // 10 * 10
+                row.append(self.feature("decade", decade))
+                row.append(self.feature("country_decade", (country, decade)))
+        for kind, through, column in (
+                ("genre", Film.genres.through, "genre_id"),
+                ("person", Film.people.through, "person_id")):
+            for film, value in (through.objects.order_by()
+                                .values_list("film_id", column)):
+                if film in films:
+                    films[film].append(self.feature(kind, value))
+        self.build(films)
+
+    def build(self, films):
+        """Fills the matrix from ``{pk: [feature id, ...]}``."""
+        self.pks = array("q", films)
+        self.positions = {pk: i for i, pk in enumerate(self.pks)}
+        self.indptr = array("q", [0])
+        self.indices = array("q")
+        df = [0] * len(self.kinds)
+        for pk in self.pks:
+            row = films[pk]
+            self.indices.extend(row)
+            self.indptr.append(len(self.indices))
+            for feature in row:
+                df[feature] += 1
+        # Columns by a counting sort of the rows.
+        self.colptr = array("q", [0])
+        for count in df:
+            self.colptr.append(self.colptr[-1] + count)
+        self.rowind = array("q", bytes(8 * len(self.indices)))
+        filled = array("q", self.colptr[:-1])
+        for i in range(len(self.pks)):
+            for feature in self.indices[self.indptr[i]:self.indptr[i + 1]]:
+                self.rowind[filled[feature]] = i
+                filled[feature] += 1
+        n = len(self.pks)
+        self.squares = array("d", (
+            (self.kind_weights[kind] * math.log(1 + n / max(count, 1))) ** 2
+            for kind, count in zip(self.kinds, df)))
+        self.norms = array("d", (
+            math.sqrt(sum(self.squares[feature] for feature in self.row(i)))
+            for i in range(n)))
+        # Frequent features of each film as bits of an int, so those shared
+        # with a candidate are one AND.
+        self.bits = {feature: bit for bit, feature in enumerate(
+            feature for feature in range(len(df)) if self.frequent(feature))}
+        self.masks = [sum(1 << self.bits[feature] for feature in self.row(i)
+                          if feature in self.bits) for i in range(n)]
+
+    def row(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def column(self, feature):
+        return self.rowind[self.colptr[feature]:self.colptr[feature + 1]]
+
+    def frequent(self, feature):
+        return self.colptr[feature + 1] - self.colptr[feature] > self.max_df
+
+    def scores(self, pk):
+        """``{position: score}`` of the candidates of ``pk``."""
+        i = self.positions[pk]
+        scores = defaultdict(float)
+        for feature in self.row(i):
+            if feature in self.bits:
+                continue
+            square = self.squares[feature]
+            for j in self.column(feature):
+                scores[j] += square
+        scores.pop(i, None)
+        mask = self.masks[i]
+        if mask:
+            # Candidates share few distinct sets of frequent features.
+            shared_weights = {0: 0.0}
+            for j in scores:
+                shared = mask & self.masks[j]
+                weight = shared_weights.get(shared)
+                if weight is None:
+                    weight = shared_weights[shared] = sum(
+                        self.squares[feature]
+                        for feature, bit in self.bits.items()
+                        if shared >> bit & 1)
+                scores[j] += weight
+        norm = self.norms[i]
+        for j, score in scores.items():
+            scores[j] = score / (norm * self.norms[j])
+        return scores
+
+    def neighbours(self, pk, k):
+        """Up to ``k`` ``(score, pk)`` of the films most similar to ``pk``,
+        best first."""
+        return [(score, self.pks[j]) for score, j in heapq.nlargest(
+            k, ((score, j) for j, score in self.scores(pk).items()))]
+
+
+def similar(film_id):
+    """The stored neighbours of a film, best first, in one query."""
+    return (Film.objects.filter(similar_to__film=film_id)
+            .order_by("-similar_to__score"))
+
+
+_features = None
+
+
+def init_worker(features):
+    global _features
+    _features = features
+
+
+def neighbours_of(job):
+    """``[(pk, neighbours), ...]`` of a chunk of films, run in workers."""
+    pks, k = job
+    return [(pk, _features.neighbours(pk, k)) for pk in pks]
@@ -1,5 +1,11 @@
 from django import template
 from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import get_template
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+from .. import thumbnails
 
 register = template.Library()
 
@@ -33,3 +39,60 @@ def ru_plural(value, variants):
     else:
         variant = 2
     return variants[variant]
+
+
+@register.simple_tag
+def responsive_image(image, alt="", css_class="", sizes="100vw"):
+    """``<picture>`` with WebP and JPEG ``srcset`` of the thumbnails of
+    ``image``; a plain ``<img>`` of the original until they are built."""
+    if not image:
+        return ""
+    name = image.name
+    storage = image.storage
+    widths = thumbnails.derivative_widths(name, storage)
+    if not widths:
+        return format_html('<img src="{}" alt="{}" class="{}" />',
+                           image.url, alt, css_class)
+
+    def srcset(fmt):
+        return ", ".join(
+            f"{storage.url(thumbnails.derivative_name(name, width, fmt))} "
+            f"{width}w" for width in widths)
+
+    fallback = thumbnails.derivative_name(name, widths[-1], "jpeg")
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}" />'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" '
+        'loading="lazy" decoding="async" style="background: url({}) '
+        'center / cover no-repeat" /></picture>',
+        srcset("webp"), sizes, storage.url(fallback), srcset("jpeg"), sizes,
+        alt, css_class, storage.url(thumbnails.placeholder_name(name)))
+
+
+def card_cache():
+    return caches[getattr(settings, "CARD_CACHE_ALIAS", "default")]
+
+
+def card_key(template_name, obj):
+    return (f"card:{template_name}:{obj._meta.model_name}:{obj.pk}:"
+            f"{obj.updated_at.timestamp()}")
+
+
+@register.simple_tag
+def cached_cards(objects, template_name):
+    """Rendered ``template_name`` for each of ``objects``, cached by
+    model, primary key and ``updated_at``. The cards of a page are read
+    with one ``get_many`` and only the missing ones are rendered."""
+    objects = list(objects)
+    keys = [card_key(template_name, obj) for obj in objects]
+    cards = card_cache().get_many(keys)
+    missing = {}
+    if len(cards) < len(keys):
+        card = get_template(template_name)
+        for key, obj in zip(keys, objects):
+            if key not in cards:
+                missing[key] = card.render({obj._meta.model_name: obj})
+        card_cache().set_many(missing,
+                              getattr(settings, "CARD_CACHE_TIMEOUT", 86400))
+        cards.update(missing)
+    return [mark_safe(cards[key]) for key in keys]
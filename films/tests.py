@@ -1,3 +1,1660 @@
-from django.test import TestCase
+import contextlib
+import importlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import urllib.parse
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.http import Http404, HttpResponse, QueryDict
+from django.test import (AsyncRequestFactory, RequestFactory,
+                         SimpleTestCase, TestCase, TransactionTestCase)
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+from django.utils.http import urlencode
+from PIL import Image
+import requests
+from . import async_views, pagecache, routers, thumbnails, urls
+from .autocomplete import person_index
+from .counters import recount
+from .management.commands import audit_queries
+from .management.commands.loadtest import MIX
+from .management.catalog import CatalogGenerator
+from .management.downloader import ImageDownloader
+from .management.commands import get_films
+from .management.importer import (BulkImporter, differs, fingerprint,
+                                  read_films, update_changed)
+from .management.fetcher import Checkpoint, KinopoiskFetcher
+from .facets import film_facets, parse_filters, positions
+from .helpers import encode_cursor, paginate, render_markdown
+from .search import search
+from .similar import Features
+from .routers import PrimaryPinMiddleware, PrimaryReplicaRouter
+from .templatetags.films_tags import card_cache, responsive_image
+from .models import (Comment, Country, Film, Genre, Person, Post, Section,
+                     SimilarFilm)
 
-# Create your tests here.
+# Maximum number of queries of a GET request by a logged in superuser,
+# including the two queries loading the session and the user, and the one
+# computing the validator of a detail page (films/conditional.py).
+QUERY_BUDGETS = {
+    'home': 3,
+    'country_list': 3,
+    'country_detail': 4,
+    'country_create': 2,
+    'country_update': 3,
+    'country_delete': 3,
+    'country_autocomplete': 2,
+    'genre_list': 3,
+    'genre_detail': 4,
+    'genre_create': 2,
+    'genre_update': 3,
+    'genre_delete': 3,
+    'film_list': 3,
+    'film_detail': 7,
+    'film_create': 3,
+    'film_update': 9,
+    'film_delete': 3,
+    'person_list': 3,
+    'person_detail': 6,
+    'person_create': 2,
+    'person_update': 3,
+    'person_delete': 3,
+    'person_autocomplete': 2,
+    'post_list': 3,
+    'post_detail': 6,
+    'post_update': 4,
+    'post_delete': 3,
+    'post_create': 2,
+    'comment_delete': 3,
+    'comment_update': 3,
+    'film_api_list': 3,
+    'film_api_detail': 3,
+    'person_api_list': 1,
+    'person_api_detail': 1,
+    'genre_api_list': 1,
+    'genre_api_detail': 1,
+    'country_api_list': 1,
+    'country_api_detail': 1,
+    'post_api_list': 1,
+    'post_api_detail': 1,
+}
+
+
+def png(width=8, height=8):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "red").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@contextlib.contextmanager
+def serve(handler):
+    """Serves ``handler`` on a local HTTP server; yields its base URL."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class QueryBudgetTest(TestCase):
+    """Every route of films/urls.py stays within its query budget, and the
+    number of queries does not grow with the amount of related data."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_superuser(
+            "admin", password="admin")
+        cls.country = Country.objects.create(name="Страна")
+        cls.genre = Genre.objects.create(name="Жанр")
+        cls.person = Person.objects.create(name="Персона")
+        cls.film = Film.objects.create(name="Фильм", country=cls.country,
+                                       director=cls.person)
+        cls.post = Post.objects.create(name="Новость", slug="news",
+                                       author=cls.user)
+        cls.comment = Comment.objects.create(author=cls.user, body="Текст",
+                                             post=cls.post)
+        cls.add_rows(1)
+
+    @classmethod
+    def add_rows(cls, count):
+        users = [get_user_model().objects.create_user(f"user{i}-{count}")
+                 for i in range(count)]
+        for i in range(count):
+            genre = Genre.objects.create(name=f"Жанр {i}-{count}")
+            person = Person.objects.create(name=f"Персона {i}-{count}")
+            film = Film.objects.create(name=f"Фильм {i}-{count}",
+                                       country=cls.country,
+                                       director=cls.person)
+            film.genres.add(genre, cls.genre)
+            film.people.add(person, cls.person)
+            cls.film.genres.add(genre)
+            cls.film.people.add(person)
+            cls.person.film_set.add(film)
+            Section.objects.create(post=cls.post, name=f"Секция {i}",
+                                   body=f"**{i}**", position=i)
+            Comment.objects.create(author=users[i], body=f"Комментарий {i}",
+                                   post=cls.post)
+
+    def url(self, pattern):
+        kwargs = {}
+        if "id" in pattern.pattern.converters:
+            model = pattern.name.split("_")[0]
+            kwargs["id"] = getattr(self, model).id
+        if "comment_id" in pattern.pattern.converters:
+            kwargs = {"post_id": self.post.id, "comment_id": self.comment.id}
+        return reverse(f"{urls.app_name}:{pattern.name}", kwargs=kwargs)
+
+    def count_queries(self, url):
+        # The first request fills process-wide caches.
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+            if response.streaming:
+                b"".join(response.streaming_content)
+        self.assertEqual(response.status_code, 200, url)
+        return len(queries)
+
+    def test_query_budgets(self):
+        self.client.force_login(self.user)
+        patterns = [pattern for pattern in urls.urlpatterns
+                    if isinstance(pattern, URLPattern)]
+        self.assertEqual({pattern.name for pattern in patterns},
+                         set(QUERY_BUDGETS))
+        small = {pattern.name: self.count_queries(self.url(pattern))
+                 for pattern in patterns}
+        self.add_rows(10)
+        for pattern in patterns:
+            url = self.url(pattern)
+            with self.subTest(url=url):
+                large = self.count_queries(url)
+                self.assertLessEqual(large, QUERY_BUDGETS[pattern.name])
+                self.assertEqual(large, small[pattern.name])
+
+
+class CursorPaginationTest(TestCase):
+    """Keyset pages walk ties on the sort key in both directions and treat
+    a tampered cursor as the first page."""
+
+    @classmethod
+    def setUpTestData(cls):
+        for name, count in [("Борис", 3), ("Анна", 1), ("Борис", 1),
+                            ("Вера", 3), ("Борис", 3), ("Анна", 1),
+                            ("Глеб", 0)]:
+            Person.objects.create(name=name, film_count=count)
+
+    def page(self, queryset, link="?"):
+        return paginate(RequestFactory().get("/" + link), queryset, per=2)
+
+    def walk(self, queryset):
+        pages = [self.page(queryset)]
+        while pages[-1].has_next():
+            pages.append(self.page(queryset, pages[-1].next_link))
+        back = [pages[-1]]
+        while back[-1].has_previous():
+            back.append(self.page(queryset, back[-1].previous_link))
+        self.assertEqual([[p.pk for p in page] for page in reversed(back)],
+                         [[p.pk for p in page] for page in pages])
+        return [person.pk for page in pages for person in page]
+
+    def test_ties(self):
+        for ordering in [["name"], ["-film_count", "name"]]:
+            queryset = Person.objects.order_by(*ordering)
+            with self.subTest(ordering=ordering):
+                self.assertEqual(self.walk(queryset),
+                                 list(queryset.order_by(*ordering, "pk")
+                                      .values_list("pk", flat=True)))
+
+    def test_links(self):
+        people = Person.objects.all()
+        first = self.page(people, "?query=&sort=name")
+        self.assertIsNone(first.previous_link)
+        self.assertEqual(first.first_link, "?query=&sort=name")
+        self.assertIn("sort=name", first.next_link)
+        second = self.page(people, first.next_link)
+        self.assertTrue(second.has_previous())
+        self.assertEqual(list(self.page(people, second.previous_link)),
+                         list(first))
+        # Numbered pages still work.
+        self.assertEqual(self.page(people, "?page=2").number, 2)
+
+    def test_tampered(self):
+        people = Person.objects.all()
+        first = list(self.page(people))
+        cursors = ["!!!", "bm90IGpzb24",
+                   encode_cursor("sideways", ["Анна", 1]),
+                   encode_cursor("next", ["Анна"]),
+                   encode_cursor("next", ["Анна", "x"]),
+                   encode_cursor("next", [None, 1])]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                page = self.page(people, "?" + urlencode({"cursor": cursor}))
+                self.assertEqual(list(page), first)
+                self.assertIsNone(page.previous_link)
+
+
+class PageCacheTest(TestCase):
+    """Anonymous pages are served from the cache until an object shown on
+    them changes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.country = Country.objects.create(name="Страна")
+        cls.genre = Genre.objects.create(name="Жанр")
+        cls.director = Person.objects.create(name="Режиссёр")
+        cls.film = Film.objects.create(name="Первый", country=cls.country,
+                                       director=cls.director)
+        cls.other = Film.objects.create(name="Второй", country=cls.country,
+                                        director=cls.director)
+
+    def setUp(self):
+        pagecache.cache().clear()
+
+    def get(self, name, obj=None):
+        args = [obj.id] if obj else []
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(f"films:{name}", args=args))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode(), len(queries)
+
+    def assertCached(self, name, obj=None):
+        self.assertEqual(self.get(name, obj)[1], 0)
+
+    def test_edit_purges_only_pages_of_the_object(self):
+        for name, obj in [("film_detail", self.film),
+                          ("film_detail", self.other),
+                          ("film_list", None),
+                          ("country_detail", self.country)]:
+            self.get(name, obj)
+            self.assertCached(name, obj)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.film.name = "Изменённый"
+            self.film.save()
+        self.assertIn("Изменённый", self.get("film_detail", self.film)[0])
+        self.assertIn("Изменённый", self.get("film_list")[0])
+        self.assertIn("Изменённый",
+                      self.get("country_detail", self.country)[0])
+        self.assertCached("film_detail", self.other)
+
+    def test_related_changes(self):
+        self.get("genre_detail", self.genre)
+        self.get("film_detail", self.film)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.film.genres.add(self.genre)
+        self.assertIn("Первый", self.get("genre_detail", self.genre)[0])
+        self.assertIn("Жанр", self.get("film_detail", self.film)[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.director.name = "Другой режиссёр"
+            self.director.save()
+        self.assertIn("Другой режиссёр",
+                      self.get("film_detail", self.film)[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.film.genres.clear()
+        self.assertNotIn("Первый", self.get("genre_detail", self.genre)[0])
+
+    def test_logged_in_users_are_not_cached(self):
+        self.client.force_login(get_user_model().objects.create_superuser(
+            "admin", password="admin"))
+        self.get("film_detail", self.film)
+        self.assertGreater(self.get("film_detail", self.film)[1], 0)
+
+
+class CardCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        country = Country.objects.create(name="Страна")
+        director = Person.objects.create(name="Режиссёр")
+        cls.films = [Film.objects.create(name=f"Фильм {i}", country=country,
+                                         director=director)
+                     for i in range(3)]
+
+    def setUp(self):
+        card_cache().clear()
+        self.client.force_login(get_user_model().objects.create_superuser(
+            "admin", password="admin"))
+
+    def test_cards_follow_updated_at(self):
+        self.client.get(reverse("films:film_list"))
+        with self.assertTemplateNotUsed("films/film.html"):
+            self.client.get(reverse("films:film_list"))
+        film = self.films[1]
+        film.name = "Новое название"
+        film.save()
+        response = self.client.get(reverse("films:film_list"))
+        self.assertContains(response, "Новое название")
+        self.assertNotContains(response, "Фильм 1<")
+
+
+class RouterTest(SimpleTestCase):
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter(replicas=["replica"])
+        self.factory = RequestFactory()
+
+    def serve(self, request, write=None):
+        reads = []
+
+        def view(request):
+            reads.append(self.router.db_for_read(Film))
+            if write is not None:
+                self.assertEqual(self.router.db_for_write(write), "default")
+                reads.append(self.router.db_for_read(Film))
+            return HttpResponse()
+
+        response = PrimaryPinMiddleware(view)(request)
+        return response, reads
+
+    def test_reads_go_to_replicas_until_a_write(self):
+        response, reads = self.serve(self.factory.get("/"))
+        self.assertEqual(reads, ["replica"])
+        self.assertNotIn("primary_pin", response.cookies)
+        response, reads = self.serve(self.factory.post("/"), write=Comment)
+        self.assertEqual(reads, ["default", "default"])
+        self.assertIn("primary_pin", response.cookies)
+
+    def test_pinned_after_write(self):
+        _, reads = self.serve(self.factory.get("/"), write=Comment)
+        self.assertEqual(reads, ["replica", "default"])
+        # The next request of the same browser reads its own write.
+        self.factory.cookies["primary_pin"] = "1"
+        _, reads = self.serve(self.factory.get("/"))
+        self.assertEqual(reads, ["default"])
+
+    def test_sessions_stay_on_primary(self):
+        from django.contrib.sessions.models import Session
+        self.assertEqual(self.router.db_for_read(Session), "default")
+        response, reads = self.serve(self.factory.get("/"), write=Session)
+        self.assertEqual(reads, ["replica", "replica"])
+        self.assertNotIn("primary_pin", response.cookies)
+
+
+class ReplicaTest(TransactionTestCase):
+    """Reads go to a replica file copied by ``replicate``, except those of
+    a browser that has just written."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # Files stand in for the test database, which lives in memory.
+        # Connections set on the handler are allowed in tests.
+        memory = connections["default"]
+        databases = {
+            alias: memory.__class__(dict(
+                memory.settings_dict,
+                NAME=os.path.join(directory.name, f"{alias}.sqlite3")),
+                alias)
+            for alias in ("default", "replica1")}
+        for alias, database in databases.items():
+            connections[alias] = database
+
+        def restore():
+            for database in databases.values():
+                database.close()
+            del connections["replica1"]
+            connections["default"] = memory
+        self.addCleanup(restore)
+        self.enterContext(self.settings(
+            DATABASE_REPLICAS=["replica1"],
+            DATABASE_ROUTERS=["films.routers.PrimaryReplicaRouter"]))
+        # Writes of the test itself pin its context.
+        self.addCleanup(routers._pin.reset, routers._pin.set(routers.Pin()))
+        call_command("migrate", verbosity=0)
+
+    def replicate(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_command("replicate")
+
+    def status(self, film):
+        return self.client.get(reverse("films:film_detail",
+                                       kwargs={"id": film.id})).status_code
+
+    def test_replicate_and_pin(self):
+        user = get_user_model().objects.create_superuser(
+            "admin", password="admin")
+        country = Country.objects.create(name="Страна")
+        director = Person.objects.create(name="Режиссёр")
+        old = Film.objects.create(name="Старый", country=country,
+                                  director=director)
+        self.replicate()
+        new = Film.objects.create(name="Новый", country=country,
+                                  director=director)
+        self.client.force_login(user)
+        # The replica lags behind the primary.
+        self.assertEqual(self.status(old), 200)
+        self.assertEqual(self.status(new), 404)
+        response = self.client.post(reverse("films:country_create"),
+                                    {"name": "Новая"})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn("primary_pin", response.cookies)
+        # The browser that wrote reads the primary until the cookie ends.
+        self.assertEqual(self.status(new), 200)
+        del self.client.cookies["primary_pin"]
+        self.assertEqual(self.status(new), 404)
+        self.replicate()
+        self.assertEqual(self.status(new), 200)
+
+
+class AsyncViewTest(TestCase):
+    """The async views render the pages of the sync ones."""
+
+    @classmethod
+    def setUpTestData(cls):
+        country = Country.objects.create(name="Страна")
+        genre = Genre.objects.create(name="Жанр")
+        cls.director = Person.objects.create(name="Режиссёр")
+        actor = Person.objects.create(name="Актёр")
+        cls.film = Film.objects.create(name="Фильм", country=country,
+                                       director=cls.director)
+        cls.film.genres.add(genre)
+        cls.film.people.add(actor)
+
+    def setUp(self):
+        pagecache.cache().clear()
+
+    def assertSamePage(self, name, args=(), query=None):
+        url = reverse(f"films:{name}", args=args)
+        expected = self.client.get(url, query)
+        pagecache.cache().clear()
+        request = AsyncRequestFactory().get(url, query)
+        request.user = AnonymousUser()
+        response = async_to_sync(getattr(async_views, name))(request, *args)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.content, expected.content)
+
+    def test_pages(self):
+        self.assertSamePage("film_list")
+        self.assertSamePage("film_list", query={"query": "фильм"})
+        self.assertSamePage("film_list", query={"page": "1"})
+        self.assertSamePage("film_detail", [self.film.id])
+        self.assertSamePage("person_detail", [self.director.id])
+        self.assertSamePage("person_list")
+        self.assertSamePage("country_list")
+        self.assertSamePage("genre_list")
+        self.assertSamePage("post_list")
+        self.assertSamePage("person_autocomplete", query={"q": "акт"})
+        self.assertSamePage("country_autocomplete", query={"q": "ст"})
+
+    def test_missing_object(self):
+        request = AsyncRequestFactory().get("/")
+        request.user = AnonymousUser()
+        with self.assertRaises(Http404):
+            async_to_sync(async_views.film_detail)(request, 0)
+
+
+class ApiTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        country = Country.objects.create(name="Страна")
+        cls.genre = Genre.objects.create(name="Жанр")
+        director = Person.objects.create(name="Режиссёр")
+        cls.films = [Film.objects.create(name=f"Фильм {i}", year=2000 + i,
+                                         country=country, director=director)
+                     for i in range(5)]
+        cls.films[1].genres.add(cls.genre)
+
+    def get_json(self, url, **params):
+        response = self.client.get(url, params)
+        content = b"".join(response.streaming_content) \
+            if response.streaming else response.content
+        return response.status_code, json.loads(content)
+
+    def test_fields_and_ids(self):
+        film = self.films[1]
+        status, data = self.get_json(
+            reverse("films:film_api_detail", args=[film.id]),
+            fields="name,genres,country")
+        self.assertEqual(status, 200)
+        self.assertEqual(data, {"name": film.name, "genres": [self.genre.id],
+                                "country": film.country_id})
+        ids = [self.films[3].id, self.films[0].id, 0]
+        with self.assertNumQueries(1):
+            status, data = self.get_json(
+                reverse("films:film_api_list"), fields="id,year",
+                ids=",".join(map(str, ids)))
+        self.assertEqual(data["results"], [
+            {"id": self.films[3].id, "year": 2003},
+            {"id": self.films[0].id, "year": 2000}])
+
+    def test_cursor_pagination(self):
+        url = reverse("films:film_api_list")
+        seen = []
+        params = {"fields": "id", "limit": 2}
+        while True:
+            status, data = self.get_json(url, **params)
+            self.assertEqual(status, 200)
+            seen.extend(row["id"] for row in data["results"])
+            if data["next"] is None:
+                break
+            params = dict(QueryDict(data["next"].partition("?")[2]).items())
+        self.assertEqual(seen, sorted(film.id for film in self.films))
+
+    def test_errors(self):
+        url = reverse("films:film_api_list")
+        self.assertEqual(self.get_json(url, fields="password")[0], 400)
+        self.assertEqual(self.get_json(url, ids="1,x")[0], 400)
+        self.assertEqual(self.get_json(url, cursor="bad")[0], 400)
+        self.assertEqual(self.client.post(url).status_code, 405)
+        self.assertEqual(self.get_json(
+            reverse("films:film_api_detail", args=[0]))[0], 404)
+
+
+class ConditionalGetTest(TestCase):
+    """Unchanged pages are answered with 304 before rendering."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_superuser(
+            "admin", password="admin")
+        cls.genre = Genre.objects.create(name="Жанр")
+        cls.film = Film.objects.create(
+            name="Фильм", country=Country.objects.create(name="Страна"),
+            director=Person.objects.create(name="Режиссёр"))
+        cls.film.genres.add(cls.genre)
+
+    def setUp(self):
+        pagecache.cache().clear()
+        self.client.force_login(self.user)
+
+    def get(self, url):
+        # The first page of a user sets the CSRF cookie the ETag covers.
+        self.client.get(url)
+        return self.client.get(url)
+
+    def revalidate(self, url, response):
+        return self.client.get(url, headers={
+            "if-none-match": response["ETag"]}).status_code
+
+    def test_detail(self):
+        url = reverse("films:film_detail", args=[self.film.id])
+        response = self.get(url)
+        self.assertIn("Last-Modified", response)
+        with self.assertTemplateNotUsed("films/film/detail.html"):
+            self.assertEqual(self.revalidate(url, response), 304)
+        self.assertEqual(self.client.get(url, headers={
+            "if-modified-since": response["Last-Modified"]}).status_code,
+            304)
+        self.film.genres.remove(self.genre)
+        self.assertEqual(self.revalidate(url, response), 200)
+        response = self.client.get(url)
+        self.film.director.name = "Другой режиссёр"
+        self.film.director.save()
+        self.assertEqual(self.revalidate(url, response), 200)
+
+    def test_similar_scores(self):
+        others = [Film.objects.create(name=f"Похожий {i}",
+                                      country=self.film.country,
+                                      director=self.film.director)
+                  for i in range(2)]
+        for score, other in zip([0.9, 0.5], others):
+            SimilarFilm.objects.create(film=self.film, similar=other,
+                                       score=score)
+        url = reverse("films:film_detail", args=[self.film.id])
+        response = self.get(url)
+        self.assertEqual(self.revalidate(url, response), 304)
+        # The same neighbours in another order.
+        for score, other in zip([0.5, 0.9], others):
+            SimilarFilm.objects.filter(similar=other).update(score=score)
+        self.assertEqual(self.revalidate(url, response), 200)
+
+    def test_render_sections(self):
+        post = Post.objects.create(name="Новость", slug="news",
+                                   author=self.user)
+        Section.objects.create(post=post, name="Таблица",
+                               body="a | b\n--|--\n1 | 2")
+        url = reverse("films:post_detail", args=[post.id])
+        response = self.get(url)
+        self.assertNotContains(response, "<table>")
+        with self.settings(MARKDOWN_EXTENSIONS=["tables"]), \
+                contextlib.redirect_stdout(io.StringIO()):
+            call_command("render_sections")
+        self.assertEqual(self.revalidate(url, response), 200)
+        self.assertContains(self.client.get(url), "<table>")
+
+    def test_list(self):
+        url = reverse("films:film_list")
+        response = self.get(url)
+        self.assertEqual(self.revalidate(url, response), 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.film.name = "Новое название"
+            self.film.save()
+        self.assertEqual(self.revalidate(url, response), 200)
+
+    def test_user_and_cached_pages(self):
+        url = reverse("films:film_detail", args=[self.film.id])
+        response = self.get(url)
+        self.client.logout()
+        self.assertEqual(self.revalidate(url, response), 200)
+        response = self.client.get(url)
+        # Served from the page cache.
+        with self.assertNumQueries(0):
+            self.assertEqual(self.revalidate(url, response), 304)
+
+
+class CounterTest(TestCase):
+    """Counter columns follow the rows they count."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.country = Country.objects.create(name="Страна")
+        cls.genre = Genre.objects.create(name="Жанр")
+        cls.director = Person.objects.create(name="Режиссёр")
+        cls.actor = Person.objects.create(name="Актёр")
+        cls.film = Film.objects.create(name="Фильм", country=cls.country,
+                                       director=cls.director)
+        cls.user = get_user_model().objects.create_user("reader")
+        cls.post = Post.objects.create(name="Новость", slug="news",
+                                       author=cls.user)
+
+    def assertCounts(self, obj, **counts):
+        obj.refresh_from_db()
+        self.assertEqual({name: getattr(obj, name) for name in counts},
+                         counts)
+
+    def test_films(self):
+        self.assertCounts(self.country, film_count=1)
+        self.assertCounts(self.director, directed_count=1, film_count=0)
+        self.film.genres.add(self.genre)
+        self.film.people.add(self.actor, self.director)
+        self.film.people.add(self.actor)
+        self.assertCounts(self.genre, film_count=1)
+        self.assertCounts(self.actor, film_count=1)
+        self.film.people.remove(self.actor, Person.objects.create(name="X"))
+        self.assertCounts(self.actor, film_count=0)
+        self.assertCounts(self.director, film_count=1)
+        self.actor.film_set.add(self.film)
+        self.assertCounts(self.actor, film_count=1)
+        self.genre.film_set.clear()
+        self.assertCounts(self.genre, film_count=0)
+
+        other = Country.objects.create(name="Другая страна")
+        film = Film.objects.get(pk=self.film.pk)
+        film.country = other
+        film.director = self.actor
+        film.save()
+        self.assertCounts(self.country, film_count=0)
+        self.assertCounts(other, film_count=1)
+        self.assertCounts(self.director, directed_count=0)
+        self.assertCounts(self.actor, directed_count=1)
+        film.delete()
+        self.assertCounts(other, film_count=0)
+        self.assertCounts(self.actor, directed_count=0, film_count=0)
+        self.assertCounts(self.director, film_count=0)
+
+    def test_comments(self):
+        comment = Comment.objects.create(author=self.user, body="Текст",
+                                         post=self.post)
+        self.assertCounts(self.post, comment_count=1)
+        comment.delete()
+        self.assertCounts(self.post, comment_count=0)
+
+    def test_recount(self):
+        self.film.genres.add(self.genre)
+        Genre.objects.update(film_count=5)
+        Country.objects.update(film_count=0)
+        fixed = recount()
+        self.assertEqual(fixed["genre.film_count"], 1)
+        self.assertEqual(fixed["country.film_count"], 1)
+        self.assertEqual(fixed["person.film_count"], 0)
+        self.assertCounts(self.genre, film_count=1)
+        self.assertCounts(self.country, film_count=1)
+
+    def test_sort_by_popularity(self):
+        self.film.people.add(self.director)
+        url = reverse("films:person_list")
+        people = self.client.get(url, {"sort": "popular"}).context["people"]
+        self.assertEqual([person.pk for person in people],
+                         [self.director.pk, self.actor.pk])
+        people = self.client.get(url).context["people"]
+        self.assertEqual([person.pk for person in people],
+                         [self.actor.pk, self.director.pk])
+
+
+class SearchTest(TestCase):
+    """Full-text search folds case and ё but keeps й, and ranks matches
+    in names first."""
+
+    @classmethod
+    def setUpTestData(cls):
+        country = Country.objects.create(name="Страна")
+        director = Person.objects.create(name="Режиссёр")
+        for name, description in [("Бой с тенью", ""),
+                                  ("Бои без правил", ""),
+                                  ("Ёлки", ""),
+                                  ("Праздник", "Про ёлки и бой курантов")]:
+            Film.objects.create(name=name, description=description,
+                                country=country, director=director)
+
+    def names(self, query):
+        return [film.name for film in search(Film.objects.all(), query)]
+
+    def test_folding(self):
+        self.assertEqual(self.names("БОЙ"), ["Бой с тенью", "Праздник"])
+        self.assertEqual(self.names("бои"), ["Бои без правил"])
+        self.assertEqual(self.names("ТЕНЬ"), ["Бой с тенью"])
+        self.assertEqual(self.names("елки"), ["Ёлки", "Праздник"])
+        self.assertEqual(self.names("режиссёр"), [])
+        self.assertEqual(self.names("!"), [])
+
+    def test_indexes_follow_writes(self):
+        # Rebuilding a table in a migration drops its triggers.
+        person = Person.objects.create(name="Фёдор Бондарчук")
+        post = Post.objects.create(name="Премьера", slug="premiere",
+                                   author=get_user_model().objects.create())
+        Section.objects.create(post=post, name="Зал", body="Фёдор в зале")
+        self.assertEqual(list(search(Person.objects.all(), "федор")),
+                         [person])
+        self.assertEqual(list(search(Post.objects.all(), "федор")), [post])
+        person.name = "Сергей Бондарчук"
+        person.save()
+        self.assertEqual(list(search(Person.objects.all(), "федор")), [])
+        post.delete()
+        self.assertEqual(list(search(Post.objects.all(), "зал")), [])
+
+    def test_triggers(self):
+        # Remaking a table in a migration drops its triggers.
+        search_index = importlib.import_module(
+            "films.migrations.0005_search_index")
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master "
+                           "WHERE type = 'trigger'")
+            triggers = {name for name, in cursor.fetchall()}
+        self.assertEqual(len(search_index.TRIGGERS), 12)
+        self.assertLessEqual(set(search_index.TRIGGERS), triggers)
+
+    def test_ranking(self):
+        # A match in the name outweighs one in the description, whatever
+        # the alphabetical order.
+        Film.objects.filter(name="Праздник").update(name="Абв")
+        self.assertEqual(self.names("ёлки"), ["Ёлки", "Абв"])
+        films = search(Film.objects.all(), "ёлки")
+        self.assertLess(films[0].search_rank, films[1].search_rank)
+        # Pages of a search are numbered.
+        response = self.client.get(reverse("films:film_list"),
+                                   {"query": "бой"})
+        self.assertEqual([film.name for film in response.context["films"]],
+                         ["Бой с тенью", "Абв"])
+
+
+class SectionTest(TestCase):
+    """Sections store the HTML of their body, rendered through a cache."""
+
+    @classmethod
+    def setUpTestData(cls):
+        post = Post.objects.create(name="Премьера", slug="premiere",
+                                   author=get_user_model().objects.create())
+        cls.section = Section.objects.create(post=post, name="Зал",
+                                             body="*Фёдор* в зале")
+
+    def test_render_markdown(self):
+        with mock.patch("markdown.markdown", return_value="<p>x</p>") as md:
+            self.assertEqual(render_markdown("Текст без кэша"), "<p>x</p>")
+            self.assertEqual(render_markdown("Текст без кэша"), "<p>x</p>")
+            self.assertEqual(md.call_count, 1)
+            with self.settings(MARKDOWN_EXTENSIONS=["tables"]):
+                render_markdown("Текст без кэша")
+            self.assertEqual(md.call_count, 2)
+
+    def test_save(self):
+        self.assertEqual(self.section.body_html,
+                         "<p><em>Фёдор</em> в зале</p>")
+        section = Section.objects.get(pk=self.section.pk)
+        section.body = "Фёдор"
+        section.save(update_fields=["body"])
+        self.assertEqual(Section.objects.get(pk=section.pk).body_html,
+                         "<p>Фёдор</p>")
+        # A body that is not saved is not rendered.
+        section.body = "Сергей"
+        section.save(update_fields=["name"])
+        self.assertEqual(Section.objects.get(pk=section.pk).body_html,
+                         "<p>Фёдор</p>")
+
+    def test_fill_missing(self):
+        # Rows saved before body_html existed get it on any save.
+        Section.objects.update(body_html=None)
+        section = Section.objects.only("pk", "name").get()
+        section.name = "Фойе"
+        section.save(update_fields=["name"])
+        self.assertEqual(Section.objects.get().body_html,
+                         "<p><em>Фёдор</em> в зале</p>")
+        # A bare instance has no body to render.
+        Section.objects.update(body_html=None)
+        Section(pk=section.pk, post_id=section.post_id,
+                name="Зал").save(update_fields=["name"])
+        self.assertIsNone(Section.objects.get().body_html)
+
+
+class AutocompleteTest(TestCase):
+    """The prefix index follows writes and is rebuilt without blocking
+    searches."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.person = Person.objects.create(name="Андрей Тарковский")
+
+    def setUp(self):
+        person_index._built_at = None
+
+    def names(self, query):
+        return [name for _, name in person_index.search(query)]
+
+    def test_bare_saves(self):
+        self.assertEqual(self.names("анд"), ["Андрей Тарковский"])
+        # Photos are saved on bare people, whose name is None.
+        Person(pk=self.person.pk).save(update_fields=["photo", "updated_at"])
+        self.assertEqual(self.names("анд"), ["Андрей Тарковский"])
+
+    def test_rebuild(self):
+        self.names("")
+        # A stale index being rebuilt by another request answers as is.
+        person_index._built_at -= person_index.ttl + 1
+        with person_index._build_lock, self.assertNumQueries(0):
+            self.assertEqual(self.names("анд"), ["Андрей Тарковский"])
+        # Writes made while the table is read are applied to the new index.
+        read = person_index.read
+
+        def read_and_rename():
+            built = read()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.person.name = "Арсений Тарковский"
+                self.person.save()
+            return built
+        with mock.patch.object(person_index, "read", read_and_rename):
+            self.names("")
+        self.assertEqual(self.names("анд"), [])
+        self.assertEqual(self.names("арс"), ["Арсений Тарковский"])
+
+    def test_rollback(self):
+        self.names("")
+        with self.captureOnCommitCallbacks(execute=True), \
+                self.assertRaises(ValueError), transaction.atomic():
+            Person.objects.create(name="Андрей Рублёв")
+            self.person.delete()
+            raise ValueError
+        self.assertEqual(self.names("анд"), ["Андрей Тарковский"])
+
+
+class FacetTest(TestCase):
+    """The bitmap index answers like the database, also after writes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.russia = Country.objects.create(name="Россия")
+        cls.france = Country.objects.create(name="Франция")
+        cls.drama = Genre.objects.create(name="Драма")
+        cls.comedy = Genre.objects.create(name="Комедия")
+        cls.director = Person.objects.create(name="Режиссёр")
+        cls.films = []
+        for i in range(30):
+            film = Film.objects.create(
+                name=f"Фильм {i:02}", director=cls.director,
+                country=cls.russia if i % 3 else cls.france,
+                year=1960 + i, length=80 + i)
+            film.genres.add(cls.drama if i % 2 else cls.comedy)
+            cls.films.append(film)
+
+    def setUp(self):
+        film_facets._built_at = None
+
+    def query(self, **params):
+        filters = parse_filters(QueryDict(urlencode(params, doseq=True)))
+        matches, facets = film_facets.query(filters)
+        return [film.name for film in matches[:len(matches)]], facets
+
+    def expected(self, films):
+        return sorted(film.name for film in films)
+
+    def test_filters(self):
+        names, facets = self.query(genre=[str(self.drama.pk)],
+                                   country=[str(self.russia.pk)])
+        self.assertEqual(names, self.expected(
+            Film.objects.filter(genres=self.drama, country=self.russia)))
+        # Counts of a facet ignore its own selection.
+        self.assertEqual(
+            {value: count for value, _, count, _ in facets["genre"]},
+            {self.drama.pk: 10, self.comedy.pk: 10})
+        names, facets = self.query(decade=["1970"], length_min="95")
+        self.assertEqual(names, self.expected(
+            Film.objects.filter(year__range=(1970, 1979), length__gte=95)))
+        self.assertEqual(dict((value, count) for value, _, count, _
+                              in facets["decade"]),
+                         {1970: 5, 1980: 10})
+        names, _ = self.query(director=[str(self.director.pk)],
+                              length_max="81")
+        self.assertEqual(names, ["Фильм 00", "Фильм 01"])
+        self.assertEqual(self.query(genre=["x"])[0], self.query()[0])
+
+    def test_updates(self):
+        self.query()
+        with self.captureOnCommitCallbacks(execute=True):
+            film = self.films[0]
+            film.country = self.russia
+            film.year = 2001
+            film.save()
+            film.genres.add(self.drama)
+            self.comedy.film_set.remove(film)
+            new = Film.objects.create(name="Аа", country=self.france,
+                                      director=self.director, year=2005)
+            self.drama.film_set.add(new)
+            self.films[1].delete()
+            self.films[2].genres.clear()
+        names, facets = self.query(genre=[str(self.drama.pk)],
+                                   decade=["2000"])
+        self.assertEqual(names, ["Фильм 00", "Аа"])
+        self.assertEqual(
+            [(value, count) for value, _, count, _ in facets["genre"]],
+            [(self.drama.pk, 2)])
+        # After a rebuild films are in the order of the film list again.
+        film_facets._built_at = None
+        self.assertEqual(self.query(genre=[str(self.drama.pk)],
+                                    decade=["2000"])[0], ["Аа", "Фильм 00"])
+        self.assertEqual(self.query()[0], self.expected(Film.objects.all()))
+
+    def test_rebuild(self):
+        self.query()
+        # A stale index being rebuilt by another request answers as is.
+        film_facets._built_at -= film_facets.ttl + 1
+        with film_facets._build_lock, self.assertNumQueries(0):
+            self.assertEqual(film_facets.query({})[0].count(), 30)
+        # Writes made while the tables are read are applied to the new
+        # index.
+        read = film_facets.read
+
+        def read_and_write():
+            built = read()
+            with self.captureOnCommitCallbacks(execute=True):
+                film = self.films[0]
+                film.year = 2001
+                film.save()
+                film.genres.add(self.drama)
+                self.films[1].delete()
+            return built
+        with mock.patch.object(film_facets, "read", read_and_write):
+            self.query()
+        self.assertEqual(self.query(genre=[str(self.drama.pk)],
+                                    decade=["2000"])[0], ["Фильм 00"])
+        self.assertEqual(len(self.query()[0]), 29)
+
+    def test_rollback(self):
+        self.query()
+        with self.captureOnCommitCallbacks(execute=True), \
+                self.assertRaises(ValueError), transaction.atomic():
+            Film.objects.create(name="Аа", country=self.france,
+                                director=self.director, year=2005)
+            self.films[0].genres.clear()
+            self.films[1].delete()
+            raise ValueError
+        self.assertEqual(self.query()[0], self.expected(Film.objects.all()))
+        self.assertEqual(len(self.query(genre=[str(self.comedy.pk)])[0]), 15)
+
+    def test_search(self):
+        drama = {"genre": {self.drama.pk}}
+        matches, facets = film_facets.query(drama, "фильм 01")
+        self.assertEqual([film.name for film in matches[:10]], ["Фильм 01"])
+        self.assertEqual(
+            [(value, count) for value, _, count, _ in facets["country"]],
+            [(self.russia.pk, 1)])
+        # Matches of a search are read once until the index changes.
+        with self.assertNumQueries(0):
+            film_facets.query({}, "фильм 01")
+        # Images are saved on bare films, which leave the index alone.
+        Film(pk=self.films[1].pk).save(update_fields=["cover", "updated_at"])
+        with self.assertNumQueries(0):
+            matches, facets = film_facets.query(drama, "фильм 01")
+        self.assertEqual(
+            [(value, count) for value, _, count, _ in facets["country"]],
+            [(self.russia.pk, 1)])
+
+    def test_positions(self):
+        bits = sum(1 << n for n in (3, 64, 65, 200, 1000))
+        self.assertEqual(positions(bits, 0, 5), [3, 64, 65, 200, 1000])
+        self.assertEqual(positions(bits, 2, 4), [65, 200])
+        self.assertEqual(positions(bits, 5, 7), [])
+
+    def test_view(self):
+        url = reverse("films:film_list")
+        response = self.client.get(url, {"genre": self.comedy.pk,
+                                         "country": self.france.pk,
+                                         "page": 1})
+        films = response.context["films"]
+        self.assertEqual([film.name for film in films], self.expected(
+            Film.objects.filter(genres=self.comedy, country=self.france)))
+        self.assertContains(response, f'value="{self.comedy.pk}" '
+                            f'id="genre-{self.comedy.pk}" checked')
+
+
+class SimilarFilmTest(TestCase):
+    """Similar films are the films of highest weighted cosine."""
+
+    @classmethod
+    def setUpTestData(cls):
+        country = Country.objects.create(name="Страна")
+        drama = Genre.objects.create(name="Драма")
+        cls.director = Person.objects.create(name="Режиссёр")
+        cls.actor = Person.objects.create(name="Актёр")
+        other = Person.objects.create(name="Другой режиссёр")
+        cls.films = []
+        for i in range(6):
+            film = Film.objects.create(
+                name=f"Фильм {i}", country=country, year=1990 + i,
+                director=cls.director if i < 3 else other)
+            film.genres.add(drama)
+            if i < 2:
+                film.people.add(cls.actor)
+            cls.films.append(film)
+
+    def brute_force(self, features, pk):
+        i = features.positions[pk]
+        row = set(features.row(i))
+        return sorted(
+            ((sum(features.squares[feature] for feature in
+                  row & set(features.row(j)))
+              / (features.norms[i] * features.norms[j]), features.pks[j])
+             for j in range(len(features.pks)) if j != i),
+            reverse=True)
+
+    def test_neighbours(self):
+        for max_df in (1000, 3):
+            features = Features(max_df=max_df)
+            features.load()
+            first = self.films[0].pk
+            neighbours = features.neighbours(first, 10)
+            self.assertEqual([pk for _, pk in neighbours[:2]],
+                             [self.films[1].pk, self.films[2].pk])
+            # Only films sharing a rare feature are candidates; their
+            # scores count the frequent ones too.
+            rare = {feature for feature in
+                    features.row(features.positions[first])
+                    if not features.frequent(feature)}
+            expected = [(score, pk) for score, pk in
+                        self.brute_force(features, first)
+                        if rare & set(features.row(features.positions[pk]))]
+            self.assertEqual(len(neighbours), len(expected))
+            for (score, pk), (expected_score, expected_pk) in zip(
+                    neighbours, expected):
+                self.assertEqual(pk, expected_pk)
+                self.assertAlmostEqual(score, expected_score)
+
+    def scores(self, film):
+        return dict(SimilarFilm.objects.filter(film=film)
+                    .values_list("similar_id", "score"))
+
+    def test_command_and_page(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_command("build_similar", workers=1)
+        url = reverse("films:film_detail", args=[self.films[0].id])
+        similar = [film.pk for film in
+                   self.client.get(url).context["similar_films"]]
+        self.assertEqual(similar[:2], [self.films[1].pk, self.films[2].pk])
+        scores = self.scores(self.films[0])
+        self.assertAlmostEqual(scores[self.films[5].pk],
+                               scores[self.films[3].pk])
+
+        # Incremental runs update the lists the edited films belong to.
+        Film.objects.update(updated_at=timezone.now() - timedelta(days=1))
+        self.films[5].people.add(self.actor)
+        SimilarFilm.objects.filter(film=self.films[1]).delete()
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_command("build_similar", workers=1, since=5)
+        scores = self.scores(self.films[0])
+        self.assertGreater(scores[self.films[5].pk],
+                           scores[self.films[3].pk])
+        self.assertTrue(self.scores(self.films[1]))
+
+
+class ThumbnailTest(SimpleTestCase):
+    """Thumbnails never upscale, and the tag lists the widths built."""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(self.settings(MEDIA_ROOT=media.name,
+                                        THUMBNAIL_WIDTHS=(160, 320, 640)))
+
+    def image(self, name, width):
+        default_storage.save(name, ContentFile(png(width, width // 2)))
+        return Film(cover=name).cover
+
+    def test_generate(self):
+        self.assertFalse(thumbnails.generate("covers/missing.png"))
+        self.assertTrue(thumbnails.generate(self.image("covers/a.png", 200).name))
+        self.assertFalse(thumbnails.generate("covers/a.png"))
+        self.assertEqual(thumbnails.derivative_widths("covers/a.png"),
+                         [160, 200])
+        with default_storage.open("thumbs/covers/a/200.webp") as fp, \
+                Image.open(fp) as image:
+            self.assertEqual(image.size, (200, 100))
+        with default_storage.open("thumbs/covers/a/placeholder.jpeg") as fp, \
+                Image.open(fp) as image:
+            self.assertEqual(image.width, thumbnails.PLACEHOLDER_WIDTH)
+        # A new, larger original replaces every copy.
+        default_storage.delete("covers/a.png")
+        self.image("covers/a.png", 1000)
+        self.assertTrue(thumbnails.generate("covers/a.png", force=True))
+        self.assertEqual(thumbnails.derivative_widths("covers/a.png"),
+                         [160, 320, 640])
+
+    def test_tag(self):
+        cover = self.image("covers/b.png", 300)
+        self.assertEqual(responsive_image(cover, alt="B"),
+                         f'<img src="{cover.url}" alt="B" class="" />')
+        thumbnails.generate(cover.name)
+        html = responsive_image(cover, alt="B")
+        self.assertIn("/thumbs/covers/b/160.webp 160w, "
+                      "/media/thumbs/covers/b/300.webp 300w", html)
+        self.assertIn('src="/media/thumbs/covers/b/300.jpeg"', html)
+        self.assertNotIn("320w", html)
+        self.assertEqual(responsive_image(None), "")
+
+
+class ImageServer(BaseHTTPRequestHandler):
+    # Keep-alive, so that sessions can reuse connections.
+    protocol_version = "HTTP/1.1"
+    requests = []
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            self.requests.append((self.path, self.client_address[1]))
+            attempts = sum(path == self.path for path, _ in self.requests)
+        if self.path == "/missing.png":
+            status, body = 404, b""
+        elif self.path == "/flaky.png" and attempts == 1:
+            status, body = 503, b""
+        else:
+            status, body = 200, png()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ImageDownloaderTest(TestCase):
+    """Images are downloaded in the pool, retried on 5xx and saved by
+    ``collect``."""
+
+    def setUp(self):
+        ImageServer.requests = []
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(self.settings(MEDIA_ROOT=media.name))
+
+    def test_download(self):
+        person = Person.objects.create(name="Персона")
+        country = Country.objects.create(name="Страна")
+        films = [Film.objects.create(name=f"Фильм {i}", country=country,
+                                     director=person) for i in range(3)]
+        downloader = ImageDownloader(workers=1, retries=2)
+        with serve(ImageServer) as url:
+            downloader.submit(films[0], "cover", f"{url}/flaky.png")
+            downloader.submit(films[0], "cover", f"{url}/flaky.png")
+            downloader.submit(films[1], "cover", f"{url}/missing.png")
+            downloader.submit(films[2], "cover", f"{url}/a.png")
+            downloader.submit(person, "photo", f"{url}/b.png")
+            downloader.close()
+        paths = [path for path, _ in ImageServer.requests]
+        # 503 is retried, 404 is not, and a field is downloaded once.
+        self.assertEqual(sorted(paths), ["/a.png", "/b.png", "/flaky.png",
+                                         "/flaky.png", "/missing.png"])
+        for film in films:
+            film.refresh_from_db()
+        person.refresh_from_db()
+        self.assertTrue(films[0].cover.name.startswith("covers/flaky"))
+        self.assertFalse(films[1].cover)
+        self.assertTrue(films[2].cover.name.startswith("covers/a"))
+        self.assertTrue(person.photo.name.startswith("photos/b"))
+        with films[2].cover.open("rb") as image:
+            self.assertEqual(image.read(), png())
+        # The one worker reused its session's connection.
+        ports = {port for path, port in ImageServer.requests
+                 if path in ("/a.png", "/b.png")}
+        self.assertEqual(len(ports), 1)
+
+    def test_sessions_per_thread(self):
+        downloader = ImageDownloader(workers=2)
+        self.addCleanup(downloader.close)
+        sessions = []
+        threads = [threading.Thread(
+            target=lambda: sessions.append(downloader.session()))
+            for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertIsNot(sessions[0], sessions[1])
+        self.assertIs(downloader.session(), downloader.session())
+
+
+class ApiServer(BaseHTTPRequestHandler):
+    """Paginated endpoints like api.kinopoisk.dev: three pages of two
+    movies, the second answered with 429 the first time."""
+
+    protocol_version = "HTTP/1.1"
+    pages = 3
+    requests = []
+    lock = threading.Lock()
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        page = int(urllib.parse.parse_qs(url.query)["page"][0])
+        with self.lock:
+            self.requests.append((url.path, page))
+            attempts = self.requests.count((url.path, page))
+        if page == 2 and attempts == 1:
+            status, body = 429, b""
+        else:
+            status, body = 200, json.dumps({
+                "docs": [{"id": page * 10 + i} for i in range(2)],
+                "pages": self.pages}).encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FetcherTest(SimpleTestCase):
+    """A crawl interrupted midway resumes from its checkpoint."""
+
+    def setUp(self):
+        ApiServer.requests = []
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "checkpoint")
+
+    def crawl(self, url, consume):
+        checkpoint = Checkpoint(self.path)
+        with KinopoiskFetcher(url, {}, checkpoint, workers=1,
+                              retries=2) as fetcher:
+            fetcher.crawl([("movies", "/v1.4/movie", {"limit": 2})], consume)
+        return checkpoint
+
+    def test_resume(self):
+        consumed = []
+
+        def interrupted(docs):
+            if len(consumed) == 2:
+                raise KeyboardInterrupt
+            consumed.extend(doc["id"] for doc in docs)
+
+        with serve(ApiServer) as url:
+            with self.assertRaises(KeyboardInterrupt):
+                self.crawl(url, interrupted)
+            self.assertEqual(Checkpoint(self.path).get("movies"),
+                             {"pages": 3, "done": [1]})
+            checkpoint = self.crawl(
+                url, lambda docs: consumed.extend(doc["id"] for doc in docs))
+        self.assertTrue(checkpoint.resumed)
+        # Every movie once, though page 2 was fetched again after 429.
+        self.assertEqual(sorted(consumed), [10, 11, 20, 21, 30, 31])
+        self.assertEqual(ApiServer.requests.count(("/v1.4/movie", 1)), 1)
+        self.assertGreaterEqual(
+            ApiServer.requests.count(("/v1.4/movie", 2)), 2)
+        checkpoint.clear()
+        self.assertFalse(os.path.exists(self.path))
+
+
+class AuditQueriesTest(TestCase):
+    """audit_queries flags full scans sorted in a temp B-tree."""
+
+    def test_full_scan(self):
+        lines = {
+            "SCAN films_film": "films_film",
+            "SCAN TABLE films_film": "films_film",
+            "SCAN films_film USING INDEX film_name_idx": None,
+            "SCAN TABLE films_film USING COVERING INDEX film_name_idx": None,
+            "SEARCH films_film USING INTEGER PRIMARY KEY (rowid=?)": None,
+            "USE TEMP B-TREE FOR ORDER BY": None,
+        }
+        for line, table in lines.items():
+            match = audit_queries.FULL_SCAN.search(line)
+            self.assertEqual(match and match.group(1), table, line)
+
+    def test_command(self):
+        country = Country.objects.create(name="Страна")
+        person = Person.objects.create(name="Персона")
+        Film.objects.create(name="Фильм", country=country, director=person)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            call_command("audit_queries")
+        self.assertIn("OK", output.getvalue())
+        command = audit_queries.Command()
+        command.min_rows = 1
+        command.sizes = {}
+        command.tables = set(connection.introspection.table_names())
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            self.assertTrue(command.audit(
+                "/", 'SELECT * FROM "films_film" ORDER BY "description"'))
+            self.assertFalse(command.audit(
+                "/", 'SELECT * FROM "films_film" ORDER BY "name", "id"'))
+        self.assertIn("SCAN films_film", output.getvalue())
+
+
+class CatalogTest(TransactionTestCase):
+    """A seed produces the same catalog whenever it is generated."""
+
+    models = [Country, Genre, Person, Film, Film.genres.through,
+              Film.people.through, get_user_model(), Post, Section, Comment]
+
+    def generate(self, seed):
+        CatalogGenerator(50, seed=seed, posts=3, comments=4,
+                         verbose=False).run()
+        rows = {model: list(model.objects.order_by("pk").values_list())
+                for model in self.models}
+        for model in reversed(self.models):
+            model.objects.all().delete()
+        return rows
+
+    def test_seed(self):
+        catalog = self.generate(1)
+        self.assertEqual(len(catalog[Film]), 50)
+        self.assertEqual(len(catalog[Comment]), 12)
+        later = timezone.now() + timedelta(days=400)
+        with mock.patch("django.utils.timezone.now", return_value=later):
+            self.assertEqual(self.generate(1), catalog)
+        self.assertNotEqual(self.generate(2)[Film], catalog[Film])
+
+
+def manage(*args, **environ):
+    """Runs a management command in a new process, with ``environ`` added
+    to the environment, for commands that set up databases of their own or
+    need one shared between threads."""
+    return subprocess.run([sys.executable, "manage.py", *args],
+                          cwd=settings.BASE_DIR, capture_output=True,
+                          text=True, timeout=300,
+                          env={**os.environ, **environ})
+
+
+class BenchTest(SimpleTestCase):
+    """bench times every route and the import on a small catalog and
+    flags regressions against a baseline."""
+
+    def test_smoke(self):
+        tempdir = self.enterContext(tempfile.TemporaryDirectory())
+        output = os.path.join(tempdir, "bench.json")
+        args = ["bench", "--films", "30", "--repeat", "2",
+                "--import-films", "5", "--output", output,
+                "--database", os.path.join(tempdir, "bench.sqlite3")]
+        run = manage(*args)
+        self.assertEqual(run.returncode, 0, run.stderr)
+        with open(output, encoding="utf-8") as f:
+            report = json.load(f)
+        self.assertEqual(report["meta"]["films"], 30)
+        results = report["results"]
+        for name in ["film_list", "film_detail", "import_films",
+                     "import_films --incremental"]:
+            self.assertGreater(results[name]["queries"], 0, name)
+        # A baseline with fewer queries makes the command fail.
+        baseline = os.path.join(tempdir, "baseline.json")
+        results["film_list"]["queries"] = 0
+        with open(baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f)
+        run = manage(*args, "--compare", baseline, "--threshold", "1000")
+        self.assertNotEqual(run.returncode, 0)
+        self.assertIn("film_list: 0 ->", run.stderr)
+        self.assertNotIn("p95", run.stderr)
+
+
+def seed_database(test, directory):
+    """Path of a new SQLite file in ``directory`` holding a small seeded
+    catalog."""
+    path = os.path.join(directory, "db.sqlite3")
+    for args in [["migrate", "-v0"],
+                 ["seed_catalog", "--films", "200", "--posts", "5",
+                  "--comments", "2"]]:
+        run = manage(*args, DATABASE_PATH=path)
+        test.assertEqual(run.returncode, 0, run.stderr)
+    return path
+
+
+class LoadTestTest(SimpleTestCase):
+    """loadtest drives the WSGI application from threads and the ASGI one
+    from asyncio tasks, without failed requests."""
+
+    def test_smoke(self):
+        tempdir = self.enterContext(tempfile.TemporaryDirectory())
+        environ = {"DATABASE_PATH": seed_database(self, tempdir),
+                   "DATABASE_PROFILE": "production"}
+        for mode in ["threads", "asyncio"]:
+            with self.subTest(mode=mode):
+                output = os.path.join(tempdir, f"{mode}.json")
+                run = manage("loadtest", "--mode", mode, "--concurrency",
+                             "2", "--duration", "1", "--output", output,
+                             "--mix", ",".join(f"{name}=1" for name in MIX),
+                             **environ)
+                self.assertEqual(run.returncode, 0, run.stderr)
+                with open(output, encoding="utf-8") as f:
+                    report = json.load(f)
+                self.assertEqual(report["mode"], mode)
+                self.assertEqual(set(report["scenarios"]), set(MIX))
+                self.assertEqual(set(report["statuses"]), {"200", "302"})
+                self.assertEqual(report["exceptions"], {})
+
+
+class BenchDatabaseTest(SimpleTestCase):
+    """bench_database runs loadtest on a copy of the database for every
+    profile and mix."""
+
+    def test_smoke(self):
+        tempdir = self.enterContext(tempfile.TemporaryDirectory())
+        path = seed_database(self, tempdir)
+        with open(path, "rb") as f:
+            before = f.read()
+        output = os.path.join(tempdir, "profiles.json")
+        run = manage("bench_database", "--duration", "0.5",
+                     "--concurrency", "2", "--output", output,
+                     DATABASE_PATH=path)
+        self.assertEqual(run.returncode, 0, run.stderr)
+        with open(output, encoding="utf-8") as f:
+            results = json.load(f)
+        self.assertEqual(set(results), {"read-heavy", "write-heavy"})
+        for by_profile in results.values():
+            self.assertEqual(set(by_profile), {"development", "production"})
+            for profile, result in by_profile.items():
+                self.assertGreater(result["throughput_rps"], 0, profile)
+            self.assertEqual(by_profile["production"]["database_locked"], 0)
+        self.assertIn("production", run.stdout)
+        # The runs write to copies only.
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), before)
+
+
+def movie(id, name, genres, actors, country="Россия", director=1):
+    """A movie of api.kinopoisk.dev as written by get_films."""
+    return {
+        "id": id, "name": name, "enName": None, "slogan": None,
+        "movieLength": 90, "description": "", "year": 2000,
+        "countries": [{"name": country}],
+        "genres": [{"name": genre} for genre in genres],
+        "persons": [{"id": director, "name": f"Режиссёр {director}",
+                     "enName": None, "profession": "режиссеры"}] + [
+            {"id": actor, "name": f"Актёр {actor}", "enName": None,
+             "profession": "актеры"} for actor in actors],
+    }
+
+
+class BulkImporterTest(TestCase):
+    """Imports upsert rows by kinopoisk_id and replace memberships."""
+
+    def run_import(self, movies, **kwargs):
+        importer = BulkImporter(chunk_size=2, **kwargs)
+        with contextlib.redirect_stdout(io.StringIO()):
+            for data in movies:
+                importer.add(data)
+            importer.finish()
+
+    def members(self, kinopoisk_id):
+        film = Film.objects.get(kinopoisk_id=kinopoisk_id)
+        return (sorted(film.genres.values_list("name", flat=True)),
+                sorted(film.people.values_list("kinopoisk_id", flat=True)))
+
+    def test_read_films(self):
+        movies = [movie(1, "Первый", ["драма"], [11]),
+                  movie(2, "Второй", ["комедия"], [12])]
+        lines = [json.dumps(data, ensure_ascii=False) for data in movies]
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        path = os.path.join(directory, "films.json")
+        for name, text in [
+                ("jsonl", "\n" + "\n\n".join(lines) + "\n\n"),
+                ("document", json.dumps({"docs": movies})),
+                ("indented", "\n  " + json.dumps({"docs": movies},
+                                                  indent=2))]:
+            with self.subTest(name):
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(text)
+                self.assertEqual(list(read_films(path)), movies)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n \n")
+        self.assertEqual(list(read_films(path)), [])
+
+    def test_upsert(self):
+        movies = [movie(1, "Первый", ["драма"], [11, 12]),
+                  movie(2, "Второй", ["драма", "комедия"], [12]),
+                  movie(3, "Третий", ["комедия"], [13], director=2)]
+        self.run_import(movies)
+        pks = dict(Film.objects.values_list("kinopoisk_id", "pk"))
+        self.assertEqual(Person.objects.count(), 5)
+        self.assertEqual(self.members(2), (["драма", "комедия"], [12]))
+        # A second import updates the same rows and replaces the genres
+        # and actors of the films it brings.
+        movies[1] = movie(2, "Второй (новый)", ["мелодрама"], [11, 14],
+                          country="Франция")
+        self.run_import(movies[1:])
+        self.assertEqual(dict(Film.objects.values_list("kinopoisk_id", "pk")),
+                         pks)
+        film = Film.objects.get(kinopoisk_id=2)
+        self.assertEqual((film.name, film.country.name),
+                         ("Второй (новый)", "Франция"))
+        self.assertEqual(self.members(2), (["мелодрама"], [11, 14]))
+        self.assertEqual(self.members(1), (["драма"], [11, 12]))
+        self.assertEqual(Person.objects.count(), 6)
+        self.assertEqual(Genre.objects.count(), 3)
+
+    def test_incremental(self):
+        movies = [movie(1, "Первый", ["драма"], [11]),
+                  movie(2, "Второй", ["драма"], [12])]
+        self.run_import(movies)
+        Film.objects.update(updated_at=timezone.now() - timedelta(days=1))
+        before = dict(Film.objects.values_list("kinopoisk_id", "updated_at"))
+        movies[1]["name"] = "Второй (новый)"
+        self.run_import(movies, incremental=True)
+        after = dict(Film.objects.values_list("kinopoisk_id", "updated_at"))
+        # Unchanged films are skipped and keep their updated_at.
+        self.assertEqual(after[1], before[1])
+        self.assertGreater(after[2], before[2])
+        self.assertEqual(Film.objects.get(kinopoisk_id=2).name,
+                         "Второй (новый)")
+
+
+class KinopoiskServer(BaseHTTPRequestHandler):
+    """api.kinopoisk.dev with one page of movies and one of birthdays,
+    the latter failing while ``down``."""
+
+    protocol_version = "HTTP/1.1"
+    down = False
+
+    def do_GET(self):
+        path = urllib.parse.urlsplit(self.path).path
+        if path == "/v1.4/person" and self.down:
+            status, body = 500, b""
+        else:
+            docs = [movie(1, "Первый", ["драма"], [11])] \
+                if path == "/v1.4/movie" \
+                else [{"id": 11, "birthday": "1970-01-02T00:00:00.000Z"}]
+            status, body = 200, json.dumps(
+                {"docs": docs, "pages": 1}).encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SyncTest(TestCase):
+    """Incremental syncs fetch films changed since the last one, and
+    import only films and rows that changed."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "films.jsonl")
+        sync_path = os.path.join(directory.name, "sync.json")
+        self.enterContext(mock.patch.object(
+            get_films.Command, "filename", staticmethod(lambda: path)))
+        self.enterContext(mock.patch.object(
+            get_films.Command, "sync_filename",
+            staticmethod(lambda: sync_path)))
+        self.path, self.sync_path = path, sync_path
+
+    def get_films(self, url, now):
+        with mock.patch.object(get_films.timezone, "now",
+                               return_value=now), \
+                contextlib.redirect_stdout(io.StringIO()):
+            call_command("get_films", base_url=url, retries=0, workers=1)
+
+    def test_resumed_sync_keeps_first_start(self):
+        first = timezone.now() - timedelta(hours=1)
+        with serve(KinopoiskServer) as url:
+            KinopoiskServer.down = True
+            with self.assertRaises(requests.RequestException):
+                self.get_films(url, first)
+            KinopoiskServer.down = False
+            self.get_films(url, timezone.now())
+        with open(self.sync_path, encoding="utf-8") as f:
+            self.assertEqual(json.load(f), {"last_sync": first.isoformat()})
+        self.assertFalse(os.path.exists(self.path + ".checkpoint"))
+        films = list(read_films(self.path))
+        self.assertEqual([film["id"] for film in films], [1])
+        self.assertEqual(films[0]["persons"][1]["birthday"],
+                         "1970-01-02T00:00:00.000Z")
+
+    def test_changes(self):
+        data = movie(1, "Первый", ["драма"], [11])
+        self.assertEqual(fingerprint(data), fingerprint(json.loads(
+            json.dumps(data))))
+        self.assertNotEqual(fingerprint(data),
+                            fingerprint({**data, "year": 2001}))
+        country = Country.objects.create(name="Страна")
+        person = Person.objects.create(name="Персона")
+        film = Film.objects.create(name="Фильм", year=2000, country=country,
+                                   director=person, kinopoisk_id=1)
+        # Values are compared after conversion to the field type.
+        self.assertEqual(differs(Film, film, {"name": "Фильм",
+                                              "year": "2000"}), [])
+        self.assertEqual(differs(Film, {"name": "Фильм", "year": 2000},
+                                 {"name": "Другой", "year": 2000}),
+                         ["name"])
+        Film.objects.update(updated_at=timezone.now() - timedelta(days=1))
+        updated_at = Film.objects.get().updated_at
+        update_changed(Film, {"name": "Фильм", "year": 2000},
+                       kinopoisk_id=1)
+        self.assertEqual(Film.objects.get().updated_at, updated_at)
+        update_changed(Film, {"name": "Фильм", "year": 2001},
+                       kinopoisk_id=1)
+        film = Film.objects.get()
+        self.assertEqual(film.year, 2001)
+        self.assertGreater(film.updated_at, updated_at)
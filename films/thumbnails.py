@@ -0,0 +1,127 @@
+import io
+import posixpath
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageFilter, ImageOps
+
+# Image fields that get derivatives, by model name.
+IMAGE_FIELDS = {"film": "cover", "person": "photo", "post": "icon"}
+
+FORMATS = {"webp": "WEBP", "jpeg": "JPEG"}
+PLACEHOLDER_WIDTH = 16
+PLACEHOLDER_BLUR = 1
+
+
+def widths():
+    return tuple(getattr(settings, "THUMBNAIL_WIDTHS", (160, 320, 640)))
+
+
+def quality():
+    return getattr(settings, "THUMBNAIL_QUALITY", 80)
+
+
+def derivative_name(name, width, fmt):
+    """``covers/a.jpg`` -> ``thumbs/covers/a/320.webp``."""
+    root, _ = posixpath.splitext(name)
+    return f"thumbs/{root}/{width}.{fmt}"
+
+
+def placeholder_name(name):
+    return derivative_name(name, "placeholder", "jpeg")
+
+
+def has_derivatives(name, storage=default_storage):
+    # The placeholder is written last, so it marks a complete set.
+    return storage.exists(placeholder_name(name))
+
+
+def derivative_widths(name, storage=default_storage):
+    """Widths of the copies of ``name``, smallest first, read with one
+    listing of their directory; None until the set is complete."""
+    directory = posixpath.dirname(placeholder_name(name))
+    try:
+        _, files = storage.listdir(directory)
+    except FileNotFoundError:
+        return None
+    if posixpath.basename(placeholder_name(name)) not in files:
+        return None
+    return sorted(int(root) for root, ext in map(posixpath.splitext, files)
+                  if ext == ".jpeg" and root.isdigit())
+
+
+def target_widths(width):
+    """Widths of ``THUMBNAIL_WIDTHS`` below ``width``, then ``width``
+    itself in place of the larger ones: images are never upscaled."""
+    targets = [target for target in widths() if target < width]
+    return targets + [min(width, max(widths()))]
+
+
+def flatten(image):
+    if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def resize(image, width):
+    if image.width <= width:
+        return image
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.Resampling.LANCZOS)
+
+
+def write(storage, name, image, fmt, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, FORMATS[fmt], **options)
+    if storage.exists(name):
+        storage.delete(name)
+    storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def generate(name, force=False, storage=default_storage):
+    """Writes WebP and JPEG copies of the image ``name`` for every width
+    of ``THUMBNAIL_WIDTHS`` plus a tiny blurred placeholder. Images are
+    never upscaled, so a small original gets one copy at its own size in
+    place of the widths above it.
+
+    Returns False if the derivatives already exist or the file is not a
+    readable image.
+    """
+    if not name or not force and has_derivatives(name, storage):
+        return False
+    try:
+        with storage.open(name) as fp, Image.open(fp) as original:
+            original = ImageOps.exif_transpose(original)
+            original.load()
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return False
+    # Copies of an earlier original may have other widths.
+    directory = posixpath.dirname(placeholder_name(name))
+    if storage.exists(directory):
+        for file in storage.listdir(directory)[1]:
+            storage.delete(posixpath.join(directory, file))
+    alpha = original.mode in ("RGBA", "LA") \
+        or "transparency" in original.info
+    rgb = flatten(original)
+    webp = original.convert("RGBA") if alpha else rgb
+    for width in target_widths(original.width):
+        write(storage, derivative_name(name, width, "webp"),
+              resize(webp, width), "webp", quality=quality())
+        write(storage, derivative_name(name, width, "jpeg"),
+              resize(rgb, width), "jpeg", quality=quality(), optimize=True,
+              progressive=True)
+    placeholder = resize(rgb, PLACEHOLDER_WIDTH).filter(
+        ImageFilter.GaussianBlur(PLACEHOLDER_BLUR))
+    write(storage, placeholder_name(name), placeholder, "jpeg", quality=50)
+    return True
+
+
+def generate_for(instance, force=False):
+    field = IMAGE_FIELDS.get(instance._meta.model_name)
+    image = getattr(instance, field, None) if field else None
+    if not image:
+        return False
+    return generate(image.name, force=force, storage=image.storage)
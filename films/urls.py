@@ -1,10 +1,14 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import api, async_views, views
+
+# Under ASGI the read-heavy pages are served by async views.
+read_views = async_views if settings.ASYNC_VIEWS else views
 
 app_name = "films"
 urlpatterns = [
-     path('', views.film_list, name='home'),
-     path('countries/', views.country_list, name='country_list'),
+     path('', read_views.film_list, name='home'),
+     path('countries/', read_views.country_list, name='country_list'),
      path('countries/<int:id>/', views.country_detail, name='country_detail'),
      path('countries/create/', views.country_create, name='country_create'),
      path('countries/<int:id>/update/',
@@ -12,9 +16,9 @@ urlpatterns = [
      path('countries/<int:id>/delete/',
           views.country_delete, name='country_delete'),
      path('countries/autocomplete/',
-          views.CountryAutocomplete.as_view(), name='country_autocomplete'),
+          read_views.country_autocomplete, name='country_autocomplete'),
 
-     path('genres/', views.genre_list, name='genre_list'),
+     path('genres/', read_views.genre_list, name='genre_list'),
      path('genres/<int:id>/', views.genre_detail, name='genre_detail'),
      path('genres/create/', views.genre_create, name='genre_create'),
      path('genres/<int:id>/update/',
@@ -22,25 +26,25 @@ urlpatterns = [
      path('genres/<int:id>/delete/',
           views.genre_delete, name='genre_delete'),
 
-     path('films/', views.film_list, name='film_list'),
-     path('films/<int:id>/', views.film_detail, name='film_detail'),
+     path('films/', read_views.film_list, name='film_list'),
+     path('films/<int:id>/', read_views.film_detail, name='film_detail'),
      path('films/create/', views.film_create, name='film_create'),
      path('films/<int:id>/update/',
           views.film_update, name='film_update'),
      path('film/<int:id>/delete/',
           views.film_delete, name='film_delete'),
 
-     path('people/', views.person_list, name='person_list'),
-     path('people/<int:id>/', views.person_detail, name='person_detail'),
+     path('people/', read_views.person_list, name='person_list'),
+     path('people/<int:id>/', read_views.person_detail, name='person_detail'),
      path('people/create/', views.person_create, name='person_create'),
      path('people/<int:id>/update/',
           views.person_update, name='person_update'),
      path('people/<int:id>/delete/',
           views.person_delete, name='person_delete'),
      path('people/autocomplete/',
-          views.PersonAutocomplete.as_view(), name='person_autocomplete'),
+          read_views.person_autocomplete, name='person_autocomplete'),
 
-     path('posts/', views.post_list, name='post_list'),
+     path('posts/', read_views.post_list, name='post_list'),
      path('posts/<int:id>/', views.post_detail, name='post_detail'),
      path('posts/<int:id>/update/',
           views.post_update, name='post_update'),
@@ -49,4 +53,18 @@ urlpatterns = [
      path('post/create/', views.post_create, name='post_create'),
      path('posts/<int:post_id>/comment/<int:comment_id>/delete/', views.comment_delete, name='comment_delete'),
      path('posts/<int:post_id>/comment/<int:comment_id>/update/', views.comment_update, name='comment_update'),
+
+     path('api/films/', api.films.list, name='film_api_list'),
+     path('api/films/<int:id>/', api.films.detail, name='film_api_detail'),
+     path('api/people/', api.people.list, name='person_api_list'),
+     path('api/people/<int:id>/',
+          api.people.detail, name='person_api_detail'),
+     path('api/genres/', api.genres.list, name='genre_api_list'),
+     path('api/genres/<int:id>/',
+          api.genres.detail, name='genre_api_detail'),
+     path('api/countries/', api.countries.list, name='country_api_list'),
+     path('api/countries/<int:id>/',
+          api.countries.detail, name='country_api_detail'),
+     path('api/posts/', api.posts.list, name='post_api_list'),
+     path('api/posts/<int:id>/', api.posts.detail, name='post_api_detail'),
 ]
@@ -1,9 +1,16 @@
 from dal import autocomplete
+from django.db.models import Prefetch
 from django.shortcuts import get_object_or_404, redirect, render
 from django.contrib.auth.decorators import user_passes_test
 from .models import Country, Film, Genre, Person, Post, Section, Comment
 from .forms import CountryForm, GenreForm, FilmForm, PersonForm, PostForm, CreateSectionFormSet, UpdateSectionFormSet, CommentForm
-from .helpers import paginate
+from .helpers import paginate, sort
+from .pagecache import cache_page, list_tag, tag
+from . import conditional
+from .autocomplete import country_index, person_index
+from .facets import film_facets, parse_filters
+from .search import search
+from .similar import similar
 from django.contrib import messages
 
 def check_admin(user):
@@ -13,16 +20,20 @@ def check_authenticity(user):
     return user.is_authenticated
 
 
+@conditional.conditional(conditional.country_list)
 def country_list(request):
-    countries = Country.objects.all()
+    countries = sort(request, Country.objects.all(), ["-film_count", "name"])
     return render(request, 'films/country/list.html', {'countries': countries})
 
 
+@cache_page
+@conditional.conditional(conditional.country_detail)
 def country_detail(request, id):
     country = get_object_or_404(Country, id=id)
     films = Film.objects.filter(country=country)
 
     films = paginate(request, films)
+    tag(request, country, list_tag(Film, country), *films)
     return render(request, 'films/country/detail.html',
                   {'country': country, 'films': films})
 
@@ -66,16 +77,20 @@ def country_delete(request, id):
                   {'country': country})
 
 
+@conditional.conditional(conditional.genre_list)
 def genre_list(request):
-    genres = Genre.objects.all()
+    genres = sort(request, Genre.objects.all(), ["-film_count", "name"])
     return render(request, 'films/genre/list.html', {'genres': genres})
 
 
+@cache_page
+@conditional.conditional(conditional.genre_detail)
 def genre_detail(request, id):
     genre = get_object_or_404(Genre, id=id)
     films = Film.objects.filter(genres=genre)
 
     films = paginate(request, films)
+    tag(request, genre, list_tag(Film, genre), *films)
     return render(request, 'films/genre/detail.html',
                   {'genre': genre, 'films': films})
 
@@ -119,22 +134,36 @@ def genre_delete(request, id):
                   {'genre': genre})
 
 
+@cache_page
+@conditional.conditional(conditional.film_list)
 def film_list(request):
     films = Film.objects.all()
     query = request.GET.get('query', '')
     if query:
-        films = films.filter(name__icontains=query)
+        films = search(films, query)
+    filters = parse_filters(request.GET)
+    matches, facets = film_facets.query(filters, query)
+    if filters:
+        films = matches
     films = paginate(request, films)
-    return render(request, 'films/film/list.html', {'films': films,
-                                                    'query': query})
+    tag(request, list_tag(Film), list_tag(Genre), list_tag(Country), *films)
+    directors = Person.objects.filter(pk__in=filters.get("director", ()))
+    return render(request, 'films/film/list.html', {
+        'films': films, 'query': query, 'facets': facets,
+        'filters': filters, 'directors': directors})
 
 
+@cache_page
+@conditional.conditional(conditional.film_detail)
 def film_detail(request, id):
-    queryset = Film.objects.prefetch_related("country", "genres", "director",
-                                             "people")
+    queryset = Film.objects.select_related("country", "director") \
+        .prefetch_related("genres", "people")
     film = get_object_or_404(queryset, id=id)
+    similar_films = list(similar(film.id))
+    tag(request, film, film.country, film.director, *film.genres.all(),
+        *film.people.all(), *similar_films)
     return render(request, 'films/film/detail.html',
-                  {'film': film})
+                  {'film': film, 'similar_films': similar_films})
 
 
 @user_passes_test(check_admin)
@@ -176,19 +205,26 @@ def film_delete(request, id):
                   {'film': film})
 
 
+@conditional.conditional(conditional.person_list)
 def person_list(request):
     people = Person.objects.all()
     query = request.GET.get('query', '')
     if query:
-        people = people.filter(name__icontains=query)
+        people = search(people, query)
+    else:
+        people = sort(request, people, ["-film_count", "name", "id"])
     people = paginate(request, people)
     return render(request, 'films/person/list.html', {'people': people,
                                                       'query': query})
 
 
+@cache_page
+@conditional.conditional(conditional.person_detail)
 def person_detail(request, id):
     queryset = Person.objects.prefetch_related("film_set", "directed_films")
     person = get_object_or_404(queryset, id=id)
+    tag(request, person, list_tag(Film, person), *person.film_set.all(),
+        *person.directed_films.all())
     return render(request, 'films/person/detail.html',
                   {'person': person})
 
@@ -231,31 +267,37 @@ def person_delete(request, id):
     return render(request, 'films/person/delete.html',
                   {'person': person})
 
+@conditional.conditional(conditional.post_list)
 def post_list(request):
     posts = Post.objects.all()
     query = request.GET.get('query', '')
     if query:
-        posts = posts.filter(name__icontains=query)
+        posts = search(posts, query)
     posts = paginate(request, posts)
     return render(request, 'films/post/list.html', {'posts': posts,
                                                       'query': query})
 
+@conditional.conditional(conditional.post_detail)
 def post_detail(request, id):
-    queryset = Post.objects.all()
-    post = get_object_or_404(queryset, id=id)
     if request.method == 'POST':
+        post = get_object_or_404(Post, id=id)
         form = CommentForm(request.POST, request.FILES, author=request.user, post=post)
         if form.is_valid():
             form.save()
             messages.success(request, 'Комментарий добавлен')
+            return redirect('films:post_detail', id=post.id)
+    comments = Comment.objects.select_related("author")
+    queryset = Post.objects.select_related("author").prefetch_related(
+        "sections", Prefetch("comments", queryset=comments))
+    post = get_object_or_404(queryset, id=id)
     form = CommentForm()
     return render(request, 'films/post/detail.html',
                   {'post': post, 'form':form})
 
 @user_passes_test(check_authenticity)
 def post_update(request, id):
-    post = get_object_or_404(Post, id=id)
-    if not request.user.is_superuser and post.author != request.user:
+    post = get_object_or_404(Post.objects.select_related("author"), id=id)
+    if not request.user.is_superuser and post.author_id != request.user.id:
         messages.warning(request, 'Вы не можете редактировать пост чужого авторства')
         return redirect('films:post_detail', id=post.id)
     if request.method == 'POST':
@@ -292,7 +334,7 @@ def post_create(request):
 @user_passes_test(check_authenticity)
 def post_delete(request, id):
     post = get_object_or_404(Post, id=id)
-    if not request.user.is_superuser and post.author != request.user:
+    if not request.user.is_superuser and post.author_id != request.user.id:
         messages.warning(request, 'Вы не можете удалить пост чужого авторства')
         return redirect('films:post_detail', id=post.id)
     if request.method == 'POST':
@@ -304,8 +346,9 @@ def post_delete(request, id):
 
 @user_passes_test(check_authenticity)
 def comment_update(request, post_id, comment_id):
-    comment = get_object_or_404(Comment, id=comment_id)
-    if not request.user.is_superuser and comment.author != request.user:
+    comment = get_object_or_404(
+        Comment.objects.select_related("author", "post"), id=comment_id)
+    if not request.user.is_superuser and comment.author_id != request.user.id:
         messages.warning(request, 'Вы не можете редактировать чужой комментарий')
         return redirect('films:post_detail', id=post_id)
     if request.method == 'POST':
@@ -322,8 +365,9 @@ def comment_update(request, post_id, comment_id):
 
 @user_passes_test(check_authenticity)
 def comment_delete(request, post_id, comment_id):
-    comment = get_object_or_404(Comment, id=comment_id)
-    if not request.user.is_superuser and comment.author != request.user:
+    comment = get_object_or_404(Comment.objects.select_related("post"),
+                                id=comment_id)
+    if not request.user.is_superuser and comment.author_id != request.user.id:
         messages.warning(request, 'Вы не можете удалить комментарий чужого авторства')
         return redirect('films:post_detail', id=post_id)
     if request.method == 'POST':
@@ -336,15 +380,15 @@ def comment_delete(request, post_id, comment_id):
 
 class PersonAutocomplete(autocomplete.Select2QuerySetView):
     def get_queryset(self):
-        people = Person.objects.all()
-        if self.q:
-            people = people.filter(name__istartswith=self.q)
-        return people
+        return [Person(pk=pk, name=name)
+                for pk, name in person_index.search(self.q)]
 
 
 class CountryAutocomplete(autocomplete.Select2QuerySetView):
     def get_queryset(self):
-        countries = Country.objects.all()
-        if self.q:
-            countries = countries.filter(name__istartswith=self.q)
-        return countries
+        return [Country(pk=pk, name=name)
+                for pk, name in country_index.search(self.q)]
+
+
+person_autocomplete = PersonAutocomplete.as_view()
+country_autocomplete = CountryAutocomplete.as_view()